@@ -0,0 +1,327 @@
+"""Bitmap index.
+
+Meant for columns with a handful of distinct values - flags, status codes
+and the like. For each distinct value the index keeps a bitmap with a bit
+set at the row map position of every row holding that value. All the
+bitmap indexes of a table share the table's row map, so bitmaps from
+different columns can be combined with plain AND/OR/NOT.
+
+In memory, the bitmaps are python ints. On disk, each bitmap is cut into
+segments of 64K rows, each zlib compressed in its own file, so a change
+only rewrites the segment it falls in. New rows always get the highest
+position, so inserts only ever touch the last segment.
+
+Files :
+- values - the list of (value id, key) pairs.
+- v{value id}.{segment} - a compressed bitmap segment.
+"""
+from pathlib import Path
+from typing import Any, Callable, Generator, Iterable, Tuple, cast
+import zlib
+
+from .globals import DBContext
+from .index import BaseIndex, OPERATOR_MAP
+from .lib import packer
+from .lib import expr_nodes as node
+from .lib.rowmap import RowMap, iter_bits
+from .lib.types.value import Value, v_isnull, v_not
+
+import logging
+logger = logging.getLogger(__name__)
+
+_SEGMENT_BITS = 1 << 16
+_SEGMENT_MASK = (1 << _SEGMENT_BITS) - 1
+
+
+class BitmapIndex(BaseIndex) :
+    kind = "bitmap"
+    ordered = False
+
+    def __init__(self, index_name : str, path : Path,
+                 column : str | None, coltype : str, db_ctx : DBContext, *,
+                 unique : bool = False, nullable : bool = True,
+                 bloom : bool = False, expr : str | None = None,
+                 where : str | None = None, rowmap : RowMap | None = None) :
+        super().__init__(index_name, path, column, coltype, db_ctx,
+                         unique=unique, nullable=nullable)
+        if bloom :
+            # The distinct values are already all in memory.
+            raise ValueError(f"Bitmap index {index_name} does not take a bloom filter.")
+        if expr is not None :
+            # Filters are matched to bitmaps by column name only.
+            raise ValueError(f"Bitmap index {index_name} cannot be on an expression.")
+        if where is not None :
+            # The false bitmaps are worked out from every row in the table.
+            raise ValueError(f"Bitmap index {index_name} cannot be partial.")
+        if rowmap is None :
+            raise ValueError(f"Bitmap index {index_name} needs the table row map.")
+        self.rowmap = rowmap
+
+        # All keyed by the raw bytes of the key value.
+        self.bitmaps : dict[bytes, int] = {}
+        self.value_ids : dict[bytes, int] = {}
+        self.keys : dict[bytes, Value] = {}
+
+    def _write_values(self) :
+        data = [[self.value_ids[raw], self.keys[raw]] for raw in self.value_ids]
+        (self.path / "values").write_bytes(packer.pack(data))
+
+    def _write_segment(self, raw : bytes, segment : int) :
+        bits = (self.bitmaps[raw] >> (segment * _SEGMENT_BITS)) & _SEGMENT_MASK
+        data = zlib.compress(bits.to_bytes((bits.bit_length() + 7) // 8, "little"))
+        (self.path / f"v{self.value_ids[raw]}.{segment}").write_bytes(data)
+
+    def _add_value(self, key : Value) -> bytes :
+        raw = key.raw
+        if raw not in self.value_ids :
+            self.value_ids[raw] = len(self.value_ids) + 1
+            self.keys[raw] = key
+            self.bitmaps[raw] = 0
+            self._write_values()
+        return raw
+
+    def _load_bitmaps(self) :
+        values_path = self.path / "values"
+        if not values_path.exists() :
+            return
+        for value_id, key in packer.unpack(values_path.read_bytes()) :
+            raw = key.raw
+            self.value_ids[raw] = value_id
+            self.keys[raw] = key
+            bitmap = 0
+            for seg_path in self.path.glob(f"v{value_id}.*") :
+                segment = int(seg_path.suffix[1:])
+                bits = int.from_bytes(zlib.decompress(seg_path.read_bytes()), "little")
+                bitmap |= bits << (segment * _SEGMENT_BITS)
+            self.bitmaps[raw] = bitmap
+
+    def _position(self, heap_id : int) -> int :
+        pos = self.rowmap.position(heap_id)
+        if pos is None :
+            raise ValueError(f"Row {heap_id:016X} is not in the row map for index {self.index_name}")
+        return pos
+
+    def _iter_keys(self) -> Iterable[Value] :
+        live = self.rowmap.live
+        return (self.keys[raw] for raw, bitmap in self.bitmaps.items() if bitmap & live)
+
+    #################################################################
+    def _create(self, iterator) :
+        self._create_storage()
+
+        records = self._collect_records(iterator)
+        for r in records :
+            raw = r.key.raw
+            if raw not in self.value_ids :
+                self.value_ids[raw] = len(self.value_ids) + 1
+                self.keys[raw] = r.key
+                self.bitmaps[raw] = 0
+            self.bitmaps[raw] |= 1 << self._position(r.heap_id)
+
+        self._write_values()
+        for raw, bitmap in self.bitmaps.items() :
+            for segment in range((bitmap.bit_length() + _SEGMENT_BITS - 1) // _SEGMENT_BITS) :
+                self._write_segment(raw, segment)
+
+        logger.debug(f"Created bitmap index {self.index_name} with {len(self.bitmaps)} values for {len(records)} records")
+
+    @classmethod
+    def _load(cls, path : Path, db_ctx : DBContext, config : dict[str, Any] | None = None, **kwargs) :
+        index = cast(BitmapIndex, super()._load(path, db_ctx, config, **kwargs))
+        index._load_bitmaps()
+        return index
+
+    #################################################################
+    # Public API
+    #################################################################
+
+    @property
+    def live(self) -> int :
+        """Bitmap of every row in the table."""
+        return self.rowmap.live
+
+    def bitmap(self, key : Any) -> int :
+        """Bitmap of the rows whose key equals `key`. Pass None for the null rows."""
+        return self.bitmaps.get(self._gen_value(key).raw, 0) & self.rowmap.live
+
+    def heap_ids(self, bitmap : int) -> Generator[int, Any, None] :
+        for heap_id in self.rowmap.heap_ids(bitmap) :
+            yield heap_id
+
+    def test_for_insert(self, record : dict[str, Value]) -> Tuple[bool, str] :
+        """Method to check if the record meets the index constraints.
+        This must be called before insert() on the record.
+        """
+        self._check_writable()
+
+        key = self._key(record)
+
+        if not self.nullable and key.is_null :
+            return False, f"Null key in non-nullable index {self.index_name}"
+
+        if self.unique and self.bitmap(key) != 0 :
+            return False, f"Duplicate key '{key}' in unique index {self.index_name}"
+
+        return True, ""
+
+    def insert(self, obj : dict[str, Any], heap_id : int) :
+        """Insert object into index.
+        The row must already be in the row map.
+        """
+        self._check_writable()
+
+        key : Value = self._key(obj)
+        if not self.nullable and key.is_null :
+            raise ValueError(f"Null key in non-nullable index {self.index_name}")
+
+        pos = self._position(heap_id)
+        raw = self._add_value(key)
+        self.bitmaps[raw] |= 1 << pos
+        self._write_segment(raw, pos // _SEGMENT_BITS)
+
+    def delete(self, row : dict[str, Value], heap_id : int | None = None) :
+        self._check_writable()
+
+        key = self._key(row)
+        bitmap = self.bitmap(key)
+        if heap_id is None :
+            pos = next(iter_bits(bitmap), None)
+        else :
+            pos = self.rowmap.position(heap_id)
+            if pos is not None and not bitmap & (1 << pos) :
+                pos = None
+
+        if pos is None :
+            raise ValueError(f"Key {key} not found in index {self.index_name}")
+
+        raw = key.raw
+        self.bitmaps[raw] &= ~(1 << pos)
+        self._write_segment(raw, pos // _SEGMENT_BITS)
+
+    def scan(self, key : Any = None, op : str | None = None,
+             upper_key : Any = None, upper_op : str | None = None,
+             reverse : bool = False) -> Generator[int, Any, None]:
+        """With no key, returns every heap id in row map order.
+        Otherwise `op` must be equality.
+        """
+        if self.closed :
+            raise ValueError(f"Index {self.index_name} is closed.")
+
+        if op is not None and op not in OPERATOR_MAP :
+            raise ValueError(f"Invalid operator {op}")
+
+        if key is None and op is not None :
+            raise ValueError("Cannot specify operator without key.")
+
+        self._check_upper_bound(None, upper_key, upper_op)
+        if reverse :
+            raise ValueError(f"Index {self.index_name} has no order to reverse.")
+
+        if key is None :
+            bitmap = 0
+            for b in self.bitmaps.values() :
+                bitmap |= b
+            yield from self.heap_ids(bitmap)
+            return
+
+        if op is not None and OPERATOR_MAP[op] != 'eq' :
+            raise ValueError(f"Bitmap index {self.index_name} only supports equality lookups.")
+
+        yield from self.heap_ids(self.bitmap(key))
+
+    def print_tree(self) :
+        """Output the distinct values and their row counts onto stdout.
+        """
+        if self.closed :
+            raise ValueError(f"Index {self.index_name} is closed.")
+
+        print(f"=== {self.index_name} Bitmaps:")
+        for raw, key in self.keys.items() :
+            print(f"  {key} (v{self.value_ids[raw]}) : {(self.bitmaps[raw] & self.rowmap.live).bit_count()} rows")
+        print("=== End of bitmaps")
+
+
+#################################################################
+# Filter evaluation
+#################################################################
+type BitmapLookup = Callable[[str], BitmapIndex | None]
+
+def _column_and_literal(expr : node.Operation) -> Tuple[node.ColumnName, node.Literal] | None :
+    if isinstance(expr.left, node.ColumnName) and isinstance(expr.right, node.Literal) :
+        return expr.left, expr.right
+    if isinstance(expr.right, node.ColumnName) and isinstance(expr.left, node.Literal) :
+        return expr.right, expr.left
+    return None
+
+def eval_filter(expr : node.ExprNode, lookup : BitmapLookup, live : int) -> Tuple[int, int] | None :
+    """Evaluate a filter expression using nothing but bitmap indexes.
+
+    Returns a pair of bitmaps - the rows where the expression is true and
+    the rows where it is false. Rows where it comes out null are in
+    neither. Keeping both is what lets NOT get nulls right.
+
+    Returns None if any part of the expression can't be answered from
+    bitmaps.
+    """
+    if isinstance(expr, node.Operation) :
+        if expr.name in ('v_and', 'v_or') :
+            left = eval_filter(expr.left, lookup, live)
+            if left is None :
+                return None
+            right = eval_filter(expr.right, lookup, live)
+            if right is None :
+                return None
+            left_true, left_false = left
+            right_true, right_false = right
+            # and/or are null if either side is null.
+            both_known = (left_true | left_false) & (right_true | right_false)
+            if expr.name == 'v_and' :
+                return left_true & right_true, both_known & (left_false | right_false)
+            else :
+                return both_known & (left_true | right_true), left_false & right_false
+
+        if expr.name in ('eq', 'ne') :
+            pair = _column_and_literal(expr)
+            if pair is None :
+                return None
+            column, literal = pair
+            index = lookup(column.name)
+            if index is None :
+                return None
+            key = literal.calc({})
+            if key.is_null :
+                return 0, 0
+            true = index.bitmap(key)
+            false = live & ~true & ~index.bitmap(None)
+            return (true, false) if expr.name == 'eq' else (false, true)
+
+    elif isinstance(expr, node.MonoOperation) :
+        if expr.op is v_not :
+            inner = eval_filter(expr.arg, lookup, live)
+            if inner is None :
+                return None
+            return inner[1], inner[0]
+
+        if expr.op is v_isnull and isinstance(expr.arg, node.ColumnName) :
+            index = lookup(expr.arg.name)
+            if index is None :
+                return None
+            true = index.bitmap(None)
+            return true, live & ~true
+
+    elif isinstance(expr, node.INStmt) :
+        if isinstance(expr.left, node.ColumnName) and all(isinstance(x, node.Literal) for x in expr.right) :
+            index = lookup(expr.left.name)
+            if index is None :
+                return None
+            true = 0
+            for x in expr.right :
+                true |= index.bitmap(x.calc({}))
+            return true, live & ~true
+
+    elif isinstance(expr, node.ColumnName) :
+        index = lookup(expr.name)
+        if index is not None and index.coltype == "bool" :
+            return index.bitmap(True), index.bitmap(False)
+
+    return None
@@ -1,6 +1,7 @@
 from typing import Iterable, Self
 from pathlib import Path
 import json
+import threading
 from dataclasses import asdict
 
 from .globals import ( CURRENT_SCHEMA_VERSION,
@@ -13,6 +14,9 @@ from .table import Table, FieldSpec
 
 from .int_id import IntegerIdGenerator
 from .lib.cache import LRUCache
+from .lib.shared_cache import SharedBlockCache, segment_name
+
+_WARM_MODES = (None, "sync", "background")
 
 _OPTIONS = {
     "pk" : bool,
@@ -36,12 +40,24 @@ class Database :
         self.mode = mode
         self.comment = comment
         self.options = options
+        self.warm_thread : threading.Thread | None = None
 
 
     #################################################################
     # Internal utilities
     #################################################################
+    def _make_cache(self) -> LRUCache :
+        shared = None
+        if self.options.index_shared_cache_bytes > 0 :
+            shared = SharedBlockCache(segment_name(self.db_path), self.options.index_shared_cache_bytes)
+        return LRUCache(self.options.index_cache_size, self.options.index_cache_policy,
+                        self.options.index_cache_bytes, self.options.index_cache_pin_internal,
+                        shared)
+
     def _create(self) :
+        # Build the cache first so bad options are caught before anything is written.
+        cache = self._make_cache()
+
         config = {
             "schema_version" : CURRENT_SCHEMA_VERSION,
             "gertrude_version" : GERTRUDE_VERSION,
@@ -53,13 +69,13 @@ class Database :
 
         self.id_gen = IntegerIdGenerator(self.db_path / "int_id")
         self.db_ctx = DBContext(self.db_path, self.mode,
-                                self.id_gen, LRUCache(self.options.index_cache_size), options=self.options)
+                                self.id_gen, cache, options=self.options)
 
 
     def _open(self) :
         self.id_gen = IntegerIdGenerator(self.db_path / "int_id")
         self.db_ctx = DBContext(self.db_path, self.mode,
-                                self.id_gen, LRUCache(100), options=self.options)
+                                self.id_gen, self._make_cache(), options=self.options)
 
         tables = self.db_path / "tables"
         if not tables.exists() :
@@ -95,9 +111,12 @@ class Database :
         return db
 
     @classmethod
-    def open(cls, db_path : Path | str, *, mode : str = "rw") -> Self:
+    def open(cls, db_path : Path | str, *, mode : str = "rw", warm : str | None = None) -> Self:
         db_path = Path(db_path)
 
+        if warm not in _WARM_MODES :
+            raise ValueError(f"Invalid warm mode {warm} - must be one of {', '.join(str(x) for x in _WARM_MODES)}")
+
         if not db_path.exists() :
             raise ValueError(f"Database {db_path} does not exist.")
         if not db_path.is_dir() :
@@ -109,6 +128,12 @@ class Database :
         db = cls(db_path, mode = mode, comment = config["comment"], options = DBOptions(**config["options"]))
         db._open()
 
+        if warm == "sync" :
+            db.warm_cache()
+        elif warm == "background" :
+            db.warm_thread = threading.Thread(target=db._background_warm, name=f"warm-{db_path.name}", daemon=True)
+            db.warm_thread.start()
+
         return db
 
     def add_table(self, name : str, spec : Iterable[FieldSpec]) -> Table :
@@ -141,7 +166,7 @@ class Database :
         table = self.table_defs.pop(table_name)
         table._drop()
 
-    def add_index(self, table_name : str, index_name : str, column : str, **kwargs) :
+    def add_index(self, table_name : str, index_name : str, column : str | None = None, **kwargs) :
         if self.mode == "ro" :
             raise ValueError("Database is in read-only mode.")
 
@@ -154,6 +179,44 @@ class Database :
 
         self.table_defs[table_name].drop_index(index_name)
 
+    def warm_cache(self) -> int :
+        """Read the upper levels of every index into the cache.
+        Returns the number of nodes read.
+        """
+        count = 0
+        for table in list(self.table_defs.values()) :
+            count += table.warm()
+        logger.debug(f"Warmed cache for {self.db_path} with {count} nodes")
+        return count
+
+    def _background_warm(self) :
+        try :
+            self.warm_cache()
+        except Exception as e :
+            # Tables or indexes dropped mid warm up. Nothing is lost.
+            logger.debug(f"Background cache warm up stopped early : {e}")
+
+    def wait_for_warm(self, timeout : float | None = None) -> bool :
+        """Wait for a background warm up to finish. Returns False on timeout."""
+        if self.warm_thread is None :
+            return True
+        self.warm_thread.join(timeout)
+        return not self.warm_thread.is_alive()
+
+    def close(self) :
+        """Stop the database's background threads and release its share of
+        the shared block cache. The object can't be used after this.
+        """
+        self.wait_for_warm()
+        self.db_ctx.close()
+        logger.debug(f"Closed database {self.db_path}")
+
+    def __enter__(self) -> Self :
+        return self
+
+    def __exit__(self, *args) :
+        self.close()
+
     @property
     def cache_stats(self) :
         return self.db_ctx.cache.stats
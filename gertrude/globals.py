@@ -1,5 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 import regex as re
+import threading
+import weakref
 from pathlib import Path
 from typing import Any, NamedTuple
 
@@ -27,6 +30,20 @@ class DBOptions :
     # decent compromise between insert performance and probe performance.
     index_fanout : int = 80
     index_cache_size : int = 128
+    # lru, 2q or arc - see lib/cache.py
+    index_cache_policy : str = "lru"
+    # approximate memory budget for the block cache, 0 for no limit.
+    index_cache_bytes : int = 0
+    # keep internal index nodes in a tier of their own that is never evicted.
+    index_cache_pin_internal : bool = True
+    # size of the block cache tier shared between processes, 0 for none.
+    index_shared_cache_bytes : int = 0
+    # most leaves a range scan reads ahead of itself, 0 for none.
+    scan_readahead : int = 8
+    # threads for reads done in the background.
+    io_threads : int = 4
+    # most rows an index scan reads at once.
+    fetch_batch : int = 32
 
 class DBContext :
     def __init__(self, db_path : Path,
@@ -39,6 +56,9 @@ class DBContext :
         self.id_gen = id_gen
         self.cache = cache
         self.options = options
+        self._io_pool : ThreadPoolExecutor | None = None
+        self._io_pool_stop : weakref.finalize | None = None
+        self._io_pool_lock = threading.Lock()
 
     def path(self) -> Path :
         return self.db_path
@@ -49,5 +69,27 @@ class DBContext :
     def generate_id(self) -> int :
         return self.id_gen.gen_id()
 
+    def io_pool(self) -> ThreadPoolExecutor :
+        """Threads for reads done in the background, started on first use."""
+        with self._io_pool_lock :
+            if self._io_pool is None :
+                self._io_pool = ThreadPoolExecutor(max_workers=self.options.io_threads,
+                                                   thread_name_prefix=f"io-{self.db_path.name}")
+                # Stopped by close(), or when the context goes away if that
+                # is never called. That can happen on one of the pool's own
+                # threads, so it doesn't wait for them.
+                self._io_pool_stop = weakref.finalize(self, self._io_pool.shutdown, wait=False)
+            return self._io_pool
+
+    def close(self) :
+        """Stop the io threads and let go of the block cache."""
+        with self._io_pool_lock :
+            if self._io_pool is not None and self._io_pool_stop is not None :
+                self._io_pool_stop.detach()
+                self._io_pool.shutdown(wait=True)
+            self._io_pool = None
+            self._io_pool_stop = None
+        self.cache.close()
+
 
 FieldSpec = NamedTuple("FieldSpec", [("name", str), ("type", str), ("options", dict[str, Any])])
@@ -0,0 +1,313 @@
+"""Extendible hash index.
+
+Node 0 is the directory. It holds the global depth and 2**depth bucket ids.
+A key goes to the bucket in the directory slot given by the low `depth` bits
+of its hash. Each bucket records its own local depth - the number of hash
+bits all of its keys agree on.
+
+When a bucket overflows, it is split on the next hash bit. If the bucket
+was already using every bit the directory has, the directory is doubled
+first.
+
+Lookups are a read of the directory and a read of one bucket, no matter
+how big the index gets. There is no ordering, so only equality is supported.
+"""
+from typing import Any, Generator, Iterable, Tuple, cast
+import zlib
+
+from .index import BaseIndex, IndexStats, OPERATOR_MAP
+from .lib.types.index import (
+    INDEX_NODE_TYPE_BUCKET, BucketNode, DirectoryNode, LeafItem, NodeEntries,
+    make_bucket, make_directory
+    )
+from .lib.types.value import Value
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Keeps the directory to a sane size if a lot of keys collide.
+_MAX_DEPTH = 24
+
+
+class HashIndex(BaseIndex) :
+    kind = "hash"
+    ordered = False
+
+    def _hash(self, key : Value) -> int :
+        # Needs to be stable across runs, so no builtin hash().
+        return zlib.crc32(key.raw)
+
+    def _read_directory(self) -> DirectoryNode :
+        return cast(DirectoryNode, self.db_ctx.cache.get(self.id, 0))
+
+    def _read_bucket(self, bucket_id : int) -> BucketNode :
+        bucket = self.db_ctx.cache.get(self.id, bucket_id)
+        if bucket.k != INDEX_NODE_TYPE_BUCKET :
+            raise ValueError(f"Invalid node type {bucket.k} for bucket node {bucket_id}")
+        return cast(BucketNode, bucket)
+
+    def _bucket_for(self, key : Value, directory : DirectoryNode | None = None) -> BucketNode :
+        if directory is None :
+            directory = self._read_directory()
+        slot = self._hash(key) & ((1 << directory.depth) - 1)
+        return self._read_bucket(directory.d[slot])
+
+    def _lookup(self, key : Value) -> list[int] :
+        raw = key.raw
+        d = self._bucket_for(key).d
+        return [h for k, h in zip(d.keys, d.ids) if k == raw]
+
+    #################################################################
+    def _create(self, iterator) :
+        self._create_storage()
+
+        records = self._collect_records(iterator)
+        self._build_bloom(r.key for r in records)
+
+        # Start with buckets about 3/4 full, same as the B+-Tree.
+        capacity = max(1, int(self.fanout * 0.75))
+        depth = 0
+        while (1 << depth) * capacity < len(records) and depth < _MAX_DEPTH :
+            depth += 1
+
+        mask = (1 << depth) - 1
+        buckets : list[list[LeafItem]] = [[] for _ in range(1 << depth)]
+        for r in records :
+            buckets[self._hash(r.key) & mask].append(r)
+
+        bucket_ids : list[int] = []
+        for b in buckets :
+            bucket_id = self.db_ctx.generate_id()
+            self._write_node(bucket_id, make_bucket(bucket_id, depth, b), cache=False)
+            bucket_ids.append(bucket_id)
+
+        logger.debug(f"Created hash index {self.index_name} with depth {depth} for {len(records)} records")
+        self._write_node(0, make_directory(0, depth, bucket_ids))
+
+    def _split_bucket(self, directory : DirectoryNode, bucket : BucketNode) :
+        """Split an overflowing bucket, repeating until every piece fits.
+        A bucket whose entries all hash the same cannot be split and is
+        allowed to overflow.
+        """
+        directory_changed = False
+
+        while len(bucket.d) > self.fanout :
+            hashes = [self._hash(x.key) for x in bucket.d]
+            if len(set(hashes)) == 1 or bucket.depth >= _MAX_DEPTH :
+                break
+
+            if bucket.depth == directory.depth :
+                # Slot i and i + 2**depth both point where slot i did.
+                directory.d = directory.d + directory.d
+                directory.depth += 1
+                logger.debug(f"--- doubling directory of {self.index_name} to depth {directory.depth}")
+
+            bit = 1 << bucket.depth
+            keep = [x for x, h in zip(bucket.d, hashes) if not h & bit]
+            move = [x for x, h in zip(bucket.d, hashes) if h & bit]
+
+            bucket.depth += 1
+            bucket.d = NodeEntries.of(LeafItem, keep)
+            new_id = self.db_ctx.generate_id()
+            new_bucket = make_bucket(new_id, bucket.depth, move)
+            logger.debug(f"--- splitting bucket {bucket.n} -> {new_id} on bit {bit}")
+
+            for slot, bucket_id in enumerate(directory.d) :
+                if bucket_id == bucket.n and slot & bit :
+                    directory.d[slot] = new_id
+            directory_changed = True
+
+            # Keep going with whichever half is still too big.
+            if len(new_bucket.d) > len(bucket.d) :
+                self._write_node(bucket.n, bucket)
+                bucket = new_bucket
+            else :
+                self._write_node(new_bucket.n, new_bucket)
+
+        self._write_node(bucket.n, bucket)
+        if directory_changed :
+            self._write_node(0, directory)
+
+    #################################################################
+    # Public API
+    #################################################################
+
+    def test_for_insert(self, record : dict[str, Value]) -> Tuple[bool, str] :
+        """Method to check if the record meets the index constraints.
+        This must be called before insert() on the record.
+        """
+        self._check_writable()
+
+        if not self._covers(record) :
+            return True, ""
+
+        key = self._key(record)
+
+        if not self.nullable and key.is_null :
+            return False, f"Null key in non-nullable index {self.index_name}"
+
+        if not self.unique or self._definitely_absent(key) :
+            return (True, "")
+
+        if len(self._lookup(key)) > 0 :
+            return False, f"Duplicate key '{key}' in unique index {self.index_name}"
+
+        return True, ""
+
+    def insert(self, obj : dict[str, Any], heap_id : int) :
+        """Insert object into index.
+        test_for_insert() must be called first, otherwise constraints may be violated.
+        """
+        self._check_writable()
+
+        if not self._covers(obj) :
+            return
+
+        key : Value = self._key(obj)
+        if not self.nullable and key.is_null :
+            raise ValueError(f"Null key in non-nullable index {self.index_name}")
+
+        directory = self._read_directory()
+        bucket = self._bucket_for(key, directory)
+        bucket.d.append(LeafItem(key, heap_id))
+
+        if len(bucket.d) > self.fanout :
+            self._split_bucket(directory, bucket)
+        else :
+            self._write_node(bucket.n, bucket)
+
+        self._bloom_add(key)
+
+    def delete(self, row : dict[str, Value], heap_id : int | None = None) :
+        """Remove the entry for the row from the index.
+        Buckets are never merged back together.
+        """
+        self._check_writable()
+
+        if not self._covers(row) :
+            return
+
+        key = self._key(row)
+        raw = key.raw
+        bucket = self._bucket_for(key)
+        for i, (k, h) in enumerate(zip(bucket.d.keys, bucket.d.ids)) :
+            if k == raw and (heap_id is None or h == heap_id) :
+                del bucket.d[i]
+                self._write_node(bucket.n, bucket)
+                return
+
+        raise ValueError(f"Key {key} not found in index {self.index_name}")
+
+    def scan(self, key : Any = None, op : str | None = None,
+             upper_key : Any = None, upper_op : str | None = None,
+             reverse : bool = False) -> Generator[int, Any, None]:
+        """With no key, returns every heap id in no particular order.
+        Otherwise `op` must be equality.
+        """
+        if self.closed :
+            raise ValueError(f"Index {self.index_name} is closed.")
+
+        if op is not None and op not in OPERATOR_MAP :
+            raise ValueError(f"Invalid operator {op}")
+
+        if key is None and op is not None :
+            raise ValueError("Cannot specify operator without key.")
+
+        self._check_upper_bound(None, upper_key, upper_op)
+        if reverse :
+            raise ValueError(f"Index {self.index_name} has no order to reverse.")
+
+        if key is None :
+            directory = self._read_directory()
+            seen : set[int] = set()
+            for bucket_id in directory.d :
+                if bucket_id in seen :
+                    continue
+                seen.add(bucket_id)
+                for x in self._read_bucket(bucket_id).d :
+                    yield x.heap_id
+            return
+
+        if op is not None and OPERATOR_MAP[op] != 'eq' :
+            raise ValueError(f"Hash index {self.index_name} only supports equality lookups.")
+
+        value = self._gen_value(key)
+        if self._definitely_absent(value) :
+            return
+
+        for heap_id in self._lookup(value) :
+            yield heap_id
+
+    def multi_get(self, keys : Iterable[Any]) -> dict[Any, list[int]] :
+        """Look up several keys at once, reading each bucket only once.
+        Keys that aren't found map to an empty list.
+        """
+        if self.closed :
+            raise ValueError(f"Index {self.index_name} is closed.")
+
+        directory = self._read_directory()
+        mask = (1 << directory.depth) - 1
+
+        by_bucket : dict[int, list[Tuple[Any, bytes]]] = {}
+        retval : dict[Any, list[int]] = {}
+        for k in keys :
+            key = self._gen_value(k)
+            retval[k] = []
+            if self._definitely_absent(key) :
+                continue
+            bucket_id = directory.d[self._hash(key) & mask]
+            by_bucket.setdefault(bucket_id, []).append((k, key.raw))
+
+        for bucket_id, wanted in by_bucket.items() :
+            bucket = self._read_bucket(bucket_id)
+            for k, raw in wanted :
+                retval[k] = [h for x, h in zip(bucket.d.keys, bucket.d.ids) if x == raw]
+
+        return retval
+
+    def warm(self) -> int :
+        if self.closed :
+            return 0
+        self._read_directory()
+        return 1
+
+    def _iter_keys(self) -> Iterable[Value] :
+        seen : set[int] = set()
+        for bucket_id in self._read_directory().d :
+            if bucket_id not in seen :
+                seen.add(bucket_id)
+                yield from (x.key for x in self._read_bucket(bucket_id).d)
+
+    def stats(self) -> IndexStats :
+        """Bucket count, fill and sizes. The directory counts as the first
+        level, the buckets as the second.
+        """
+        if self.closed :
+            raise ValueError(f"Index {self.index_name} is closed.")
+
+        directory = self.db_ctx.cache.peek(self.id, 0)
+        buckets = [self.db_ctx.cache.peek(self.id, x) for x in dict.fromkeys(cast(DirectoryNode, directory).d)]
+        stats = self._fill_stats([buckets], [x for b in buckets for x in cast(BucketNode, b).d], [directory])
+        stats.height = 2
+        stats.nodes = [1, len(buckets)]
+        return stats
+
+    def print_tree(self) :
+        """Output a representation of the directory and buckets onto stdout.
+        """
+        if self.closed :
+            raise ValueError(f"Index {self.index_name} is closed.")
+
+        directory = self._read_directory()
+        print(f"=== {self.index_name} Hash (depth = {directory.depth}):")
+        seen : set[int] = set()
+        for slot, bucket_id in enumerate(directory.d) :
+            print(f"  slot {slot:b} -> {bucket_id}")
+            if bucket_id in seen :
+                continue
+            seen.add(bucket_id)
+            bucket = self._read_bucket(bucket_id)
+            print(f"    {bucket.n} B depth={bucket.depth} ({len(bucket.d)}):")
+            for x in bucket.d :
+                print(f"      {x.key} -> {x.heap_id:016X}")
+        print("=== End of hash")
@@ -1,11 +1,18 @@
+from abc import ABC, abstractmethod
 from bisect import bisect_left, insort, bisect_right
-from dataclasses import asdict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
 import json
 from pathlib import Path
-from typing import Any, Generator, List, NamedTuple, Optional, Tuple, cast
+from typing import Any, Generator, Iterable, List, NamedTuple, Optional, Tuple, cast
 import operator as pyops
+import threading
 
+from .expression import expr_parse
 from .globals import TYPES, DBContext
+from .lib import heap
+from .lib.bloom import BloomFilter
+from .lib.expr_nodes import ExprNode
 from .lib.types.index import *
 from .lib.types.value import Value, type_const
 
@@ -23,6 +30,11 @@ class tpi(NamedTuple) :
 # The last entry will always be (leaf_block_id, index_into_parent)
 type TreePath = List[tpi]
 
+# What Index.prepare_insert() found, for apply_insert().
+class InsertTicket(NamedTuple) :
+    key : Value
+    tree_path : TreePath
+
 _INVALID_INDEX = -10
 
 OPERATOR_MAP = {
@@ -40,12 +52,61 @@ OPERATOR_MAP = {
 }
 
 
-class Index :
+@dataclass
+class IndexStats :
+    """Shape and health of an index - see Index.stats()."""
+    kind : str
+    height : int = 0
+    # Number of nodes on each level, root first.
+    nodes : list[int] = field(default_factory=list)
+    entries : int = 0
+    # Average fraction of fanout used, for the leaves (or buckets) and
+    # for the internal nodes.
+    fill : float = 0.0
+    internal_fill : float = 0.0
+    # Fraction of all the node slots that are empty.
+    dead_space : float = 0.0
+    # Bytes on disk of the nodes in the index, and of node files that
+    # nothing points to any more.
+    bytes : int = 0
+    orphan_bytes : int = 0
+    # p50, p90, p99 and max, in bytes.
+    key_bytes : dict[str, int] = field(default_factory=dict)
+    node_bytes : dict[str, int] = field(default_factory=dict)
+
+
+def _percentiles(values : list[int]) -> dict[str, int] :
+    if len(values) == 0 :
+        return { "p50" : 0, "p90" : 0, "p99" : 0, "max" : 0 }
+    values = sorted(values)
+    def at(p : float) -> int :
+        return values[min(len(values) - 1, int(len(values) * p))]
+    return { "p50" : at(0.5), "p90" : at(0.9), "p99" : at(0.99), "max" : values[-1] }
+
+
+class BaseIndex(ABC) :
+    """Bookkeeping shared by all kinds of index - configuration, storage
+    registration with the block cache and the open/closed state.
+    Subclasses provide the actual structure.
+    """
+    # Name used in the config and for `add_index(kind=...)`.
+    kind = ""
+    # True if scan() returns keys in order and supports range operators.
+    ordered = False
+
     def __init__(self, index_name : str, path : Path,
-                 column : str, coltype : str, db_ctx : DBContext, *,
-                 unique : bool = False, nullable : bool = True) :
+                 column : str | None, coltype : str, db_ctx : DBContext, *,
+                 unique : bool = False, nullable : bool = True,
+                 bloom : bool = False, expr : str | None = None,
+                 where : str | None = None) :
         self.index_name = index_name
         self._column = column
+        # An expression index has no column - its keys are computed from the row.
+        self.expr = expr
+        self.expr_node : ExprNode | None = expr_parse(expr) if expr is not None else None
+        # A partial index only holds the rows this is true for.
+        self.where = where
+        self.where_node : ExprNode | None = expr_parse(where) if where is not None else None
         self.coltype = coltype
         self.path = path
         self.real_type = TYPES[coltype]
@@ -54,68 +115,100 @@ class Index :
         self.unique = unique
         self.nullable = nullable
         self.fanout = db_ctx.options.index_fanout
+        self.use_bloom = bloom
+        self.bloom : BloomFilter | None = None
+        # Where the table keeps its rows, so scans can prefetch them.
+        # Set by the table.
+        self.heap_path : Path | None = None
 
         logger.debug(f" DBContext options = {db_ctx.options}")
 
-        logger.debug(f"Creating index {self.index_name} on column {self._column} of type {self.coltype} with fanout = {self.fanout}")
+        logger.debug(f"Creating {self.kind} index {self.index_name} on {self._column or self.expr} of type {self.coltype} with fanout = {self.fanout}")
 
         self.closed = False
 
+        # False while an online build is still running - see Table.add_index().
+        self.ready = True
+
         # We'll fix this later
         # see _create or _load
         self.id : int= 0
 
-
-
-    def _write_node(self, node_id : int, node : LeafNode | InternalNode, cache : bool = True) :
+    def _write_node(self, node_id : int, node : IndexNode, cache : bool = True) :
         self.db_ctx.cache.put(self.id, node_id, node, cache=cache)
 
-    def _read_node(self, node_id : int) -> LeafNode | InternalNode:
-        data = self.db_ctx.cache.get(self.id, node_id)
-        if data.k == INDEX_NODE_TYPE_LEAF :
-            data = cast(LeafNode, data)
-        else :
-            data = cast(InternalNode, data)
-        return data
-
+    def _pin_node(self, node_id : int) -> IndexNode :
+        return self.db_ctx.cache.pin(self.id, node_id)
 
-    def _read_root(self) -> InternalNode :
-        return cast(InternalNode, self._read_node(0))
+    def _unpin_node(self, node_id : int) :
+        self.db_ctx.cache.unpin(self.id, node_id)
 
     def _gen_value(self, key : Any) -> Value :
+        if isinstance(key, Value) :
+            return key
         type_constant = type_const(self.coltype)
         return Value(type_constant, key)
 
-    #################################################################
-    def _create(self, iterator) :
-        if self.path.exists() :
-            raise ValueError(f"Index {self.index_name} directory already exists.")
-
-        self.path.mkdir()
-
-        self.id = self.db_ctx.generate_id()
-
-        config = {
+    def _key(self, row : dict[str, Value]) -> Value :
+        """The index key for a row."""
+        if self.expr_node is None :
+            return row[self._column]   # type: ignore[index]
+
+        key = self.expr_node.calc(row)
+        if key.is_null :
+            # Keep nulls the index's type so they compare with the other keys.
+            return Value(self.coltype, None)
+        if key.type_name != self.coltype :
+            raise ValueError(f"Expression {self.expr} gave a {key.type_name}, index {self.index_name} holds {self.coltype}")
+        return key
+
+    def _covers(self, row : dict[str, Value]) -> bool :
+        """True if the row belongs in the index - always, unless it is partial."""
+        return self.where_node is None or bool(self.where_node.calc(row))
+
+    def _config(self) -> dict[str, Any] :
+        return {
             "name" : self.index_name,
+            "kind" : self.kind,
             "column" : self._column,
+            "expr" : self.expr,
+            "where" : self.where,
             "coltype" : self.coltype,
             "id" : self.id,
             "unique" : self.unique,
             "nullable" : self.nullable,
             "fanout" : self.fanout,
+            "bloom" : self.use_bloom,
+            "building" : not self.ready,
         }
 
+    def _write_config(self) :
+        (self.path / "config").write_text(json.dumps(self._config()))
+
+    def _create_storage(self) :
+        """Make the directory, dump the config and register with the cache."""
+        if self.path.exists() :
+            raise ValueError(f"Index {self.index_name} directory already exists.")
+
+        self.path.mkdir()
+
+        self.id = self.db_ctx.generate_id()
+
         ## Dump config info
-        (self.path / "config").write_text(json.dumps(config))
+        self._write_config()
 
         ## Register with the cache
         self.db_ctx.cache.register(self.id, self.path)
 
-        records : LeafData = []
+    def _collect_records(self, iterator) -> list[LeafItem] :
+        """Pull the keys for a new index out of the table, checking the constraints."""
+        records : list[LeafItem] = []
         keyset = set()
         for record in iterator() :
             (heap_id, data) = record
-            key = data[self._column]
+            if not self._covers(data) :
+                continue
+            key = self._key(data)
 
             if self.unique :
                 if key in keyset :
@@ -123,80 +216,325 @@ class Index :
                 keyset.add(key)
 
             if not self.nullable :
-                if key is None :
+                if key.is_null :
                     raise ValueError(f"Null key in non-nullable index {self.index_name}")
 
             records.append(LeafItem(key, heap_id))
 
-        root : List[InternalItem] = []
-        records.sort(key=lambda x : x.key)
-        if len(records) < 10 :
-            logger.debug(f"populating index with records = {records}")
-
-        init_fanout = int(self.fanout * 0.75)
+        return records
 
-        while len(records) >= init_fanout :
-            # TODO : The root node may still be too large.
-            split_point = self._pick_split_point(init_fanout, records)
-            new_records = records[:split_point]
-            records = records[split_point:]
+    @abstractmethod
+    def _create(self, iterator) :
+        """Build the index from the (heap id, row) pairs `iterator()` yields."""
 
-            while len(new_records) > init_fanout :
-                split_point = self._pick_split_point(init_fanout, new_records)
-                new_block_id = self.db_ctx.generate_id()
-                root.append(InternalItem(new_records[0].key, new_block_id))
-                new_node = make_leaf(new_block_id, new_records[:split_point])
-                self._write_node(new_block_id, new_node, cache=False)
-                new_records = new_records[split_point:]
+    @abstractmethod
+    def _iter_keys(self) -> Iterable[Value] :
+        """Every key in the index, in no particular order."""
 
-            if len(new_records) > 0 :
-                new_block_id = self.db_ctx.generate_id()
-                root.append(InternalItem(new_records[0].key, new_block_id))
-                new_node = make_leaf(new_block_id, new_records)
-                self._write_node(new_block_id, new_node, cache=False)
+    def _build_bloom(self, keys : Iterable[Value]) :
+        if self.use_bloom :
+            self.bloom = BloomFilter.create(self.path / "bloom", (k.raw for k in keys))
 
-        if len(records) > 0 :
-            new_block_id = self.db_ctx.generate_id()
-            root.append(InternalItem(records[0].key, new_block_id))
-            new_node = make_leaf(new_block_id, records)
-            self._write_node(new_block_id, new_node, cache=False)
-
-        if len(root) > 0 :
-            root[0] = InternalItem(self._gen_value(None), root[0].node_id)
+    def _bloom_add(self, key : Value) :
+        """Record a newly inserted key. Call after the key is in the index."""
+        if self.bloom is None :
+            return
+        if self.bloom.count >= self.bloom.capacity :
+            logger.debug(f"--- bloom filter for {self.index_name} is full, rebuilding")
+            self._build_bloom(self._iter_keys())
         else :
-            # create an empty block
-            first_block_id = self.db_ctx.generate_id()
-            new_node = make_leaf(first_block_id, [])
-            self._write_node(first_block_id, new_node, cache=False)
-            root.append(InternalItem(self._gen_value(None), first_block_id))
-
-        self._write_node(0, make_internal(0, root))
-        #self.print_tree()
+            self.bloom.add(key.raw)
+
+    def _definitely_absent(self, key : Value) -> bool :
+        """True if the bloom filter shows the key is not in the index."""
+        return self.bloom is not None and not self.bloom.might_contain(key.raw)
+
+    def _check_upper_bound(self, mapped_op : str | None, upper_key : Any, upper_op : str | None) -> str | None :
+        """Check the optional upper bound of a scan. Returns its mapped operator."""
+        if upper_op is None :
+            if upper_key is not None :
+                raise ValueError("Cannot specify upper key without operator.")
+            return None
+
+        if not self.ordered :
+            raise ValueError(f"Index {self.index_name} does not support range scans.")
+
+        mapped = OPERATOR_MAP.get(upper_op)
+        if mapped not in ('lt', 'le') :
+            raise ValueError(f"Invalid upper bound operator {upper_op}")
+        if upper_key is None :
+            raise ValueError("Cannot specify operator without key.")
+        if mapped_op not in (None, 'gt', 'ge') :
+            raise ValueError(f"Operator {mapped_op} cannot be combined with an upper bound.")
+        return mapped
+
+    def _node_ids_on_disk(self) -> set[int] :
+        # Node files are named by node id - everything else is a digit free name.
+        return { int(p.name) for p in self.path.iterdir() if p.name.isdigit() }
+
+    def _node_file_bytes(self, node_id : int) -> int :
+        return (self.path / f"{node_id:03}").stat().st_size
+
+    def _fill_stats(self, levels : list[list[IndexNode]], leaf_items : list[LeafItem],
+                    others : list[IndexNode] | None = None) -> IndexStats :
+        """Work out the stats from every node of the index, grouped by
+        level, root first. The last level holds the entries. `others` are
+        nodes that take up space but don't count towards the fill.
+        """
+        stats = IndexStats(self.kind)
+        stats.height = len(levels)
+        stats.nodes = [len(level) for level in levels]
+        stats.entries = len(leaf_items)
+
+        internal = [len(cast(Any, n).d) for level in levels[:-1] for n in level]
+        leaves = [len(cast(Any, n).d) for n in levels[-1]]
+        if len(leaves) > 0 :
+            stats.fill = sum(leaves) / (len(leaves) * self.fanout)
+        if len(internal) > 0 :
+            stats.internal_fill = sum(internal) / (len(internal) * self.fanout)
+        slots = (len(internal) + len(leaves)) * self.fanout
+        if slots > 0 :
+            stats.dead_space = 1 - (sum(internal) + sum(leaves)) / slots
+
+        live = { n.n for level in levels for n in level } | { n.n for n in others or [] }
+        sizes = [self._node_file_bytes(node_id) for node_id in live]
+        stats.bytes = sum(sizes)
+        stats.orphan_bytes = sum(self._node_file_bytes(x) for x in self._node_ids_on_disk() - live)
+        stats.key_bytes = _percentiles([len(x.key.raw) for x in leaf_items])
+        stats.node_bytes = _percentiles(sizes)
+        return stats
+
+    def stats(self) -> IndexStats :
+        """Height, node counts, fill and sizes of the index."""
+        raise ValueError(f"{self.kind} index {self.index_name} does not keep node statistics")
+
+    def reorganize(self, timeout : float | None = 30.0) -> IndexStats :
+        """Rebuild the index from its current entries."""
+        raise ValueError(f"{self.kind} index {self.index_name} cannot be reorganized")
+
+    def _check_writable(self) :
+        if self.db_ctx.mode == "ro" :
+            raise ValueError("Database is in read-only mode.")
+        if self.closed :
+            raise ValueError(f"Index {self.index_name} is closed.")
 
     #################################################################
     @classmethod
-    def _load(cls, path : Path, db_ctx : DBContext) :
-        config = json.loads((path / "config").read_text())
+    def _load(cls, path : Path, db_ctx : DBContext, config : dict[str, Any] | None = None, **kwargs) :
+        if config is None :
+            config = json.loads((path / "config").read_text())
 
-        index = Index(config["name"], path, config["column"], config["coltype"],
-                      db_ctx, unique=config["unique"], nullable=config["nullable"])
+        index = cls(config["name"], path, config["column"], config["coltype"],
+                    db_ctx, unique=config["unique"], nullable=config["nullable"],
+                    bloom=config.get("bloom", False), expr=config.get("expr"),
+                    where=config.get("where"), **kwargs)
 
         # forcing fanout to what was in the config
         index.fanout = config["fanout"]
-        logger.debug(f"Loading index {index.index_name} with fanout {index.fanout}")
+        logger.debug(f"Loading {index.kind} index {index.index_name} with fanout {index.fanout}")
 
         index.id = config["id"]
         db_ctx.cache.register(index.id, path)
 
+        if index.use_bloom :
+            if (path / "bloom").exists() :
+                index.bloom = BloomFilter(path / "bloom")
+            else :
+                index._build_bloom(index._iter_keys())
+
         return index
 
+    #################################################################
+    # Public API
+    #################################################################
+
+    @property
+    def column(self) :
+        return self._column
+
+    def multi_get(self, keys : Iterable[Any]) -> dict[Any, list[int]] :
+        """Look up several keys at once. Returns the heap ids for each key.
+        Keys that aren't found map to an empty list.
+        """
+        return { k : list(self.scan(k, 'eq')) for k in keys }
+
+    def warm(self) -> int :
+        """Read the nodes every lookup needs into the cache.
+        Returns the number of nodes read.
+        """
+        return 0
+
+    @abstractmethod
+    def test_for_insert(self, record : dict[str, Value]) -> Tuple[bool, str] :
+        """Check the record against the index constraints, before insert()."""
+
+    @abstractmethod
+    def insert(self, obj : dict[str, Any], heap_id : int) :
+        """Add the record's key to the index."""
+
+    @abstractmethod
+    def delete(self, row : dict[str, Value], heap_id : int | None = None) :
+        """Remove the row's entry from the index."""
+
+    @abstractmethod
+    def scan(self, key : Any = None, op : str | None = None,
+             upper_key : Any = None, upper_op : str | None = None,
+             reverse : bool = False) -> Generator[int, Any, None]:
+        """Heap ids of the entries matching `op key`."""
+
+    @abstractmethod
+    def print_tree(self) :
+        """Output a representation of the index onto stdout."""
+
+    def prepare_insert(self, record : dict[str, Value]) -> Tuple[bool, str, Any] :
+        """First half of an insert. Checks the record against the index
+        constraints like test_for_insert(), without changing anything, and
+        returns (ok, message, ticket). The ticket holds whatever the index
+        found on the way that apply_insert() can reuse.
+        A table prepares every index before it applies any, so a record
+        rejected by one index is in none of them.
+        """
+        ok, msg = self.test_for_insert(record)
+        return ok, msg, None
+
+    def apply_insert(self, record : dict[str, Value], heap_id : int, ticket : Any) :
+        """Second half of an insert, with the ticket from prepare_insert().
+        Nothing else may change the index in between.
+        """
+        self.insert(record, heap_id)
+
+    def close(self) :
+        if self.closed :
+            return
+        # Let the table take care of deleting storage.
+
+        self.db_ctx.cache.unregister(self.id)
+        self.closed = True
+
+
+class Index(BaseIndex) :
+    """B+-Tree index. Supports ordered scans and range operators."""
+    kind = "btree"
+    ordered = True
+
+    def __init__(self, *args, **kwargs) :
+        super().__init__(*args, **kwargs)
+        # Path to the right most leaf, remembered while inserts keep
+        # landing at the end of the index. See _append_path().
+        self._rightmost : TreePath | None = None
+        # Scans and lookups running, and whether a reorganize is swapping
+        # the tree out from under them. See _reading() and reorganize().
+        self.readers = 0
+        self.reorganizing = False
+        self.readers_changed = threading.Condition()
+
+    @contextmanager
+    def _reading(self) :
+        """Held by anything that walks the tree without the table lock, so
+        reorganize() doesn't remove nodes it is still using.
+        """
+        with self.readers_changed :
+            while self.reorganizing :
+                self.readers_changed.wait()
+            self.readers += 1
+        try :
+            yield
+        finally :
+            with self.readers_changed :
+                self.readers -= 1
+                self.readers_changed.notify_all()
+
+    def _read_node(self, node_id : int) -> LeafNode | InternalNode:
+        data = self.db_ctx.cache.get(self.id, node_id)
+        if data.k == INDEX_NODE_TYPE_LEAF :
+            data = cast(LeafNode, data)
+        else :
+            data = cast(InternalNode, data)
+        return data
+
+
+    def _read_root(self) -> InternalNode :
+        return cast(InternalNode, self._read_node(0))
+
+    def _read_ahead(self, node_ids : Iterable[int]) :
+        """Load nodes into the cache on the io threads, and hint the rows
+        they point at too, if the node is a leaf.
+        """
+        pool = self.db_ctx.io_pool()
+        for node_id in node_ids :
+            pool.submit(self._load_ahead, node_id)
+
+    def _load_ahead(self, node_id : int) :
+        try :
+            node = self.db_ctx.cache.prefetch(self.id, node_id)
+            if node is not None and node.k == INDEX_NODE_TYPE_LEAF and self.heap_path is not None :
+                heap.prefetch(self.heap_path, cast(LeafNode, node).d.ids)
+        except Exception as e :
+            # Only ever a hint - the scan reads what it needs itself.
+            logger.debug(f"Readahead of {node_id} in {self.index_name} failed : {e}")
+
+    #################################################################
+    def _create(self, iterator) :
+        self._create_storage()
+
+        records = self._collect_records(iterator)
+        self._build_bloom(r.key for r in records)
+
+        records.sort(key=lambda x : x.key)
+        if len(records) < 10 :
+            logger.debug(f"populating index with records = {records}")
+
+        self._bulk_load(records)
+
+    def _bulk_load(self, records : list[LeafItem]) :
+        """Build the tree bottom up from sorted records, writing the root
+        last. Every node starts about 3/4 full, so there is room for
+        inserts before anything has to split.
+        """
+        init_fanout = max(2, int(self.fanout * 0.75))
+
+        level : List[InternalItem] = []
+        while len(records) > init_fanout :
+            split_point = self._pick_split_point(init_fanout, records)
+            new_block_id = self.db_ctx.generate_id()
+            level.append(InternalItem(records[0].key, new_block_id))
+            self._write_node(new_block_id, make_leaf(new_block_id, records[:split_point]), cache=False)
+            records = records[split_point:]
+
+        if len(records) > 0 or len(level) == 0 :
+            new_block_id = self.db_ctx.generate_id()
+            level.append(InternalItem(records[0].key if len(records) > 0 else self._gen_value(None), new_block_id))
+            self._write_node(new_block_id, make_leaf(new_block_id, records), cache=False)
+
+        # Spread each level evenly over as few nodes as it takes, until
+        # what is left fits in the root.
+        while len(level) > init_fanout :
+            count = (len(level) + init_fanout - 1) // init_fanout
+            size, extra = divmod(len(level), count)
+            parents : List[InternalItem] = []
+            start = 0
+            for i in range(count) :
+                end = start + size + (1 if i < extra else 0)
+                children = level[start:end]
+                new_block_id = self.db_ctx.generate_id()
+                parents.append(InternalItem(children[0].key, new_block_id))
+                children[0] = InternalItem(self._gen_value(None), children[0].node_id)
+                self._write_node(new_block_id, make_internal(new_block_id, children), cache=False)
+                start = end
+            level = parents
+
+        level[0] = InternalItem(self._gen_value(None), level[0].node_id)
+        self._write_node(0, make_internal(0, level))
+        logger.debug(f"Bulk loaded index {self.index_name}")
+
     def _find_key_in_leaf(self, key : Value, leaf : LeafNode) -> Tuple[bool, int] :
         """Check if a key is in a leaf node. If so, return the index.
         """
 
-        i = bisect_left(leaf.d, key, key=lambda x : x.key)
+        raw = key.raw
+        i = bisect_left(leaf.d.keys, raw)
         logger.debug(f"_find_key_in_leaf: i = {i}")
-        if i < len(leaf.d) and leaf.d[i].key == key :
+        if i < len(leaf.d) and leaf.d.keys[i] == raw :
             return True, i
         else :
             return False, -1
@@ -211,7 +549,9 @@ class Index :
             parent = self._read_root()
         logger.debug(f"_find_block2: Finding pointer in block {parent.n} for key = '{key}'")
         logger.debug(f"_find_block2: lower_bound = {lower_bound}")
-        i = bisect_func(parent.d, key, lo=1, key=lambda x : x.key)
+        raw = key.raw
+        keys = parent.d.keys
+        i = bisect_func(keys, raw, lo=1)
         logger.debug(f"_find_block2: raw i = {i}")
         # if the index is 1, it is either because we need to
         # look at the block at index 1 or we need to look at
@@ -221,12 +561,12 @@ class Index :
             # we need to look at the block at index 0.
             # If the given key is less that the key at index 1,
             # then we need to look at the block at index 0.
-            if i == len(parent.d) or parent.d[i].key > key :
+            if i == len(keys) or keys[i] > raw :
                 i = 0
-        elif i == len(parent.d) or parent.d[i].key > key :
+        elif i == len(keys) or keys[i] > raw :
             i -= 1
         logger.debug(f"_find_block2: final i = {i}")
-        next_block_id = parent.d[i].node_id
+        next_block_id = parent.d.ids[i]
         retval += [tpi(parent.n, i)]
         next_node = self._read_node(next_block_id)
         if next_node.k == INDEX_NODE_TYPE_INTERNAL :
@@ -236,7 +576,7 @@ class Index :
         else :
             next_node = cast(LeafNode, next_node)
             logger.debug(f"_find_block2: in leaf node {next_block_id}")
-            i = bisect_func(next_node.d, key, key=lambda x : x.key)
+            i = bisect_func(next_node.d.keys, raw)
             logger.debug(f"_find_block2: leaf i = {i}")
             check_index = i if lower_bound else i-1
             # if i >= len(next_node.d) or tuple(next_node.d[check_index][0]) != key :
@@ -247,12 +587,13 @@ class Index :
         return retval
 
     #################################################################
-    def _pick_split_point(self, split_point : int, node : LeafNode | InternalNode | LeafData) -> int :
+    def _pick_split_point(self, split_point : int, node : LeafNode | InternalNode | NodeEntries | list[LeafItem]) -> int :
         # Calculate where to split the block.
         # Prefer to split it down the middle, but if
         # there are multiple entries with the same key,
         # we need to make sure all the entries with the same key
         # are in the same block.
+        records : NodeEntries | list[LeafItem]
         if (isinstance(node, LeafNode) or isinstance(node, InternalNode)) :
             records = node.d
         else :
@@ -306,7 +647,16 @@ class Index :
 
         return new_split_point
 
-    def _split_leaf(self, node : LeafNode,  tree_path : TreePath) :
+    def _split_at(self, count : int, append : bool, min_right : int) -> int :
+        """Where to split a full node. Down the middle, unless the node
+        is on the right edge and filled by appends - then 90/10, since
+        nothing will ever be inserted into the left part again.
+        """
+        if append :
+            return count - max(min_right, count // 10)
+        return self.fanout // 2
+
+    def _split_leaf(self, node : LeafNode,  tree_path : TreePath, append : bool = False) :
 
         parent_id, parent_index = tree_path[-1]
         parent = self._read_node(parent_id)
@@ -317,7 +667,7 @@ class Index :
 
         logger.debug(f"--- splitting {node.n} at parent {parent.n}, index {parent_index}")
 
-        split_point = self._pick_split_point(self.fanout//2, node)
+        split_point = self._pick_split_point(self._split_at(len(node.d), append, 1), node)
         logger.debug(f"split_point = {split_point}")
 
         left_data = node.d[:split_point]
@@ -332,11 +682,11 @@ class Index :
         parent.d.insert(parent_index+1, InternalItem(right_data[0].key, right_id))
 
         if len(parent.d) >= self.fanout :
-            self._split_internal(parent, tree_path[:-1])
+            self._split_internal(parent, tree_path[:-1], append)
         else :
             self._write_node(parent.n, parent)
 
-    def _split_internal(self, node : InternalNode, tree_path : TreePath) :
+    def _split_internal(self, node : InternalNode, tree_path : TreePath, append : bool = False) :
         """Split an internal node.
         recursively splits parents if necessary.
         """
@@ -355,7 +705,7 @@ class Index :
 
         logger.debug(f"--- splitting {node.n} at parent {parent.n}, index {parent_index}")
 
-        split_point = self._pick_split_point(self.fanout//2, node)
+        split_point = self._pick_split_point(self._split_at(len(node.d), append, 2), node)
         logger.debug(f"split_point = {split_point}")
 
         left_data = node.d[:split_point]
@@ -383,10 +733,245 @@ class Index :
             self._write_node(right_id, make_internal(right_id, right_data))
 
             if len(parent.d) >= self.fanout :
-                self._split_internal(parent, tree_path[:-1])
+                self._split_internal(parent, tree_path[:-1], append)
             else :
                 self._write_node(parent.n, parent)
 
+    #################################################################
+    # Delete support
+    #################################################################
+    def _min_fill(self) -> int :
+        # A node is rebalanced once it drops below a quarter full.
+        # The textbook half-full rule would make a freshly split node
+        # merge straight back on its first delete.
+        return max(2, self.fanout // 4)
+
+    def _drop_node(self, node_id : int) :
+        self.db_ctx.cache.delete(self.id, node_id)
+
+    def _find_leftmost_path(self, key : Value) -> TreePath :
+        """Like _find_block2(), but always descends to the left most leaf
+        that could hold the key. A run of duplicates can straddle a split,
+        so a separator equal to the key does not mean the left sibling
+        is free of it.
+        """
+        retval : TreePath = []
+        node : LeafNode | InternalNode = self._read_root()
+        while node.k == INDEX_NODE_TYPE_INTERNAL :
+            node = cast(InternalNode, node)
+            i = bisect_left(node.d.keys, key.raw, lo=1) - 1
+            retval.append(tpi(node.n, i))
+            node = self._read_node(node.d.ids[i])
+
+        node = cast(LeafNode, node)
+        retval.append(tpi(node.n, bisect_left(node.d.keys, key.raw)))
+        return retval
+
+    def _next_leaf_path(self, tree_path : TreePath) -> TreePath | None :
+        """Given a path that ends in a leaf, return the path to the first
+        entry of the next leaf to the right. None if there isn't one.
+        """
+        level = len(tree_path) - 2
+        while level >= 0 :
+            node_id, i = tree_path[level]
+            node = cast(InternalNode, self._read_node(node_id))
+            if i + 1 < len(node.d) :
+                retval = tree_path[:level] + [tpi(node_id, i+1)]
+                child = self._read_node(node.d[i+1].node_id)
+                while child.k == INDEX_NODE_TYPE_INTERNAL :
+                    child = cast(InternalNode, child)
+                    retval.append(tpi(child.n, 0))
+                    child = self._read_node(child.d[0].node_id)
+                retval.append(tpi(child.n, 0))
+                return retval
+            level -= 1
+
+        return None
+
+    def _prev_leaf_path(self, tree_path : TreePath) -> TreePath | None :
+        """Given a path that ends in a leaf, return the path to the last
+        entry of the next leaf to the left. None if there isn't one.
+        """
+        level = len(tree_path) - 2
+        while level >= 0 :
+            node_id, i = tree_path[level]
+            if i > 0 :
+                node = cast(InternalNode, self._read_node(node_id))
+                retval = tree_path[:level] + [tpi(node_id, i-1)]
+                child = self._read_node(node.d[i-1].node_id)
+                while child.k == INDEX_NODE_TYPE_INTERNAL :
+                    child = cast(InternalNode, child)
+                    retval.append(tpi(child.n, len(child.d) - 1))
+                    child = self._read_node(child.d[-1].node_id)
+                retval.append(tpi(child.n, len(child.d) - 1))
+                return retval
+            level -= 1
+
+        return None
+
+    def _find_rightmost_path(self, key : Value | None = None, inclusive : bool = True) -> TreePath :
+        """Path to the last entry that is <= key (< key if not inclusive),
+        or to the last entry of all with no key. The leaf index is -1 if
+        the leaf found has no such entry.
+        """
+        retval : TreePath = []
+        bisect = bisect_right if inclusive else bisect_left
+        node : LeafNode | InternalNode = self._read_root()
+        while node.k == INDEX_NODE_TYPE_INTERNAL :
+            node = cast(InternalNode, node)
+            i = len(node.d) - 1 if key is None else bisect(node.d.keys, key.raw, lo=1) - 1
+            retval.append(tpi(node.n, i))
+            node = self._read_node(node.d.ids[i])
+
+        node = cast(LeafNode, node)
+        i = len(node.d) if key is None else bisect(node.d.keys, key.raw)
+        retval.append(tpi(node.n, i - 1))
+        return retval
+
+    def _append_path(self, key : Value, strict : bool = False) -> TreePath | None :
+        """The path to the end of the right most leaf if the key goes
+        there - it is not less than (strict - greater than) every key in
+        the index. Otherwise None.
+        Only tried while inserts have been landing there, so ever increasing
+        keys skip the search from the root. The remembered path is checked
+        against the nodes on the way down, so after a split or merge it is
+        just a miss.
+        """
+        path = self._rightmost
+        if path is None :
+            return None
+
+        node : LeafNode | InternalNode = self._read_root()
+        for node_id, i in path[:-1] :
+            if node.n != node_id or node.k != INDEX_NODE_TYPE_INTERNAL or i != len(node.d) - 1 :
+                return None
+            node = self._read_node(node.d.ids[i])
+
+        if node.n != path[-1].block_id or node.k != INDEX_NODE_TYPE_LEAF or len(node.d) == 0 :
+            return None
+        last = node.d.keys[-1]
+        if key.raw < last or (strict and key.raw == last) :
+            return None
+        return path[:-1] + [tpi(node.n, len(node.d))]
+
+    def _on_right_edge(self, tree_path : TreePath, leaf : LeafNode) -> bool :
+        """True if the path ends past the last entry of the right most leaf."""
+        if tree_path[-1].index != len(leaf.d) :
+            return False
+        return all(i == len(self._read_node(node_id).d) - 1 for node_id, i in tree_path[:-1])
+
+    def _fix_separator(self, new_key : Value, tree_path : TreePath) :
+        """The first key of a node changed. Update the separator that
+        points at it. Raising a separator to the true minimum of its
+        subtree is always safe.
+        """
+        for node_id, i in reversed(tree_path) :
+            if i > 0 :
+                node = cast(InternalNode, self._read_node(node_id))
+                node.d[i] = InternalItem(new_key, node.d[i].node_id)
+                self._write_node(node_id, node)
+                return
+
+    def _collapse_root(self, root : InternalNode) :
+        """Reduce the height of the tree while the root has a single
+        internal child.
+        The root is always node 0 and always internal, so a tree with
+        a single leaf keeps a one entry root.
+        """
+        while len(root.d) == 1 :
+            child = self._read_node(root.d[0].node_id)
+            if child.k != INDEX_NODE_TYPE_INTERNAL :
+                break
+            logger.debug(f"--- collapsing root into {child.n}")
+            root.d = cast(InternalNode, child).d
+            self._drop_node(child.n)
+
+        self._write_node(0, root)
+
+    def _rebalance(self, node : LeafNode | InternalNode, tree_path : TreePath) :
+        """Write out a node that just lost an entry. If it is now under
+        filled, either merge it with a sibling or borrow entries from one.
+        Merges may cascade up the tree.
+        `tree_path` is the path to the parent of `node`.
+        """
+        if node.n == 0 :
+            self._collapse_root(cast(InternalNode, node))
+            return
+
+        if len(node.d) >= self._min_fill() :
+            self._write_node(node.n, node)
+            return
+
+        parent_id, index = tree_path[-1]
+        parent = cast(InternalNode, self._read_node(parent_id))
+        if len(parent.d) < 2 :
+            # Only child - nothing to merge with, so the parent is the one
+            # that is under filled. Merging it into a sibling gives this
+            # node siblings of its own. An empty node is dropped first.
+            # Under the root there is nothing above to merge, and a lone
+            # leaf stays even when empty.
+            if parent.n == 0 :
+                if len(node.d) == 0 and node.k == INDEX_NODE_TYPE_INTERNAL :
+                    # The whole tree is empty - back to a single leaf.
+                    node = make_leaf(node.n, [])
+                self._write_node(node.n, node)
+                self._collapse_root(parent)
+                return
+            if len(node.d) == 0 :
+                logger.debug(f"--- dropping empty node {node.n} from parent {parent.n}")
+                self._drop_node(node.n)
+                del parent.d[index]
+            else :
+                self._write_node(node.n, node)
+            self._rebalance(parent, tree_path[:-1])
+            return
+
+        left_index = index - 1 if index > 0 else index
+        right_index = left_index + 1
+        if left_index == index :
+            left = node
+            right = self._read_node(parent.d[right_index].node_id)
+        else :
+            left = self._read_node(parent.d[left_index].node_id)
+            right = node
+
+        is_leaf = (node.k == INDEX_NODE_TYPE_LEAF)
+        if is_leaf or len(right.d) == 0 :
+            combined = left.d + right.d
+        elif len(left.d) == 0 :
+            # Nothing on the left, so the right keeps its placeholder.
+            combined = right.d
+        else :
+            # The first key in an internal node is a placeholder. The real
+            # lower bound for the right node is the separator in the parent.
+            combined = left.d + [InternalItem(parent.d[right_index].key, right.d[0].node_id)] + right.d[1:]
+
+        if len(combined) < self.fanout :
+            logger.debug(f"--- merging {right.n} into {left.n} at parent {parent.n}")
+            left.d = combined
+            self._write_node(left.n, left)
+            self._drop_node(right.n)
+            del parent.d[right_index]
+            self._rebalance(parent, tree_path[:-1])
+            return
+
+        split_point = self._pick_split_point(len(combined)//2, combined)
+        if split_point < self._min_fill() or len(combined) - split_point < self._min_fill() :
+            split_point = len(combined)//2
+        logger.debug(f"--- rebalancing {left.n} and {right.n} at {split_point} of {len(combined)}")
+
+        new_separator = combined[split_point].key
+        left.d = combined[:split_point]
+        if is_leaf :
+            right.d = combined[split_point:]
+        else :
+            right.d = [InternalItem(self._gen_value(None), combined[split_point].node_id)] + combined[split_point+1:]
+        parent.d[right_index] = InternalItem(new_separator, right.n)
+
+        self._write_node(left.n, left)
+        self._write_node(right.n, right)
+        self._write_node(parent.n, parent)
+
     def _print_tree(self, node_id : int, prefix : str) :
         node = self._read_node(node_id)
         print(f"{prefix}{node.n} {node.k} ({len(node.d)}):")
@@ -406,20 +991,16 @@ class Index :
     # Public API
     #################################################################
 
-    @property
-    def column(self) :
-        return self._column
-
     def test_for_insert(self, record : dict[str, Value]) -> Tuple[bool, str] :
         """Method to check if the record meets the index constraints.
         This must be called before insert() on the record.
         """
-        if self.db_ctx.mode == "ro" :
-            raise ValueError("Database is in read-only mode.")
-        if self.closed :
-            raise ValueError(f"Index {self.index_name} is closed.")
+        self._check_writable()
 
-        key = record[self._column]
+        if not self._covers(record) :
+            return True, ""
+
+        key = self._key(record)
         logger.debug(f"---- Testing key {key} for index {self.index_name}")
 
         if not self.nullable :
@@ -431,6 +1012,14 @@ class Index :
             logger.debug(f"--- Non-unique index {self.index_name}")
             return (True, "")
 
+        if self._definitely_absent(key) :
+            logger.debug(f"--- Bloom filter rules out key '{key}'")
+            return True, ""
+
+        if self._append_path(key, strict=True) is not None :
+            logger.debug(f"--- '{key}' is past the end of the index")
+            return True, ""
+
         leaf_id, i = self._find_block2(key)[-1]
         logger.debug(f"--- leaf_id = {leaf_id}, i = {i}")
         leaf = self._read_node(leaf_id)
@@ -449,12 +1038,12 @@ class Index :
         """Insert object into index.
         test_for_insert() must be called first, otherwise constraints may be violated.
         """
-        if self.db_ctx.mode == "ro" :
-            raise ValueError("Database is in read-only mode.")
-        if self.closed :
-            raise ValueError(f"Index {self.index_name} is closed.")
+        self._check_writable()
+
+        if not self._covers(obj) :
+            return
 
-        key : Value = obj[self._column]
+        key : Value = self._key(obj)
 
         logger.debug(f"---- Value = {key} for index {self.index_name}")
 
@@ -463,9 +1052,46 @@ class Index :
         if not self.nullable and key.is_null :
             raise ValueError(f"Null key in non-nullable index {self.index_name}")
 
-        logger.debug(f"--- Inserting {key.value} into index {self.index_name}")
+        self._insert_at(key, heap_id, self._insert_path(key))
+
+    def prepare_insert(self, record : dict[str, Value]) -> Tuple[bool, str, Any] :
+        """test_for_insert() and the search for where the key goes, done in
+        a single descent. The path found is the ticket for apply_insert().
+        """
+        self._check_writable()
 
-        tree_path = self._find_block2(key)
+        if not self._covers(record) :
+            return True, "", None
+
+        key = self._key(record)
+        if not self.nullable and key.is_null :
+            return False, f"Null key in non-nullable index {self.index_name}", None
+
+        tree_path = self._insert_path(key)
+        if self.unique and not self._definitely_absent(key) :
+            leaf = cast(LeafNode, self._read_node(tree_path[-1].block_id))
+            if self._find_key_in_leaf(key, leaf)[0] :
+                return False, f"Duplicate key '{key}' in unique index {self.index_name}", None
+
+        return True, "", InsertTicket(key, tree_path)
+
+    def apply_insert(self, record : dict[str, Value], heap_id : int, ticket : Any) :
+        if ticket is None :
+            return
+        self._check_writable()
+        self._insert_at(ticket.key, heap_id, ticket.tree_path)
+
+    def _insert_path(self, key : Value) -> TreePath :
+        """Where a new key goes - the end of the right most leaf for keys
+        past the end, found the usual way otherwise.
+        """
+        tree_path = self._append_path(key)
+        if tree_path is None :
+            tree_path = self._find_block2(key)
+        return tree_path
+
+    def _insert_at(self, key : Value, heap_id : int, tree_path : TreePath) :
+        logger.debug(f"--- Inserting {key.value} into index {self.index_name}")
 
         leaf_id, leaf_index = tree_path[-1]
 
@@ -475,14 +1101,162 @@ class Index :
         else :
             raise ValueError(f"Invalid node type {leaf.k} for leaf node {leaf_id}")
 
+        append = self._on_right_edge(tree_path, leaf)
+        self._rightmost = tree_path if append else None
+
         # insort(leaf.d, (key, heap_id), key=lambda x : x[0])
         leaf.d.insert(leaf_index, LeafItem(key, heap_id))
 
         if len(leaf.d) >= self.fanout :
-            self._split_leaf(leaf, tree_path[:-1])
+            self._split_leaf(leaf, tree_path[:-1], append)
+            if append :
+                self._rightmost = self._find_rightmost_path()
         else :
             self._write_node(leaf_id, leaf)
 
+        self._bloom_add(key)
+
+    def _multi_get(self, node : LeafNode | InternalNode, keys : list[bytes], found : dict[bytes, list[int]]) :
+        """Push a sorted run of raw keys down through the node.
+        Each child is visited once, with every key that could be in it.
+        """
+        if node.k == INDEX_NODE_TYPE_LEAF :
+            node = cast(LeafNode, node)
+            leaf_keys = node.d.keys
+            i = 0
+            for key in keys :
+                i = bisect_left(leaf_keys, key, lo=i)
+                while i < len(leaf_keys) and leaf_keys[i] == key :
+                    found[key].append(node.d.ids[i])
+                    i += 1
+            return
+
+        node = cast(InternalNode, node)
+        separators = node.d.keys
+        last_child = len(separators) - 1
+
+        # A run of duplicates may straddle a split, so a key equal to a
+        # separator is sent to both sides of it.
+        first = max(0, bisect_left(separators, keys[0], lo=1) - 1)
+        last = max(0, bisect_right(separators, keys[-1], lo=1) - 1)
+        for i in range(first, last+1) :
+            lo = 0 if i == 0 else bisect_left(keys, separators[i])
+            hi = len(keys) if i == last_child else bisect_right(keys, separators[i+1])
+            if lo < hi :
+                self._multi_get(self._read_node(node.d.ids[i]), keys[lo:hi], found)
+
+    def multi_get(self, keys : Iterable[Any]) -> dict[Any, list[int]] :
+        """Look up several keys with a single walk down the tree.
+        The keys are sorted and sent down together, so the internal nodes and
+        leaves that neighbouring keys share are only read once.
+        Returns the heap ids for each key, with the keys in index order.
+        Keys that aren't found map to an empty list.
+        """
+        if self.closed :
+            raise ValueError(f"Index {self.index_name} is closed.")
+
+        wanted : dict[bytes, Any] = {}
+        for k in keys :
+            wanted.setdefault(self._gen_value(k).raw, k)
+
+        raw_keys = sorted(wanted)
+        found : dict[bytes, list[int]] = { k : [] for k in raw_keys }
+        if self.bloom is not None :
+            probe_keys = [k for k in raw_keys if self.bloom.might_contain(k)]
+        else :
+            probe_keys = raw_keys
+        if len(probe_keys) > 0 :
+            with self._reading() :
+                self._multi_get(self._read_root(), probe_keys, found)
+
+        return { wanted[k] : found[k] for k in raw_keys }
+
+    def warm(self) -> int :
+        if self.closed :
+            return 0
+
+        count = 0
+        level = [0]
+        while True :
+            nodes = [self._read_node(node_id) for node_id in level]
+            count += len(nodes)
+            children = [x.node_id for n in nodes for x in cast(InternalNode, n).d]
+            # All the leaves are at the same depth, so one look tells
+            # if the next level down is the leaves.
+            if len(children) == 0 or self._read_node(children[0]).k == INDEX_NODE_TYPE_LEAF :
+                return count
+            level = children
+
+    def _iter_keys(self) -> Iterable[Value] :
+        pending = [0]
+        while len(pending) > 0 :
+            node = self._read_node(pending.pop())
+            if node.k == INDEX_NODE_TYPE_LEAF :
+                yield from (x.key for x in cast(LeafNode, node).d)
+            else :
+                pending.extend(x.node_id for x in cast(InternalNode, node).d)
+
+    def _levels(self) -> list[list[IndexNode]] :
+        """Every node of the tree, level by level, left to right. Read
+        without going through the cache, so it doesn't push anything out.
+        """
+        levels : list[list[IndexNode]] = [[self.db_ctx.cache.peek(self.id, 0)]]
+        while levels[-1][0].k == INDEX_NODE_TYPE_INTERNAL :
+            levels.append([self.db_ctx.cache.peek(self.id, x.node_id)
+                           for n in levels[-1] for x in cast(InternalNode, n).d])
+        return levels
+
+    def stats(self) -> IndexStats :
+        """Height, node counts per level, fill and sizes of the tree.
+        Reads every node, so it takes about as long as a full scan.
+        """
+        if self.closed :
+            raise ValueError(f"Index {self.index_name} is closed.")
+
+        levels = self._levels()
+        leaf_items = [x for n in levels[-1] for x in cast(LeafNode, n).d]
+        return self._fill_stats(levels, leaf_items)
+
+    def reorganize(self, timeout : float | None = 30.0) -> IndexStats :
+        """Rebuild the tree in place with the bulk loader, packing the
+        leaves back to their starting fill. The new nodes are written
+        before the root is switched over to them, and the old ones are
+        removed after, along with any orphaned node files.
+        Waits up to `timeout` seconds for scans already running on the index
+        to finish, and raises ValueError if they don't. Scans started
+        meanwhile wait until it is done.
+        Returns the stats of the new tree.
+        """
+        self._check_writable()
+
+        with self.readers_changed :
+            if self.reorganizing :
+                raise ValueError(f"Index {self.index_name} is already being reorganized.")
+            self.reorganizing = True
+            if not self.readers_changed.wait_for(lambda : self.readers == 0, timeout) :
+                self.reorganizing = False
+                self.readers_changed.notify_all()
+                raise ValueError(f"Index {self.index_name} still has {self.readers} scans running.")
+
+        try :
+            levels = self._levels()
+            records = [x for n in levels[-1] for x in cast(LeafNode, n).d]
+            old_ids = self._node_ids_on_disk() - {0}
+
+            logger.debug(f"Reorganizing index {self.index_name} with {len(records)} entries in {sum(len(x) for x in levels)} nodes")
+            self._bulk_load(records)
+            for node_id in old_ids :
+                self.db_ctx.cache.delete(self.id, node_id)
+
+            # Drops the bits left behind by deleted keys, too.
+            self._build_bloom(r.key for r in records)
+        finally :
+            with self.readers_changed :
+                self.reorganizing = False
+                self.readers_changed.notify_all()
+
+        return self.stats()
+
     def print_tree(self) :
         """Output a representation of the index B+-Tree onto stdout.
         """
@@ -493,7 +1267,15 @@ class Index :
         self._print_tree(0, '')
         print("=== End of tree")
 
-    def scan(self, key : Any = None, op : str | None = None) -> Generator[int, Any, None]:
+    def scan(self, key : Any = None, op : str | None = None,
+             upper_key : Any = None, upper_op : str | None = None,
+             reverse : bool = False) -> Generator[int, Any, None]:
+        """Heap ids of the entries matching `op key`, in key order.
+        `upper_key` / `upper_op` add a second bound ('<' or '<=') so a range
+        like `lo <= x < hi` is a single walk of the leaves. With an upper
+        bound, `op` must be '>', '>=' or None.
+        With `reverse`, the same entries come back in descending key order.
+        """
         if self.closed :
             raise ValueError(f"Index {self.index_name} is closed.")
 
@@ -505,56 +1287,110 @@ class Index :
         if key is None and op is not None :
             raise ValueError("Cannot specify operator without key.")
 
-        logger.debug(f"--- Scanning index {self.index_name}, key = {key}, op = {op}, mapped_op = {mapped_op}")
+        mapped_upper = self._check_upper_bound(mapped_op, upper_key, upper_op)
 
-        for record in IndexIterator(self, self._gen_value(key), mapped_op) :
-            yield record
+        logger.debug(f"--- Scanning index {self.index_name}, key = {key}, op = {op}, mapped_op = {mapped_op}, upper = {mapped_upper} {upper_key}")
 
-    def close(self) :
-        if self.closed :
+        value = self._gen_value(key)
+        if mapped_op == 'eq' and self._definitely_absent(value) :
             return
-        # Let the table take care of deleting storage.
 
-        self.db_ctx.cache.unregister(self.id)
-        self.closed = True
+        upper_value = self._gen_value(upper_key) if mapped_upper is not None else None
+        iterator : IndexIterator
+        with self._reading() :
+            if not reverse :
+                iterator = IndexIterator(self, value, mapped_op, upper_value, mapped_upper)
+            elif mapped_op in ['lt', 'le'] :
+                iterator = ReverseIndexIterator(self, None, None, value, mapped_op)
+            elif mapped_op == 'eq' :
+                iterator = ReverseIndexIterator(self, value, 'ge', value, 'le')
+            else :
+                iterator = ReverseIndexIterator(self, value, mapped_op, upper_value, mapped_upper)
+            try :
+                for record in iterator :
+                    yield record
+            finally :
+                # Let go of the leaf if the caller stopped early.
+                iterator.close()
+
+    def delete(self, row : dict[str, Value], heap_id : int | None = None) :
+        """Remove the entry for the row from the index.
+        If `heap_id` is given, only the entry pointing at that row is removed,
+        otherwise the first entry with a matching key is.
+        Nodes that become under filled are merged or rebalanced.
+        """
+        self._check_writable()
 
-    def delete(self, row : dict[Any, Value]) :
-        if self.db_ctx.mode == "ro" :
-            raise ValueError("Database is in read-only mode.")
-        if self.closed :
-            raise ValueError(f"Index {self.index_name} is closed.")
+        if not self._covers(row) :
+            return
 
-        key = row[self._column]
-        tree_path = self._find_block2(key)
+        key = self._key(row)
+        tree_path = self._find_leftmost_path(key)
 
-        leaf_id, leaf_index = tree_path[-1]
+        found = False
+        while True :
+            leaf_id, leaf_index = tree_path[-1]
+            leaf = self._read_node(leaf_id)
+            if leaf.k == INDEX_NODE_TYPE_LEAF :
+                leaf = cast(LeafNode, leaf)
+            else :
+                raise ValueError(f"Invalid node type {leaf.k} for leaf node {leaf_id}")
+
+            while leaf_index < len(leaf.d) and leaf.d.keys[leaf_index] == key.raw :
+                if heap_id is None or leaf.d.ids[leaf_index] == heap_id :
+                    found = True
+                    break
+                leaf_index += 1
+
+            # Either found it or walked past the run of matching keys.
+            if found or leaf_index < len(leaf.d) :
+                break
 
-        if leaf_index == _INVALID_INDEX :
+            next_path = self._next_leaf_path(tree_path)
+            if next_path is None :
+                break
+            tree_path = next_path
+
+        if not found :
             raise ValueError(f"Key {key} not found in index {self.index_name}")
 
-        leaf = self._read_node(leaf_id)
-        if leaf.k == INDEX_NODE_TYPE_LEAF :
-            leaf = cast(LeafNode, leaf)
-        else :
-            raise ValueError(f"Invalid node type {leaf.k} for leaf node {leaf_id}")
+        logger.debug(f"--- deleting {key} at leaf {leaf_id} index {leaf_index}")
         del leaf.d[leaf_index]
-        self._write_node(leaf_id, leaf)
+
+        if leaf_index == 0 and len(leaf.d) > 0 :
+            self._fix_separator(leaf.d.key(0), tree_path[:-1])
+
+        self._rebalance(leaf, tree_path[:-1])
 
 
 #################################################################
 # Iterator
 #################################################################
 class IndexIterator :
-    def __init__(self, index : Index, key : Value | None = None, op : str | None = None) :
+    def __init__(self, index : Index, key : Value | None = None, op : str | None = None,
+                 upper_key : Value | None = None, upper_op : str | None = None) :
         # This assumes that parameter sanitizing has already been done.
         self.index = index
         self.key = key
         self.bound_key = key
         self.op = op
 
+        # Optional second bound, 'lt' or 'le', checked on every key.
+        self.upper_key = upper_key
+        self.upper_pyop = getattr(pyops, upper_op) if upper_op is not None else None
+
         #List of tuples of block_id and current index
         self.scan_path : TreePath = []
 
+        # The leaf being walked is pinned in the cache so it stays put
+        # between calls, even with other threads using the cache.
+        self.held_leaf : int | None = None
+
+        # Readahead - how many leaves to load ahead, and the parent and
+        # index in it that has been loaded up to.
+        self.window = 0
+        self.ahead : tpi | None = None
+
         if op in [None, 'le', 'lt'] :
             logger.debug(f"__init__ : scan_path_for_start")
             self.scan_path_for_start()
@@ -568,14 +1404,14 @@ class IndexIterator :
             raise RuntimeError(f"Not sure what to do with operator {op}")
 
         logger.debug(f"__init__ : starting scan_path = {self.scan_path}")
-        logger.debug(f"__init__ : pyops = {self.pyop.__name__ if self.pyop is not None else None}")
+        logger.debug(f"__init__ : pyops = {self.pyop.__name__ if self.pyop is not None else None}, upper = {upper_op} {upper_key}")
 
     def scan_path_for_start(self) :
         node = self.index._read_root()
         while node.k == INDEX_NODE_TYPE_INTERNAL :
             node = cast(InternalNode, node)
             self.scan_path.append(tpi(node.n, 0))
-            node = self.index._read_node(node.d[0].node_id)
+            node = self.index._read_node(node.d.ids[0])
         # append the leaf
         self.scan_path.append(tpi(node.n, 0))
 
@@ -583,8 +1419,45 @@ class IndexIterator :
         if self.key is None :
             raise RuntimeError("scan_path_for_key called with null key")
         self.bound_key = None
-        self.scan_path = self.index._find_block2(self.key, lower_bound=lower_bound)
+        if lower_bound :
+            # Duplicates can straddle leaves, so start at the left most candidate.
+            self.scan_path = self.index._find_leftmost_path(self.key)
+        else :
+            self.scan_path = self.index._find_block2(self.key, lower_bound=lower_bound)
+
+
+    def _past_end(self, key : Value) -> bool :
+        if self.pyop is not None and not self.pyop(key, self.key) :
+            return True
+        if self.upper_pyop is not None and not self.upper_pyop(key, self.upper_key) :
+            return True
+        return False
+
+    def _read_ahead(self, parent : InternalNode, i : int) :
+        """The scan has moved on to the next leaf, so it is reading leaves
+        in order. Start loading the ones after it, under the same parent, in
+        the background. The window doubles each leaf, up to scan_readahead.
+        """
+        self.window = min(self.index.db_ctx.options.scan_readahead, max(1, self.window * 2))
+        start = i + 1
+        if self.ahead is not None and self.ahead.block_id == parent.n :
+            start = max(start, self.ahead.index)
+        end = min(len(parent.d), i + 1 + self.window)
+        if start < end :
+            self.ahead = tpi(parent.n, end)
+            self.index._read_ahead(parent.d.ids[start:end])
+
+    def _hold(self, leaf_id : int) :
+        if self.held_leaf == leaf_id :
+            return
+        self.close()
+        self.index._pin_node(leaf_id)
+        self.held_leaf = leaf_id
 
+    def close(self) :
+        if self.held_leaf is not None :
+            self.index._unpin_node(self.held_leaf)
+            self.held_leaf = None
 
     def __iter__(self) :
         return self
@@ -593,6 +1466,13 @@ class IndexIterator :
         '''Returns the row heap id.
         Assumes the key has already been skipped if it is not to be included.
         '''
+        try :
+            return self._next()
+        except StopIteration :
+            self.close()
+            raise
+
+    def _next(self) -> int :
         logger.debug(f"__next__: scan_path = {self.scan_path}")
         if len(self.scan_path) == 0 :
             logger.debug(f"__next__: scan_path is empty - Stopping")
@@ -602,40 +1482,85 @@ class IndexIterator :
         node = self.index._read_node(path_item.block_id)
         if node.k == INDEX_NODE_TYPE_LEAF :
             node = cast(LeafNode, node)
+            self._hold(node.n)
             logger.debug(f"__next__: leaf node = {node.n}, {node.k}, {len(node.d)}")
             if path_item.index >= len(node.d) :
                 logger.debug(f"__next__: path_item.index >= len(node.d)")
-                return self.__next__()
+                return self._next()
             else :
-                if self.pyop is not None and not self.pyop(node.d[path_item.index].key, self.key) :
+                if self._past_end(node.d.key(path_item.index)) :
                     raise StopIteration
                 self.scan_path.append(tpi(node.n, path_item[1]+1))
-                logger.debug(f"__next__: (leaf) returning {node.d[path_item.index].heap_id:016X}")
-                return node.d[path_item.index].heap_id
+                heap_id = node.d.ids[path_item.index]
+                logger.debug(f"__next__: (leaf) returning {heap_id:016X}")
+                return heap_id
         else :
             node = cast(InternalNode, node)
             logger.debug(f"__next__: internal node = {node.n}, {node.k}, {len(node.d)}")
             if path_item.index >= len(node.d) - 1:
                 logger.debug(f"__next__: path_item.index >= len(node.d) - 1")
-                return self.__next__()
+                return self._next()
             else :
                 current_index = path_item.index+1
-                logger.debug(f"__next__: path_item.index < len(node.d) - 1 current_index = {current_index} current_key = {node.d[current_index].key}")
-                if self.pyop is not None and not self.pyop(node.d[current_index].key, self.key) :
-                    logger.debug(f"__next__: not {self.pyop.__name__}({node.d[current_index].key}, {self.key})")
+                current_key = node.d.key(current_index)
+                logger.debug(f"__next__: path_item.index < len(node.d) - 1 current_index = {current_index} current_key = {current_key}")
+                if self._past_end(current_key) :
+                    logger.debug(f"__next__: past the end at {current_key}")
                     raise StopIteration
                 self.scan_path.append(tpi(node.n, current_index))
-                node = self.index._read_node(node.d[current_index].node_id)
+                if self.index.db_ctx.options.scan_readahead > 0 :
+                    self._read_ahead(node, current_index)
+                node = self.index._read_node(node.d.ids[current_index])
                 while node.k == INDEX_NODE_TYPE_INTERNAL :
                     node = cast(InternalNode, node)
                     self.scan_path.append(tpi(node.n, 0))
-                    node = self.index._read_node(node.d[0].node_id)
+                    node = self.index._read_node(node.d.ids[0])
                 # append the leaf
                 node = cast(LeafNode, node)
+                if len(node.d) == 0 :
+                    # Nothing in it - move on to the next leaf.
+                    self.scan_path.append(tpi(node.n, 0))
+                    return self._next()
+                self._hold(node.n)
                 # we will return the first key below, set lets skip it.
                 self.scan_path.append(tpi(node.n, 1))
-                if self.pyop is not None and not self.pyop(node.d[0].key, self.key) :
+                if self._past_end(node.d.key(0)) :
                     raise StopIteration
 
-                logger.debug(f"__next__: (internal) returning {node.d[0].heap_id:016X}")
-                return node.d[0].heap_id
+                logger.debug(f"__next__: (internal) returning {node.d.ids[0]:016X}")
+                return node.d.ids[0]
+
+
+class ReverseIndexIterator(IndexIterator) :
+    """Walks the leaves from right to left, from the upper bound down to
+    the lower one. The path from the root is kept as a stack, so moving to
+    the previous leaf only re-reads the internal nodes that change.
+    """
+    def __init__(self, index : Index, lower_key : Value | None = None, lower_op : str | None = None,
+                 upper_key : Value | None = None, upper_op : str | None = None) :
+        # This assumes that parameter sanitizing has already been done.
+        self.index = index
+        self.key = lower_key
+        self.pyop = getattr(pyops, lower_op) if lower_op is not None else None
+        self.held_leaf : int | None = None
+
+        self.reverse_path : TreePath | None = index._find_rightmost_path(upper_key, inclusive=(upper_op != 'lt'))
+        logger.debug(f"__init__ : reverse scan from {self.reverse_path}, lower = {lower_op} {lower_key}, upper = {upper_op} {upper_key}")
+
+    def _next(self) -> int :
+        while self.reverse_path is not None :
+            leaf_id, i = self.reverse_path[-1]
+            if i < 0 :
+                self.reverse_path = self.index._prev_leaf_path(self.reverse_path)
+                continue
+
+            leaf = cast(LeafNode, self.index._read_node(leaf_id))
+            self._hold(leaf_id)
+            if self.pyop is not None and not self.pyop(leaf.d.key(i), self.key) :
+                self.reverse_path = None
+                break
+
+            self.reverse_path[-1] = tpi(leaf_id, i - 1)
+            return leaf.d.ids[i]
+
+        raise StopIteration
@@ -1,5 +1,6 @@
 import msgpack
 from pathlib import Path
+import threading
 
 class IntegerIdGenerator:
     SaveInterval : int = 10
@@ -11,17 +12,20 @@ class IntegerIdGenerator:
             self.id = (msgpack.unpackb(self.cache_path.read_bytes()))['id']
             self.id += 2*self.SaveInterval
         self.count = 0
+        self.lock = threading.Lock()
 
     def gen_id(self) -> int :
-        self.count += 1
-        self.id += 1
-        if self.count == self.SaveInterval or self.on_first :
-            self.count = 0
-            with self.cache_path.open('wb') as f :
-                msgpack.dump({'id' : self.id}, f)
-            self.on_first = False
-        return self.id
+        with self.lock :
+            self.count += 1
+            self.id += 1
+            if self.count == self.SaveInterval or self.on_first :
+                self.count = 0
+                with self.cache_path.open('wb') as f :
+                    msgpack.dump({'id' : self.id}, f)
+                self.on_first = False
+            return self.id
 
     def close(self) :
-        with self.cache_path.open('wb') as f :
-            msgpack.dump({'id' : self.id}, f)
\ No newline at end of file
+        with self.lock :
+            with self.cache_path.open('wb') as f :
+                msgpack.dump({'id' : self.id}, f)
\ No newline at end of file
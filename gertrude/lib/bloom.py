@@ -0,0 +1,92 @@
+"""Blocked Bloom filter.
+
+Answers "is this key definitely not in the index?" without reading the
+index itself. Each key hashes to a single 64 byte block and sets a few bits
+inside it, so adding a key only rewrites that one block in the file.
+
+On disk it is a small header (block count, key count) followed by the
+blocks.
+
+Bloom filters can't forget a key, so deleted keys leave their bits behind.
+That only costs some extra false positives, and those go away the next
+time the filter is rebuilt.
+"""
+import hashlib
+from pathlib import Path
+import struct
+from typing import Iterable, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("<QQ")
+_BLOCK_BYTES = 64
+_BLOCK_BITS = _BLOCK_BYTES * 8
+
+# Roughly a 1% false positive rate.
+_BITS_PER_KEY = 10
+_PROBES = 7
+# 9 bits picks a bit within a block.
+_PROBE_SHIFT = 9
+_PROBE_MASK = _BLOCK_BITS - 1
+
+_MIN_BLOCKS = 16
+
+
+def _probe(key : bytes, blocks : int) -> Tuple[int, list[int]] :
+    """Byte offset of the key's block and the bits to check inside it."""
+    digest = hashlib.blake2b(key, digest_size=16).digest()
+    block = int.from_bytes(digest[:8], "little") % blocks
+    bits = int.from_bytes(digest[8:], "little")
+    return block * _BLOCK_BYTES, [(bits >> (i * _PROBE_SHIFT)) & _PROBE_MASK for i in range(_PROBES)]
+
+
+class BloomFilter :
+    def __init__(self, path : Path) :
+        self.path = path
+        data = path.read_bytes()
+        self.blocks, self.count = _HEADER.unpack_from(data)
+        self.bits = bytearray(data[_HEADER.size:])
+        if len(self.bits) != self.blocks * _BLOCK_BYTES :
+            raise ValueError(f"Bloom filter {path} is the wrong size.")
+
+    @classmethod
+    def create(cls, path : Path, keys : Iterable[bytes]) -> 'BloomFilter' :
+        """Write a new filter holding the keys, with room for as many again."""
+        keys = list(keys)
+        capacity = len(keys) * 2
+        blocks = max(_MIN_BLOCKS, (capacity * _BITS_PER_KEY + _BLOCK_BITS - 1) // _BLOCK_BITS)
+
+        bits = bytearray(blocks * _BLOCK_BYTES)
+        for key in keys :
+            base, probes = _probe(key, blocks)
+            for p in probes :
+                bits[base + (p >> 3)] |= 1 << (p & 7)
+
+        logger.debug(f"Creating bloom filter {path} with {blocks} blocks for {len(keys)} keys")
+        path.write_bytes(_HEADER.pack(blocks, len(keys)) + bits)
+        return cls(path)
+
+    @property
+    def capacity(self) -> int :
+        """Number of keys the filter can hold before it should be rebuilt bigger."""
+        return self.blocks * _BLOCK_BITS // _BITS_PER_KEY
+
+    def might_contain(self, key : bytes) -> bool :
+        base, probes = _probe(key, self.blocks)
+        bits = self.bits
+        for p in probes :
+            if not bits[base + (p >> 3)] & (1 << (p & 7)) :
+                return False
+        return True
+
+    def add(self, key : bytes) :
+        base, probes = _probe(key, self.blocks)
+        for p in probes :
+            self.bits[base + (p >> 3)] |= 1 << (p & 7)
+        self.count += 1
+
+        with self.path.open("r+b") as f :
+            f.write(_HEADER.pack(self.blocks, self.count))
+            f.seek(_HEADER.size + base)
+            f.write(self.bits[base:base + _BLOCK_BYTES])
@@ -1,15 +1,47 @@
-from dataclasses import dataclass, asdict
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, field
 from pathlib import Path
-from typing import OrderedDict, Tuple, cast
+import sys
+import threading
+from typing import Container, Tuple, cast
 import logging
 logger = logging.getLogger(__name__)
 
-from .types.index import INDEX_NODE_TYPE_LEAF, IndexNode, InternalNode, LeafNode
+from .types.index import (
+    INDEX_NODE_TYPE_DIRECTORY, INDEX_NODE_TYPE_INTERNAL, IndexNode, NodeEntries,
+    node_from_dict, node_to_dict
+    )
 
 from . import packer
+from .shared_cache import SharedBlockCache, block_generation, read_block, write_block
 
 type CacheKey = Tuple[int, int]
 
+# Every probe goes through these, so they are kept out of the eviction policy.
+PINNED_NODE_TYPES = frozenset([INDEX_NODE_TYPE_INTERNAL, INDEX_NODE_TYPE_DIRECTORY])
+
+# Number of locks that loads and writes of blocks are spread over.
+_LOAD_STRIPES = 16
+
+# Rough sizes of the python objects that make up a node.
+# Only meant to be close enough to size the cache by.
+_NODE_OVERHEAD = sys.getsizeof(object()) * 4 + 56
+_ENTRIES_OVERHEAD = 56 + 64 + 64   # NodeEntries, key list and id array
+_ENTRY_OVERHEAD = 8 + 8            # key list slot, id array slot
+_INT_SIZE = sys.getsizeof(1 << 40) + 8
+
+
+def node_bytes(node : IndexNode) -> int :
+    """Approximate memory used by a node once it is unpacked."""
+    size = _NODE_OVERHEAD
+    d = getattr(node, "d", ())
+    if isinstance(d, NodeEntries) :
+        size += _ENTRIES_OVERHEAD + sum(sys.getsizeof(x) + _ENTRY_OVERHEAD for x in d.keys)
+    else :
+        size += _INT_SIZE * len(d)
+    return size
+
 
 @dataclass
 class CacheStats:
@@ -21,90 +53,592 @@ class CacheStats:
     gets : int = 0
     puts : int = 0
     indexes : int = 0
+    policy : str = "lru"
+    # Counters specific to the eviction policy.
+    policy_stats : dict[str, int] = field(default_factory=dict)
+    # Approximate memory held by cached nodes, against the byte budget (0 = none).
+    bytes : int = 0
+    max_bytes : int = 0
+    # bytes held, by "table.index"
+    index_bytes : dict[str, int] = field(default_factory=dict)
+    # The pinned tier - upper index levels that are never evicted.
+    pinned_blocks : int = 0
+    pinned_bytes : int = 0
+    # blocks currently held with pin()
+    held_blocks : int = 0
+    # The tier shared between processes, if there is one.
+    shared_hits : int = 0
+    shared_misses : int = 0
+    # blocks loaded ahead of a scan by prefetch()
+    prefetches : int = 0
 
-class LRUCache :
+
+#################################################################
+# Eviction policies
+#################################################################
+def _pop_oldest(queue : OrderedDict[CacheKey, None], exclude : Container[CacheKey],
+                keep : CacheKey | None = None) -> CacheKey | None :
+    """Remove and return the oldest key not in `exclude` and not `keep`."""
+    for key in queue :
+        if key != keep and key not in exclude :
+            del queue[key]
+            return key
+    return None
+
+
+class EvictionPolicy(ABC) :
+    """Decides which block to throw out when the cache is full.
+    The policy only tracks keys - the cache itself holds the nodes.
+    """
+    name = ""
+
+    def __init__(self, max_size : int) :
+        self.max_size = max_size
+
+    @abstractmethod
+    def hit(self, key : CacheKey) :
+        """A block already in the cache was used."""
+
+    @abstractmethod
+    def admit(self, key : CacheKey) :
+        """A block was added to the cache."""
+
+    @abstractmethod
+    def discard(self, key : CacheKey) :
+        """A block was removed from the cache by the caller, not by eviction."""
+
+    @abstractmethod
+    def victim(self, exclude : Container[CacheKey] = ()) -> CacheKey | None :
+        """Pick a block to evict and forget about it. Blocks in `exclude`
+        are passed over and keep their place. None if there is no block
+        to pick.
+        """
+
+    def stats(self) -> dict[str, int] :
+        return {}
+
+
+class LRUPolicy(EvictionPolicy) :
+    """Evict the least recently used block."""
+    name = "lru"
+
+    def __init__(self, max_size : int) :
+        super().__init__(max_size)
+        self.order : OrderedDict[CacheKey, None] = OrderedDict()
+
+    def hit(self, key : CacheKey) :
+        self.order.move_to_end(key)
+
+    def admit(self, key : CacheKey) :
+        self.order[key] = None
+
+    def discard(self, key : CacheKey) :
+        self.order.pop(key, None)
+
+    def victim(self, exclude : Container[CacheKey] = ()) -> CacheKey | None :
+        return _pop_oldest(self.order, exclude)
+
+
+class TwoQPolicy(EvictionPolicy) :
+    """2Q (Johnson & Shasha).
+
+    New blocks go into a small FIFO (`a1in`). Blocks pushed out of it are
+    remembered, without their data, in a ghost list (`a1out`). Only a block
+    that is asked for again while it is a ghost makes it into the main LRU
+    (`am`). A scan touches each block once, so it churns through the FIFO
+    without disturbing the main list.
     """
-    A simple LRU cache implementation.
-    Use OrderedDict to keep track of the most recently used items.
+    name = "2q"
+
+    def __init__(self, max_size : int) :
+        super().__init__(max_size)
+        self.in_size = max(1, max_size // 4)
+        self.out_size = max(1, max_size // 2)
+        self.a1in : OrderedDict[CacheKey, None] = OrderedDict()
+        self.a1out : OrderedDict[CacheKey, None] = OrderedDict()
+        self.am : OrderedDict[CacheKey, None] = OrderedDict()
+        self.ghost_hits = 0
+
+    def hit(self, key : CacheKey) :
+        # A second use while still in the FIFO is usually correlated with
+        # the first (same scan or transaction), so it doesn't count.
+        if key in self.am :
+            self.am.move_to_end(key)
+
+    def admit(self, key : CacheKey) :
+        if key in self.a1out :
+            del self.a1out[key]
+            self.ghost_hits += 1
+            self.am[key] = None
+        else :
+            self.a1in[key] = None
+
+    def discard(self, key : CacheKey) :
+        self.a1in.pop(key, None)
+        self.am.pop(key, None)
+
+    def victim(self, exclude : Container[CacheKey] = ()) -> CacheKey | None :
+        if len(self.a1in) > self.in_size or len(self.am) == 0 :
+            order = [self.a1in, self.am]
+        else :
+            order = [self.am, self.a1in]
+
+        for queue in order :
+            key = _pop_oldest(queue, exclude)
+            if key is None :
+                continue
+            if queue is self.a1in :
+                self.a1out[key] = None
+                if len(self.a1out) > self.out_size :
+                    self.a1out.popitem(last=False)
+            return key
+        return None
+
+    def stats(self) -> dict[str, int] :
+        return {
+            "a1in" : len(self.a1in),
+            "a1out" : len(self.a1out),
+            "am" : len(self.am),
+            "ghost_hits" : self.ghost_hits,
+        }
+
+
+class ARCPolicy(EvictionPolicy) :
+    """Adaptive Replacement Cache (Megiddo & Modha).
+
+    `t1` holds blocks seen once recently, `t2` blocks seen at least twice.
+    `b1` and `b2` are ghost lists of keys recently evicted from each. A
+    miss that lands in a ghost list shows that list was cut too short, and
+    moves the target size `p` of `t1` toward it. Scans only ever fill `t1`,
+    so they can't push out the frequently used blocks in `t2`.
     """
+    name = "arc"
+
     def __init__(self, max_size : int) :
+        super().__init__(max_size)
+        self.p = 0
+        self.t1 : OrderedDict[CacheKey, None] = OrderedDict()
+        self.t2 : OrderedDict[CacheKey, None] = OrderedDict()
+        self.b1 : OrderedDict[CacheKey, None] = OrderedDict()
+        self.b2 : OrderedDict[CacheKey, None] = OrderedDict()
+        self.b1_hits = 0
+        self.b2_hits = 0
+        self._from_b2 = False
+        self._newest : CacheKey | None = None
+
+    def hit(self, key : CacheKey) :
+        self.t1.pop(key, None)
+        self.t2[key] = None
+        self.t2.move_to_end(key)
+
+    def admit(self, key : CacheKey) :
+        self._newest = key
+        self._from_b2 = False
+        if key in self.b1 :
+            self.b1_hits += 1
+            self.p = min(self.max_size, self.p + max(len(self.b2) // len(self.b1), 1))
+            del self.b1[key]
+            self.t2[key] = None
+        elif key in self.b2 :
+            self.b2_hits += 1
+            self._from_b2 = True
+            self.p = max(0, self.p - max(len(self.b1) // len(self.b2), 1))
+            del self.b2[key]
+            self.t2[key] = None
+        else :
+            self.t1[key] = None
+
+        # Keep the ghost lists from growing past the size of the cache.
+        while len(self.t1) + len(self.b1) > self.max_size and len(self.b1) > 0 :
+            self.b1.popitem(last=False)
+        while len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2) > 2 * self.max_size and len(self.b2) > 0 :
+            self.b2.popitem(last=False)
+
+    def discard(self, key : CacheKey) :
+        self.t1.pop(key, None)
+        self.t2.pop(key, None)
+
+    def victim(self, exclude : Container[CacheKey] = ()) -> CacheKey | None :
+        t1_len = len(self.t1)
+        if t1_len > 0 and (t1_len > self.p or (self._from_b2 and t1_len == self.p)) :
+            order = [(self.t1, self.b1), (self.t2, self.b2)]
+        else :
+            order = [(self.t2, self.b2), (self.t1, self.b1)]
+
+        # Never evict the block that is being added right now.
+        for resident, ghosts in order :
+            key = _pop_oldest(resident, exclude, self._newest)
+            if key is not None :
+                ghosts[key] = None
+                return key
+
+        # Only the block being added is left.
+        for resident, ghosts in order :
+            if self._newest in resident and self._newest not in exclude :
+                key = cast(CacheKey, self._newest)
+                del resident[key]
+                ghosts[key] = None
+                return key
+
+        return None
+
+    def stats(self) -> dict[str, int] :
+        return {
+            "p" : self.p,
+            "t1" : len(self.t1),
+            "t2" : len(self.t2),
+            "b1" : len(self.b1),
+            "b2" : len(self.b2),
+            "b1_hits" : self.b1_hits,
+            "b2_hits" : self.b2_hits,
+        }
+
+
+EVICTION_POLICIES : dict[str, type[EvictionPolicy]] = {
+    LRUPolicy.name : LRUPolicy,
+    TwoQPolicy.name : TwoQPolicy,
+    ARCPolicy.name : ARCPolicy,
+}
+
+
+#################################################################
+# Block cache
+#################################################################
+class LRUCache :
+    """
+    Block cache shared by all the indexes in a database.
+    Despite the name, the eviction policy is pluggable - see EVICTION_POLICIES.
+
+    If `pin_internal` is set, internal B+-Tree nodes and hash directories go
+    into a separate tier that is never evicted and doesn't count against
+    `max_size`. There are far fewer of them than leaves, and every lookup
+    starts by reading them. With a byte budget, the pinned tier counts
+    against `max_bytes` and is held to half of it.
+
+    The cache is safe to share between threads. One lock guards the
+    bookkeeping and is only held briefly. Reading and writing the block
+    files happens under one of a set of striped locks instead, so threads
+    loading different blocks don't wait on each other, while two threads
+    after the same block only read it once.
+
+    pin() / unpin() hold a block in the cache while it is in use - a held
+    block is passed over for eviction. Holds are counted, so every pin()
+    needs its own unpin().
+
+    If given a SharedBlockCache, blocks that miss are looked for there
+    before going to disk, and every block read or written is copied into it
+    for other processes to use.
+    """
+    def __init__(self, max_size : int, policy : str = LRUPolicy.name, max_bytes : int = 0,
+                 pin_internal : bool = False, shared : SharedBlockCache | None = None) :
+        if policy not in EVICTION_POLICIES :
+            raise ValueError(f"Invalid cache policy {policy} - must be one of {', '.join(EVICTION_POLICIES)}")
+        if max_bytes < 0 :
+            raise ValueError(f"Invalid cache byte budget {max_bytes}")
         self.max_size = max_size
-        self.cache : OrderedDict[CacheKey, IndexNode] = OrderedDict()
+        self.max_bytes = max_bytes
+        self.pin_internal = pin_internal
+        self.shared = shared
+        self.cache : dict[CacheKey, IndexNode] = {}
+        self.pinned : dict[CacheKey, IndexNode] = {}
+        self.policy = EVICTION_POLICIES[policy](max_size)
         self.paths : dict[int, Path] = {}
-        self._stats = CacheStats(size = max_size)
+
+        # approximate bytes per cached block, total and per index.
+        self.sizes : dict[CacheKey, int] = {}
+        self.bytes = 0
+        self.pinned_bytes = 0
+        self.index_bytes : dict[int, int] = {}
+
+        self.lock = threading.RLock()
+        self._stripes = [threading.Lock() for _ in range(_LOAD_STRIPES)]
+        # pin() counts
+        self.refs : dict[CacheKey, int] = {}
+
+        self._stats = CacheStats(size = max_size, policy = policy, max_bytes = max_bytes)
+
+    def _is_pinned(self, key : CacheKey, node : IndexNode) -> bool :
+        if not self.pin_internal or node.k not in PINNED_NODE_TYPES :
+            return False
+        if self.max_bytes == 0 :
+            return True
+        # The tier may fill up to half the byte budget. Past that, upper
+        # level nodes are cached like any other.
+        others = self.pinned_bytes - (self.sizes[key] if key in self.pinned else 0)
+        return others + node_bytes(node) <= self.max_bytes // 2
+
+    def _set_node(self, key : CacheKey, node : IndexNode) :
+        size = node_bytes(node)
+        delta = size - self.sizes.get(key, 0)
+        if key in self.pinned :
+            self.pinned[key] = node
+            self.pinned_bytes += delta
+        else :
+            self.cache[key] = node
+            self.bytes += delta
+        self.sizes[key] = size
+        self.index_bytes[key[0]] = self.index_bytes.get(key[0], 0) + delta
+
+    def _forget(self, key : CacheKey) :
+        size = self.sizes.pop(key)
+        if key in self.pinned :
+            del self.pinned[key]
+            self.pinned_bytes -= size
+        else :
+            del self.cache[key]
+            self.bytes -= size
+        self.index_bytes[key[0]] -= size
+
+    def _over_budget(self) -> bool :
+        if len(self.cache) > self.max_size :
+            return True
+        # Always keep at least the block just added.
+        return self.max_bytes > 0 and self.bytes + self.pinned_bytes > self.max_bytes and len(self.cache) > 1
+
+    def _trim(self) :
+        while self._over_budget() :
+            # Held blocks are skipped over, keeping their place in the policy.
+            key = self.policy.victim(exclude=self.refs)
+            # Everything left is in use - let the cache run over for now.
+            if key is None :
+                break
+            self._stats.evictions += 1
+            self._forget(key)
+
+    def _add(self, key : CacheKey, node : IndexNode) :
+        if self._is_pinned(key, node) :
+            self.pinned[key] = node
+            self._set_node(key, node)
+            return
+        self._set_node(key, node)
+        self.policy.admit(key)
+        self._trim()
+
+    def _stripe(self, key : CacheKey) -> threading.Lock :
+        return self._stripes[hash(key) % _LOAD_STRIPES]
+
+    def _drop(self, key : CacheKey) :
+        if key not in self.pinned :
+            self.policy.discard(key)
+        self._forget(key)
+
+    def _label(self, index : int) -> str :
+        # index directories live at <db>/tables/<table>/index/<index>
+        path = self.paths[index]
+        return f"{path.parent.parent.name}.{path.name}"
 
     def register(self, key, path : Path) :
-        self.paths[key] = path
+        with self.lock :
+            self.paths[key] = path
 
     def unregister(self, key) :
-        del self.paths[key]
+        with self.lock :
+            dead = [k for k in self.sizes if k[0] == key]
+            for k in dead :
+                self._drop(k)
+            for k in [k for k in self.refs if k[0] == key] :
+                del self.refs[k]
+            self.index_bytes.pop(key, None)
+            del self.paths[key]
 
-        dead = [k for k in self.cache if k[0] == key]
-        for k in dead :
-            del self.cache[k]
+    def close(self) :
+        """Let go of the shared tier. Blocks are read straight from disk
+        after this.
+        """
+        with self.lock :
+            shared, self.shared = self.shared, None
+        if shared is not None :
+            shared.close()
+            # The process that made the segment removes it, as it would at exit.
+            if shared.owner :
+                shared.unlink()
 
     @property
     def stats(self) :
-        self._stats.blocks = len(self.cache)
-        self._stats.indexes = len(self.paths)
-        # return a copy.
-        return CacheStats(**self._stats.__dict__)
+        with self.lock :
+            self._stats.blocks = len(self.cache)
+            self._stats.indexes = len(self.paths)
+            self._stats.policy_stats = self.policy.stats()
+            self._stats.bytes = self.bytes
+            self._stats.index_bytes = { self._label(k) : v for k, v in self.index_bytes.items() if k in self.paths }
+            self._stats.pinned_blocks = len(self.pinned)
+            self._stats.pinned_bytes = self.pinned_bytes
+            self._stats.held_blocks = len(self.refs)
+            if self.shared is not None :
+                self._stats.shared_hits = self.shared.hits
+                self._stats.shared_misses = self.shared.misses
+            # return a copy.
+            return CacheStats(**self._stats.__dict__)
 
-    def get(self, index : int, block_id : int) -> IndexNode:
-        if index not in self.paths :
-            raise Exception(f"Index {index} not registered")
+    def _lookup(self, key : CacheKey) -> IndexNode | None :
+        """Must be called holding self.lock."""
+        if key[0] not in self.paths :
+            raise Exception(f"Index {key[0]} not registered")
 
-        self._stats.gets += 1
+        if key in self.pinned :
+            self._stats.hits += 1
+            return self.pinned[key]
 
-        if (index, block_id) in self.cache :
+        if key in self.cache :
             self._stats.hits += 1
-            self.cache.move_to_end((index, block_id))
-            return self.cache[(index, block_id)]
-
-        self._stats.misses += 1
-        with open(self.paths[index] / f"{block_id:03}", "rb") as f :
-            data = packer.unpack(f.read())
-            if data['k'] == INDEX_NODE_TYPE_LEAF :
-                data = LeafNode(**data)
+            self.policy.hit(key)
+            return self.cache[key]
+
+        return None
+
+    def get(self, index : int, block_id : int) -> IndexNode:
+        key = (index, block_id)
+        with self.lock :
+            self._stats.gets += 1
+            node = self._lookup(key)
+            if node is not None :
+                return node
+            path = self.paths[index] / f"{block_id:03}"
+
+        with self._stripe(key) :
+            # Somebody else may have loaded it while we waited.
+            with self.lock :
+                node = self._lookup(key)
+                if node is not None :
+                    return node
+                self._stats.misses += 1
+
+            node = self._load(index, block_id, path)
+
+            with self.lock :
+                if index in self.paths :
+                    self._add(key, node)
+            return node
+
+    def _load(self, index : int, block_id : int, path : Path) -> IndexNode :
+        """Read a block, from the shared tier if there is one.
+        Must be called holding the block's stripe lock."""
+        shared = self.shared
+        raw = None
+        if shared is not None :
+            raw = shared.get(index, block_id, block_generation(path))
+        if raw is None :
+            generation, raw = read_block(path)
+            if shared is not None :
+                shared.put(index, block_id, generation, raw)
+        return node_from_dict(packer.unpack(raw))
+
+    def prefetch(self, index : int, block_id : int) -> IndexNode | None :
+        """Load a block into the cache before it is asked for. Doesn't count
+        as a get, hit or miss, and a block already cached is left where it
+        is in the eviction order. Returns None if the index or the block has
+        gone away in the meantime.
+        """
+        key = (index, block_id)
+        with self._stripe(key) :
+            with self.lock :
+                if index not in self.paths :
+                    return None
+                node = self.pinned.get(key) or self.cache.get(key)
+                if node is not None :
+                    return node
+                path = self.paths[index] / f"{block_id:03}"
+
+            try :
+                node = self._load(index, block_id, path)
+            except FileNotFoundError :
+                return None
+
+            with self.lock :
+                if index in self.paths and key not in self.sizes :
+                    self._stats.prefetches += 1
+                    self._add(key, node)
+            return node
+
+    def peek(self, index : int, block_id : int) -> IndexNode :
+        """Get a block without adding it to the cache or counting a hit or
+        miss. For walking a whole index without pushing out the hot blocks.
+        """
+        key = (index, block_id)
+        with self.lock :
+            if index not in self.paths :
+                raise Exception(f"Index {index} not registered")
+            node = self.pinned.get(key) or self.cache.get(key)
+            if node is not None :
+                return node
+            path = self.paths[index] / f"{block_id:03}"
+
+        return node_from_dict(packer.unpack(read_block(path)[1]))
+
+    def pin(self, index : int, block_id : int) -> IndexNode :
+        """Get a block and hold it in the cache until unpin() is called."""
+        key = (index, block_id)
+        with self.lock :
+            # Count it first so it can't be evicted as it is loaded.
+            self.refs[key] = self.refs.get(key, 0) + 1
+        try :
+            return self.get(index, block_id)
+        except Exception :
+            self.unpin(index, block_id)
+            raise
+
+    def unpin(self, index : int, block_id : int) :
+        key = (index, block_id)
+        with self.lock :
+            count = self.refs.get(key, 0) - 1
+            if count > 0 :
+                self.refs[key] = count
             else :
-                data = InternalNode(**data)
-            self.cache[(index, block_id)] = data
-            if len(self.cache) > self.max_size :
-                self._stats.evictions += 1
-                self.cache.popitem(last=False)
-            return data
+                self.refs.pop(key, None)
+                # Catch up on anything skipped while it was held.
+                self._trim()
 
     def put(self, index : int, block_id : int, node : IndexNode, cache : bool = True) -> None :
-        if index not in self.paths :
-            raise Exception(f"Index {index} not registered")
+        key = (index, block_id)
+        with self._stripe(key) :
+            with self.lock :
+                if index not in self.paths :
+                    raise Exception(f"Index {index} not registered")
 
-        self._stats.puts += 1
+                self._stats.puts += 1
 
-        if cache :
-            if (index, block_id) in self.cache :
-                self._stats.hits += 1
-                self.cache.move_to_end((index, block_id))
+                # A block that changes tier is dropped and added back.
+                if key in self.sizes and (key in self.pinned) != self._is_pinned(key, node) :
+                    self._drop(key)
 
-            self.cache[(index, block_id)] = node
-            if len(self.cache) > self.max_size :
-                self._stats.evictions += 1
-                self.cache.popitem(last=False)
+                if cache :
+                    if key in self.pinned :
+                        self._stats.hits += 1
+                        self._set_node(key, node)
+                    elif key in self.cache :
+                        self._stats.hits += 1
+                        self.policy.hit(key)
+                        self._set_node(key, node)
+                        self._trim()
+                    else :
+                        self._add(key, node)
 
-        elif (index, block_id) in self.cache :
-            del self.cache[(index, block_id)]
+                elif key in self.sizes :
+                    self._drop(key)
 
-        if node.k == INDEX_NODE_TYPE_LEAF :
-            node = cast(LeafNode, node)
-        else :
-            node = cast(InternalNode, node)
+                path = self.paths[index] / f"{block_id:03}"
 
-        data = {
-            "k" : node.k,
-            "n" : node.n,
-            "d" : node.d
-        }
+            logger.debug(f"Writing {node.k} {block_id} ({len(getattr(node, 'd', ()))})")
+
+            raw = packer.pack(node_to_dict(node))
+            generation = write_block(path, raw)
+
+            shared = self.shared
+            if shared is not None :
+                shared.put(index, block_id, generation, raw)
+
+    def delete(self, index : int, block_id : int) -> None :
+        """Drop a block from the cache and remove its file."""
+        key = (index, block_id)
+        with self._stripe(key) :
+            with self.lock :
+                if index not in self.paths :
+                    raise Exception(f"Index {index} not registered")
+
+                if key in self.sizes :
+                    self._drop(key)
+                self.refs.pop(key, None)
 
-        logger.debug(f"Writing {data}")
+                path = self.paths[index] / f"{block_id:03}"
 
-        with open(self.paths[index] / f"{block_id:03}", "wb") as f :
-            f.write(packer.pack(data))
+            path.unlink(missing_ok=True)
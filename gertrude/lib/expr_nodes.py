@@ -3,6 +3,8 @@ from dataclasses import dataclass
 from .types.value import Value, valueTrue, valueFalse, valueNull, valueStr
 from typing import Any, Callable, List
 
+import operator as pyops
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -265,4 +267,76 @@ class DataVar(ExprNode) :
         return f"row['{self.name_}']"
 
     def __repr__(self) :
-        return f"DataVar({self.name_})"
\ No newline at end of file
+        return f"DataVar({self.name_})"
+
+
+def same_expr(a : Any, b : Any) -> bool :
+    """True if two expression trees have the same shape, operators, columns
+    and literals - i.e. they always compute the same value.
+    """
+    if isinstance(a, Value) and isinstance(b, Value) :
+        return a.raw == b.raw
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)) :
+        return len(a) == len(b) and all(same_expr(x, y) for x, y in zip(a, b))
+    if isinstance(a, ExprNode) or isinstance(b, ExprNode) :
+        if type(a) is not type(b) or vars(a).keys() != vars(b).keys() :
+            return False
+        return all(same_expr(v, vars(b)[k]) for k, v in vars(a).items())
+    return a == b
+
+def conjuncts(expr : ExprNode) -> list[ExprNode] :
+    """Split a chain of ANDs into its parts. A row passes a filter on
+    `a and b` exactly when it passes both `a` and `b`.
+    """
+    if isinstance(expr, Operation) and expr.name == 'v_and' :
+        return conjuncts(expr.left) + conjuncts(expr.right)
+    return [expr]
+
+# `literal op term` is the same test as `term flipped op literal`.
+_FLIPPED = { 'eq' : pyops.eq, 'lt' : pyops.gt, 'gt' : pyops.lt, 'le' : pyops.ge, 'ge' : pyops.le }
+
+def normalize(expr : ExprNode) -> ExprNode :
+    """Put the literal of a comparison on the right, so `5 < x` becomes
+    `x > 5`. Anything else is returned as it is.
+    """
+    if isinstance(expr, Operation) and expr.name in _FLIPPED \
+        and isinstance(expr.left, Literal) and not isinstance(expr.right, Literal) :
+        return Operation(expr.category, _FLIPPED[expr.name], expr.right, expr.left)
+    return expr
+
+def _bound_implies(cond : ExprNode, pred : ExprNode) -> bool :
+    """True if `term op literal` in cond makes the one in pred true,
+    e.g. `x > 10` implies `x >= 5`.
+    """
+    if not isinstance(cond, Operation) or not isinstance(pred, Operation) :
+        return False
+    if not isinstance(cond.right, Literal) or not isinstance(pred.right, Literal) :
+        return False
+    if not same_expr(cond.left, pred.left) :
+        return False
+
+    have, want = cond.right.value, pred.right.value
+    if have.is_null or want.is_null or have.type != want.type :
+        return False
+
+    match pred.name, cond.name :
+        case ('ge', 'ge') | ('ge', 'gt') | ('ge', 'eq') :
+            return bool(have >= want)
+        case ('gt', 'gt') :
+            return bool(have >= want)
+        case ('gt', 'ge') | ('gt', 'eq') :
+            return bool(have > want)
+        case ('le', 'le') | ('le', 'lt') | ('le', 'eq') :
+            return bool(have <= want)
+        case ('lt', 'lt') :
+            return bool(have <= want)
+        case ('lt', 'le') | ('lt', 'eq') :
+            return bool(have < want)
+    return False
+
+def implies(conds : list[ExprNode], pred : ExprNode) -> bool :
+    """True if rows passing every condition in `conds` are sure to pass
+    `pred`. Only spots the easy cases - each part of `pred` has to be one
+    of the conditions, or a looser bound on the same term as one of them.
+    """
+    return all(any(same_expr(c, p) or _bound_implies(c, p) for c in conds) for p in conjuncts(pred))
@@ -2,8 +2,9 @@
 The current implementation assumes heap blocks are only written once.
 Data changes must be implemented with a read/delete/write cycle.
 """
-from typing import Any
+from typing import Any, Iterable
 from nanoid import generate
+import os
 from pathlib import Path
 from . import packer
 
@@ -58,3 +59,23 @@ def delete(heap : Path, hash_id : str | int | bytes | HeapID) -> Any :
     heap_path.unlink()
 
     return retval
+
+def prefetch(heap : Path, hash_ids : Iterable[str | int | bytes | HeapID]) :
+    """Hint to the OS that the rows are about to be read, so it can start
+    fetching them. Where posix_fadvise() isn't available the files are
+    read instead, which has much the same effect.
+    """
+    for hash_id in hash_ids :
+        heap_path = heap / heap_id_to_heap_path(hash_id)
+        try :
+            if hasattr(os, "posix_fadvise") :
+                fd = os.open(heap_path, os.O_RDONLY)
+                try :
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally :
+                    os.close(fd)
+            else :
+                heap_path.read_bytes()
+        except FileNotFoundError :
+            # Deleted since the index was read.
+            pass
@@ -1,8 +1,9 @@
+import copy
 from dataclasses import dataclass
 from enum import Enum
 from itertools import islice
+import heapq
 import itertools
-from types import GeneratorType
 from typing import Any, Iterable, List, Tuple, cast, override
 
 from gertrude.lib.types.colref import ColRef
@@ -24,9 +25,15 @@ class OpType(Enum) :
     limit = "limit"
     join = "join"
     rename = "rename"
+    top_n = "top_n"
 
 @dataclass
 class QueryOp :
+    """One step of a query. run() takes the rows from the step before and
+    hands back its own, lazily where it can. Only the steps that have to
+    see every row before they can produce any - sort, and the build side of
+    a join - hold rows in memory.
+    """
     op : OpType
 
     def run(self, data : Iterable[dict[str, Value]]) -> Iterable[dict[str, Value]]:
@@ -95,11 +102,9 @@ class FilterOp(QueryOp) :
     @override
     def run(self, data : Iterable[dict[str, Value]]) -> Iterable[dict[str, Value]] :
         logger.debug(f"Filtering by {self.exprs}")
-        retval : list[dict] = []
         for row in data :
             if all(f.calc(row) for f in self.exprs) :
-                retval.append(row)
-        return retval
+                yield row
 
     @override
     def columns(self, in_cols : set[ColRef]) -> set[ColRef] :
@@ -123,10 +128,7 @@ class SortOp(QueryOp) :
     def run(self, data : Iterable[dict[str, Value]]) -> Iterable[dict[str, Any]] :
         logger.debug(f"Sorting by {self.spec}")
         # Sort must have a list to work with.
-        if isinstance(data, GeneratorType) :
-            retval = [ x for x in data ]
-        else :
-            retval = cast(list[dict[str, Value]], data)
+        retval = list(data)
         logger.debug(f"row count in = {len(retval)}")
         # python sort is stable, so we sort with minor keys first
         # and then the relative ordering is maintained as we sort
@@ -141,6 +143,59 @@ class SortOp(QueryOp) :
     def columns(self, in_cols : set[ColRef]) -> set[ColRef] :
         return in_cols
 
+class _Reversed :
+    """Sorts the other way round to the bytes it holds."""
+    __slots__ = ("raw",)
+
+    def __init__(self, raw : bytes) :
+        self.raw = raw
+
+    def __lt__(self, other : '_Reversed') -> bool :
+        return other.raw < self.raw
+
+    def __eq__(self, other : object) -> bool :
+        return isinstance(other, _Reversed) and self.raw == other.raw
+
+class TopNOp(QueryOp) :
+    """A sort followed by a limit. Only the rows that can still make it
+    into the result are kept, in a heap, rather than sorting them all.
+    Put in by the planner - queries are written with sort() and limit().
+    """
+    def __init__(self, spec : List[SortSpec], limit : int, offset : int = 0) :
+        super().__init__(OpType.top_n)
+
+        self.spec_ = spec
+        self.limit_ = limit
+        self.offset_ = offset
+
+    def __str__(self) :
+        if self.offset_ > 0 :
+            return f"TopN({self.spec}, {self.limit}, offset={self.offset_})"
+        return f"TopN({self.spec}, {self.limit})"
+
+    @property
+    def spec(self) -> list[SortSpec]:
+        return self.spec_
+
+    @property
+    def limit(self) -> int :
+        return self.limit_
+
+    @override
+    def run(self, data : Iterable[dict[str, Value]]) -> Iterable[dict[str, Value]] :
+        logger.debug(f"Top {self.limit} (offset {self.offset_}) by {self.spec}")
+        # Values order by their raw bytes, so the key is those - turned
+        # around for the descending parts. nsmallest() is stable, just
+        # like the sort.
+        spec = [(s.expr, s.order == "desc") for s in self.spec]
+        def key(row : dict[str, Value]) -> tuple :
+            return tuple(_Reversed(expr.calc(row).raw) if desc else expr.calc(row).raw for expr, desc in spec)
+        return heapq.nsmallest(self.limit_ + self.offset_, data, key=key)[self.offset_:]
+
+    @override
+    def columns(self, in_cols : set[ColRef]) -> set[ColRef] :
+        return in_cols
+
 class DistinctOp(QueryOp) :
     def __init__(self, keys : List[str]) :
         super().__init__(OpType.distinct)
@@ -155,7 +210,6 @@ class DistinctOp(QueryOp) :
     def run(self, data : Iterable[dict[str, Value]]) -> Iterable[dict[str, Value]] :
         logger.debug(f"Distinct by {self.keys}")
         seen : set[tuple] = set()
-        retval : list[dict] = []
         keys : list[str] = self.keys
         for row in data :
             if len(keys) == 0 :
@@ -164,8 +218,7 @@ class DistinctOp(QueryOp) :
             key = tuple(row[c] for c in keys)
             if key not in seen :
                 seen.add(key)
-                retval.append(row)
-        return retval
+                yield row
 
     @override
     def columns(self, in_cols : set[ColRef]) -> set[ColRef] :
@@ -185,10 +238,9 @@ class ProjectOp(QueryOp) :
     def run(self, data : Iterable[dict[str, Value]]) -> Iterable[dict[str, Value]] :
         logger.debug(f"Projecting (retain = {self.retain}) {self.column_list}")
         if self.retain :
-            retval = [ {**x, **{ c : e.calc(x) for c,e in self.column_list }} for x in data ]
+            return ( {**x, **{ c : e.calc(x) for c,e in self.column_list }} for x in data )
         else :
-            retval = [ { c : e.calc(x) for c,e in self.column_list } for x in data ]
-        return retval
+            return ( { c : e.calc(x) for c,e in self.column_list } for x in data )
 
     def columns(self, in_cols : set[ColRef]) -> set[ColRef] :
         new_cols = set([ ColRef(c) for c,e in self.column_list ])
@@ -209,8 +261,7 @@ class RenameOp(QueryOp) :
     @override
     def run(self, data : Iterable[dict[str, Value]]) -> Iterable[dict[str, Value]] :
         logger.debug(f"Renaming {self.column_map}")
-        retval = [ { self.column_map.get(c,c) :  x[c] for c in x } for x in data ]
-        return retval
+        return ( { self.column_map.get(c,c) :  x[c] for c in x } for x in data )
 
     def columns(self, in_cols : set[ColRef]) -> set[ColRef] :
         colref_map = { ColRef(c) : ColRef(e) for c,e in self.column_map.items() }
@@ -231,21 +282,30 @@ class RenameOp(QueryOp) :
         return retval
 
 class LimitOp(QueryOp) :
-    def __init__(self, limit : int) :
+    def __init__(self, limit : int, offset : int = 0) :
         super().__init__(OpType.limit)
 
+        if limit < 0 or offset < 0 :
+            raise ValueError("limit and offset can't be negative")
         self.limit_ = limit
+        self.offset_ = offset
 
     def __str__(self) :
+        if self.offset_ > 0 :
+            return f"Limit({self.limit}, offset={self.offset_})"
         return f"Limit({self.limit})"
 
     @property
     def limit(self) -> int :
         return self.limit_
 
+    @property
+    def offset(self) -> int :
+        return self.offset_
+
     @override
-    def run(self, data : Iterable[dict[str, Value]] ) -> list[dict[str, Value]] :
-        return list(islice(data, self.limit))
+    def run(self, data : Iterable[dict[str, Value]] ) -> Iterable[dict[str, Value]] :
+        return islice(data, self.offset_, self.offset_ + self.limit_)
 
     def columns(self, in_cols : set[ColRef]) -> set[ColRef] :
         return in_cols
@@ -272,10 +332,32 @@ class JoinOp(QueryOp) :
             self.left_rename_, self.right_rename_ = ('_left', '_right')
         else :
             self.rename_ = False
+        # Which side is held in memory as the hash table.
+        self.build_ = "right"
 
     def __str__(self) :
+        if self.build_ == "left" :
+            return f"Join({self.right_}, build left)"
         return f"Join({self.right_})"
 
+    @property
+    def how(self) -> str :
+        return self.how_
+
+    @property
+    def right(self) -> Any :
+        return self.right_
+
+    def build_left(self) -> 'JoinOp' :
+        """A copy that hashes the left side and streams the right, for
+        when the left is the smaller. Inner joins only.
+        """
+        if self.how_ != "inner" :
+            raise ValueError("Only an inner join can build from the left side")
+        join = copy.copy(self)
+        join.build_ = "left"
+        return join
+
     def _compute_key_maps(self, left_cols : set[str], right_cols : set[str]) -> tuple[dict[str, str], dict[str, str]] :
         if self.rename_ :
             same_keys = left_cols & right_cols
@@ -295,47 +377,73 @@ class JoinOp(QueryOp) :
         else :
             raise ValueError(f"'on' must be a string or tuple, got {type(self.on_)}")
 
-        left_row = next(iter(data))
-        right_row = next(iter(self.right_.run(values=True)))
+        if self.build_ == "left" :
+            yield from self._run_build_left(data, left_col, right_col)
+            return
 
-        empty_row : dict[str, Value] = { k : valueNull() for k in right_row.keys() }
-        logger.debug(f"empty_row = {empty_row}")
-
-        left_keys = set(left_row.keys())
-        right_keys = set(right_row.keys())
-        left_key_map, right_key_map = self._compute_key_maps(left_keys, right_keys)
+        data = iter(data)
+        left_row = next(data, None)
+        if left_row is None :
+            return
 
+        # The right side is the one held in memory.
         hash_map : dict[Value, list[dict[str, Value]]] = {}
-        for lrow in self.right_.run(values=True) :
-
-            logger.debug(f"-- right row = {lrow}")
-
-            key = lrow[right_col]
+        right_row : dict[str, Value] = {}
+        for rrow in self.right_.iter(values=True) :
+            right_row = rrow
+            key = rrow[right_col]
             if key in hash_map :
-                hash_map[key].append(lrow)
+                hash_map[key].append(rrow)
             else :
-                hash_map[key] = [lrow]
+                hash_map[key] = [rrow]
 
         logger.debug(f"hash_map count = {len(hash_map)}")
-        logger.debug(f"hash_map = {hash_map}")
 
-        retval : list[dict[str, Value]] = []
+        if len(hash_map) > 0 :
+            right_names = list(right_row.keys())
+        else :
+            # No rows to take the names from.
+            right_names = sorted(c.name for c in self.right_.columns())
+        empty_row : dict[str, Value] = { k : valueNull() for k in right_names }
+        logger.debug(f"empty_row = {empty_row}")
+
+        left_keys = set(left_row.keys())
+        right_keys = set(right_names)
+        left_key_map, right_key_map = self._compute_key_maps(left_keys, right_keys)
+
+        if self.how_ not in ("inner", "left_outer") :
+            raise ValueError(f"how must be one of inner or left_outer, got {self.how_}")
+
         for lrow in itertools.chain([left_row], data) :
             key = lrow[left_col]
-            if self.how_ == "inner" :
-                if key in hash_map :
-                    retval.extend([{**{left_key_map.get(k,k) : v for k,v in lrow.items()},
-                                    **{right_key_map.get(k,k) : v for k,v in x.items()}} for x in hash_map[key]])
+            if key in hash_map :
+                for x in hash_map[key] :
+                    yield {**{left_key_map.get(k,k) : v for k,v in lrow.items()},
+                           **{right_key_map.get(k,k) : v for k,v in x.items()}}
             elif self.how_ == "left_outer" :
-                if key in hash_map :
-                    retval.extend([{**{left_key_map.get(k,k) : v for k,v in lrow.items()},
-                                    **{right_key_map.get(k,k) : v for k,v in x.items()}} for x in hash_map[key]])
-                else :
-                    retval.append({**{left_key_map.get(k,k) : v for k,v in lrow.items()},
-                                   **{right_key_map.get(k,k) : v for k,v in empty_row.items()}})
-            else :
-                raise ValueError(f"how must be one of inner or left_outer, got {self.how_}")
-        return retval
+                yield {**{left_key_map.get(k,k) : v for k,v in lrow.items()},
+                       **{right_key_map.get(k,k) : v for k,v in empty_row.items()}}
+
+    def _run_build_left(self, data : Iterable[dict[str, Value]], left_col : str, right_col : str) -> Iterable[dict[str, Value]] :
+        hash_map : dict[Value, list[dict[str, Value]]] = {}
+        left_row : dict[str, Value] = {}
+        for lrow in data :
+            left_row = lrow
+            hash_map.setdefault(lrow[left_col], []).append(lrow)
+        logger.debug(f"hash_map count = {len(hash_map)} (left side)")
+        if len(hash_map) == 0 :
+            return
+
+        right = iter(self.right_.iter(values=True))
+        right_row = next(right, None)
+        if right_row is None :
+            return
+        left_key_map, right_key_map = self._compute_key_maps(set(left_row.keys()), set(right_row.keys()))
+
+        for rrow in itertools.chain([right_row], right) :
+            for x in hash_map.get(rrow[right_col], ()) :
+                yield {**{left_key_map.get(k,k) : v for k,v in x.items()},
+                       **{right_key_map.get(k,k) : v for k,v in rrow.items()}}
 
     def columns(self, left_cols : set[ColRef]) -> set[ColRef] :
         """This isn't quite right as it totally ignore aliasing.
@@ -0,0 +1,92 @@
+"""Row positions for a table.
+
+Heap ids are random, so they can't be used directly as bit positions.
+The row map gives every row in a table a small, stable integer position.
+All bitmap indexes on the table share it, which is what lets their
+bitmaps be combined.
+
+On disk it is an append only file of 8 byte heap ids - the position is
+the offset in the file. Positions are never reused. A deleted row has its
+slot zeroed out.
+"""
+from array import array
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import logging
+logger = logging.getLogger(__name__)
+
+_SLOT_SIZE = array('Q').itemsize
+
+# For each byte value, the positions of the bits that are set.
+_BYTE_BITS = tuple(tuple(i for i in range(8) if b & (1 << i)) for b in range(256))
+
+
+def iter_bits(bitmap : int) -> Iterator[int] :
+    """Positions of the set bits in the bitmap, lowest first."""
+    if bitmap <= 0 :
+        return
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for offset, b in enumerate(data) :
+        if b :
+            base = offset * 8
+            for i in _BYTE_BITS[b] :
+                yield base + i
+
+
+class RowMap :
+    def __init__(self, path : Path) :
+        self.path = path
+        self.ids = array('Q')
+        self.positions : dict[int, int] = {}
+        # bitmap of the positions that hold a live row
+        self.live = 0
+
+        if path.exists() :
+            self.ids.frombytes(path.read_bytes())
+            live = bytearray((len(self.ids) + 7) // 8)
+            for pos, heap_id in enumerate(self.ids) :
+                if heap_id != 0 :
+                    self.positions[heap_id] = pos
+                    live[pos >> 3] |= 1 << (pos & 7)
+            self.live = int.from_bytes(live, "little")
+            logger.debug(f"Loaded row map {path} with {len(self.positions)} rows")
+
+    @classmethod
+    def create(cls, path : Path, heap_ids : Iterable[int]) -> 'RowMap' :
+        # Hand out positions in heap order so that walking a
+        # bitmap also walks the heap in order.
+        ids = array('Q', sorted(heap_ids))
+        path.write_bytes(ids.tobytes())
+        return cls(path)
+
+    def __len__(self) -> int :
+        return len(self.positions)
+
+    def add(self, heap_id : int) -> int :
+        pos = len(self.ids)
+        self.ids.append(heap_id)
+        self.positions[heap_id] = pos
+        self.live |= 1 << pos
+        with self.path.open("ab") as f :
+            f.write(self.ids[pos:].tobytes())
+        return pos
+
+    def remove(self, heap_id : int) -> int | None :
+        pos = self.positions.pop(heap_id, None)
+        if pos is None :
+            return None
+        self.ids[pos] = 0
+        self.live &= ~(1 << pos)
+        with self.path.open("r+b") as f :
+            f.seek(pos * _SLOT_SIZE)
+            f.write(self.ids[pos:pos+1].tobytes())
+        return pos
+
+    def position(self, heap_id : int) -> int | None :
+        return self.positions.get(heap_id)
+
+    def heap_ids(self, bitmap : int) -> Iterator[int] :
+        """The heap ids for the positions set in the bitmap, in position order."""
+        for pos in iter_bits(bitmap & self.live) :
+            yield self.ids[pos]
@@ -0,0 +1,178 @@
+"""Block cache tier shared between processes.
+
+Several processes working on the same database each have their own
+LRUCache. This tier sits behind them in a `multiprocessing.shared_memory`
+segment named after the database, so a block read from disk by one process
+is there for all the others.
+
+It holds the encoded (msgpack) form of each block, so a hit saves the file
+read but not the decoding.
+
+The segment is a header followed by fixed size slots. A block can only go
+in one slot, picked by hashing its (index, block_id). Whatever was in the
+slot before is simply replaced.
+
+Each block file starts with a generation - a count of the writes to it.
+Each slot records the generation it was copied from, and a slot that
+doesn't match the file on disk is ignored, so a process that changes a
+block never leaves stale copies behind for the others. Checking costs a
+read of the header, not the whole block.
+
+There is no lock shared between processes. Instead a writer bumps the
+slot's sequence number to odd before writing and back to even after. A
+reader that sees an odd number, or a number that changed while it was
+copying, treats the slot as empty. A crc32 over the slot catches the rare
+case of two writers racing on the same slot.
+"""
+import hashlib
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+import struct
+from typing import Tuple, cast
+import zlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+_MAGIC = 0x47525445   # GRTE
+_HEADER = struct.Struct("<III")   # magic, slot count, slot size
+# seq, index, block_id, generation, data length, crc32
+_SLOT_HEADER = struct.Struct("<IQQQII")
+_SEQ = struct.Struct("<I")
+
+_BLOCK_MAGIC = b"GB"
+_BLOCK_HEADER = struct.Struct("<2sQ")   # magic, generation
+
+_SLOT_BYTES = 8192
+_MIN_SLOTS = 16
+
+# Segments this process created. The resource tracker is per process, so
+# these must stay registered even when attached to a second time.
+_created : set[str] = set()
+
+
+def segment_name(db_path : Path) -> str :
+    digest = hashlib.blake2b(str(db_path.resolve()).encode("utf-8"), digest_size=8).hexdigest()
+    return f"gertrude_{digest}"
+
+def _generation(head : bytes) -> int :
+    if head[:len(_BLOCK_MAGIC)] != _BLOCK_MAGIC or len(head) < _BLOCK_HEADER.size :
+        # Written before blocks had a generation.
+        return 0
+    return _BLOCK_HEADER.unpack_from(head)[1]
+
+def block_generation(path : Path) -> int :
+    with open(path, "rb") as f :
+        return _generation(f.read(_BLOCK_HEADER.size))
+
+def read_block(path : Path) -> Tuple[int, bytes] :
+    """The generation and encoded node of a block file."""
+    data = path.read_bytes()
+    generation = _generation(data)
+    return generation, (data[_BLOCK_HEADER.size:] if data[:len(_BLOCK_MAGIC)] == _BLOCK_MAGIC else data)
+
+def write_block(path : Path, data : bytes) -> int :
+    """Write a block file with its generation bumped. Returns the new generation."""
+    try :
+        with open(path, "r+b") as f :
+            generation = _generation(f.read(_BLOCK_HEADER.size)) + 1
+            f.seek(0)
+            f.write(_BLOCK_HEADER.pack(_BLOCK_MAGIC, generation))
+            f.write(data)
+            f.truncate()
+    except FileNotFoundError :
+        generation = 1
+        with open(path, "wb") as f :
+            f.write(_BLOCK_HEADER.pack(_BLOCK_MAGIC, generation))
+            f.write(data)
+    return generation
+
+
+class SharedBlockCache :
+    def __init__(self, name : str, size_bytes : int) :
+        """Attach to the named segment, creating it if this is the first process."""
+        slots = max(_MIN_SLOTS, (size_bytes - _HEADER.size) // _SLOT_BYTES)
+        try :
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=_HEADER.size + slots * _SLOT_BYTES)
+            _HEADER.pack_into(self.buf, 0, _MAGIC, slots, _SLOT_BYTES)
+            self.owner = True
+            _created.add(name)
+            logger.debug(f"Created shared block cache {name} with {slots} slots")
+        except FileExistsError :
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Only the process that made the segment should remove it at exit.
+            if name not in _created :
+                resource_tracker.unregister(self.shm._name, "shared_memory")   # type: ignore[attr-defined]
+            self.owner = False
+
+            magic, slots, slot_size = _HEADER.unpack_from(self.buf, 0)
+            if magic != _MAGIC or _HEADER.size + slots * slot_size > self.shm.size :
+                self.shm.close()
+                raise ValueError(f"Shared memory segment {name} is not a gertrude block cache.")
+            logger.debug(f"Attached to shared block cache {name} with {slots} slots")
+
+        self.name = name
+        _, self.slots, self.slot_size = _HEADER.unpack_from(self.buf, 0)
+        self.max_data = self.slot_size - _SLOT_HEADER.size
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def buf(self) -> memoryview :
+        # Only None once the segment is closed.
+        return cast(memoryview, self.shm.buf)
+
+    def _offset(self, index : int, block_id : int) -> int :
+        slot = zlib.crc32(struct.pack("<QQ", index, block_id)) % self.slots
+        return _HEADER.size + slot * self.slot_size
+
+    @staticmethod
+    def _crc(index : int, block_id : int, generation : int, data : bytes | memoryview) -> int :
+        return zlib.crc32(data, zlib.crc32(struct.pack("<QQQ", index, block_id, generation)))
+
+    def get(self, index : int, block_id : int, generation : int) -> bytes | None :
+        offset = self._offset(index, block_id)
+        buf = self.buf
+
+        seq, s_index, s_block, s_generation, length, crc = _SLOT_HEADER.unpack_from(buf, offset)
+        if seq & 1 or (s_index, s_block, s_generation) != (index, block_id, generation) or length > self.max_data :
+            self.misses += 1
+            return None
+
+        start = offset + _SLOT_HEADER.size
+        data = bytes(buf[start:start + length])
+
+        if _SEQ.unpack_from(buf, offset)[0] != seq or self._crc(index, block_id, generation, data) != crc :
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return data
+
+    def put(self, index : int, block_id : int, generation : int, data : bytes) :
+        if len(data) > self.max_data :
+            return
+        offset = self._offset(index, block_id)
+        buf = self.buf
+
+        seq = _SEQ.unpack_from(buf, offset)[0]
+        # odd while writing - even if the last writer never finished.
+        writing = ((seq + 1) | 1) & 0xFFFFFFFF
+        _SEQ.pack_into(buf, offset, writing)
+
+        start = offset + _SLOT_HEADER.size
+        buf[start:start + len(data)] = data
+        _SLOT_HEADER.pack_into(buf, offset, writing, index, block_id, generation,
+                               len(data), self._crc(index, block_id, generation, data))
+
+        _SEQ.pack_into(buf, offset, (writing + 1) & 0xFFFFFFFF)
+
+    def close(self) :
+        self.shm.close()
+
+    def unlink(self) :
+        """Remove the segment. Processes already attached keep their mapping."""
+        if self.name not in _created :
+            resource_tracker.register(self.shm._name, "shared_memory")   # type: ignore[attr-defined]
+        _created.discard(self.name)
+        self.shm.unlink()
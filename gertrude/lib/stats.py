@@ -0,0 +1,73 @@
+"""Column statistics for the query planner.
+
+Table.analyze() keeps, for each column, the number of distinct values, the
+fraction that are null, the smallest and largest values and an equi-depth
+histogram - bounds chosen so each bucket holds about the same number of
+rows. They are only estimates, and get staler as the table changes.
+"""
+from bisect import bisect_left, bisect_right
+from typing import Any
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def column_stats(values : list[Any], buckets : int = 32) -> dict[str, Any] :
+    """Statistics for one column, given every value in it."""
+    present = sorted(x for x in values if x is not None)
+    n = len(present)
+    k = min(buckets, max(n - 1, 1))
+    return {
+        "ndv" : len(set(present)),
+        "nulls" : (len(values) - n) / len(values) if len(values) > 0 else 0.0,
+        "min" : present[0] if n > 0 else None,
+        "max" : present[-1] if n > 0 else None,
+        "histogram" : [present[(i * (n - 1)) // k] for i in range(k + 1)] if n > 0 else [],
+    }
+
+def _fraction_below(col : dict[str, Any], value : Any, inclusive : bool) -> float :
+    """Fraction of the non-null values less than (or equal to) `value`."""
+    bounds = col["histogram"]
+    k = len(bounds) - 1
+    if k < 1 :
+        return 0.0
+    i = bisect_right(bounds, value) if inclusive else bisect_left(bounds, value)
+    if i == 0 :
+        return 0.0
+    if i > k :
+        return 1.0
+    lo, hi = bounds[i - 1], bounds[i]
+    part = 0.5
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and hi > lo :
+        part = (value - lo) / (hi - lo)
+    return (i - 1 + part) / k
+
+def estimate_rows(col : dict[str, Any], count : int, op : str, value : Any) -> float | None :
+    """Rows out of `count` expected to pass `column op value`. None if the
+    value can't be compared with the column's.
+    """
+    nonnull = count * (1.0 - col["nulls"])
+    if value is None or col["min"] is None :
+        return 0.0
+    try :
+        match op :
+            case 'eq' :
+                if value < col["min"] or value > col["max"] :
+                    return 0.0
+                # A value repeated across buckets shows up as a run of
+                # equal bounds, anything else gets an average share.
+                spread = _fraction_below(col, value, True) - _fraction_below(col, value, False)
+                if spread <= 0 :
+                    spread = 1.0 / max(col["ndv"], 1)
+                return nonnull * spread
+            case 'lt' :
+                return nonnull * _fraction_below(col, value, False)
+            case 'le' :
+                return nonnull * _fraction_below(col, value, True)
+            case 'gt' :
+                return nonnull * (1.0 - _fraction_below(col, value, True))
+            case 'ge' :
+                return nonnull * (1.0 - _fraction_below(col, value, False))
+    except TypeError :
+        logger.debug(f"Can't compare {value!r} with column statistics")
+    return None
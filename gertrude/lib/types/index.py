@@ -1,5 +1,8 @@
-from dataclasses import dataclass
-from typing import List, NamedTuple
+from array import array
+from collections.abc import MutableSequence
+from dataclasses import dataclass, fields
+from typing import Iterable, List, NamedTuple
+import sys
 
 from .value import Value
 
@@ -7,21 +10,106 @@ from .value import Value
 # the code easier to reason about if we are clear on
 # the difference between a heap_id (lives in the table data)
 # and a node_id (lives in the index data).
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class LeafItem :
     key : Value
     heap_id : int
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class InternalItem :
     key : Value
     node_id : int
 
-# Used by the InternalNode
-type InternalData = List[InternalItem]
+class NodeEntries(MutableSequence) :
+    """The items of a node, held as parallel arrays of raw key bytes and
+    ids rather than as item objects. Items are only built when they are
+    looked at, so a cached node is one bytes object per entry plus a
+    single array of ids.
+
+    The raw keys sort the same as their Values, so searches can bisect
+    `keys` directly.
+    """
+    __slots__ = ('item_type', 'keys', 'ids')
+
+    def __init__(self, item_type : type, keys : List[bytes] | None = None, ids : array | None = None) :
+        self.item_type = item_type
+        self.keys = keys if keys is not None else []
+        self.ids = ids if ids is not None else array('Q')
+
+    @classmethod
+    def of(cls, item_type : type, items : Iterable) -> "NodeEntries" :
+        if isinstance(items, NodeEntries) :
+            return items
+        retval = cls(item_type)
+        retval.extend(items)
+        return retval
+
+    def key(self, i : int) -> Value :
+        return Value.from_raw(self.keys[i])
+
+    def _item_id(self, item) -> int :
+        return item.heap_id if self.item_type is LeafItem else item.node_id
+
+    def __len__(self) :
+        return len(self.keys)
+
+    def __getitem__(self, i) :
+        if isinstance(i, slice) :
+            return NodeEntries(self.item_type, self.keys[i], self.ids[i])
+        return self.item_type(Value.from_raw(self.keys[i]), self.ids[i])
+
+    def __setitem__(self, i, item) :
+        if isinstance(i, slice) :
+            items = NodeEntries.of(self.item_type, item)
+            self.keys[i] = items.keys
+            self.ids[i] = items.ids
+        else :
+            self.keys[i] = item.key.raw
+            self.ids[i] = self._item_id(item)
+
+    def __delitem__(self, i) :
+        del self.keys[i]
+        del self.ids[i]
+
+    def __iter__(self) :
+        item_type = self.item_type
+        for k, i in zip(self.keys, self.ids) :
+            yield item_type(Value.from_raw(k), i)
+
+    def insert(self, i : int, item) :
+        self.keys.insert(i, item.key.raw)
+        self.ids.insert(i, self._item_id(item))
+
+    def __add__(self, other) :
+        other = NodeEntries.of(self.item_type, other)
+        return NodeEntries(self.item_type, self.keys + other.keys, self.ids + other.ids)
+
+    def __radd__(self, other) :
+        return NodeEntries.of(self.item_type, other) + self
+
+    def __eq__(self, other) :
+        if isinstance(other, NodeEntries) :
+            return self.keys == other.keys and self.ids == other.ids
+        return list(self) == other
+
+    def __repr__(self) :
+        return f"NodeEntries({list(self)!r})"
+
+    def pack(self) -> dict :
+        ids = self.ids
+        if sys.byteorder != "little" :
+            ids = array('Q', ids)
+            ids.byteswap()
+        return {"keys" : self.keys, "ids" : ids.tobytes()}
+
+    @classmethod
+    def unpack(cls, item_type : type, keys : List[bytes], ids : bytes) -> "NodeEntries" :
+        id_array = array('Q')
+        id_array.frombytes(ids)
+        if sys.byteorder != "little" :
+            id_array.byteswap()
+        return cls(item_type, keys, id_array)
 
-# use by leaf nodes
-type LeafData = List[LeafItem]
 
 @dataclass
 class IndexNode :
@@ -30,18 +118,90 @@ class IndexNode :
 
 @dataclass
 class LeafNode(IndexNode) :
-    d : LeafData
+    d : NodeEntries
+
+    def __setattr__(self, name, value) :
+        if name == "d" :
+            value = NodeEntries.of(LeafItem, value)
+        super().__setattr__(name, value)
 
 INDEX_NODE_TYPE_LEAF = 'L'
 
 @dataclass
 class InternalNode(IndexNode) :
-    d : InternalData
+    d : NodeEntries
+
+    def __setattr__(self, name, value) :
+        if name == "d" :
+            value = NodeEntries.of(InternalItem, value)
+        super().__setattr__(name, value)
 
 INDEX_NODE_TYPE_INTERNAL = 'I'
 
-def make_leaf(node_id : int, d : LeafData) :
-    return LeafNode(INDEX_NODE_TYPE_LEAF, node_id, d)
+# Extendible hash index bucket.
+@dataclass
+class BucketNode(IndexNode) :
+    depth : int    # local depth
+    d : NodeEntries
+
+    def __setattr__(self, name, value) :
+        if name == "d" :
+            value = NodeEntries.of(LeafItem, value)
+        super().__setattr__(name, value)
+
+INDEX_NODE_TYPE_BUCKET = 'B'
+
+# Extendible hash index directory - 2**depth bucket node ids
+@dataclass
+class DirectoryNode(IndexNode) :
+    depth : int    # global depth
+    d : List[int]
+
+INDEX_NODE_TYPE_DIRECTORY = 'D'
+
+NODE_TYPES : dict[str, type[IndexNode]] = {
+    INDEX_NODE_TYPE_LEAF : LeafNode,
+    INDEX_NODE_TYPE_INTERNAL : InternalNode,
+    INDEX_NODE_TYPE_BUCKET : BucketNode,
+    INDEX_NODE_TYPE_DIRECTORY : DirectoryNode,
+}
+
+_ITEM_TYPES : dict[str, type] = {
+    INDEX_NODE_TYPE_LEAF : LeafItem,
+    INDEX_NODE_TYPE_INTERNAL : InternalItem,
+    INDEX_NODE_TYPE_BUCKET : LeafItem,
+}
+
+def node_to_dict(node : IndexNode) -> dict :
+    """What gets written out for a node. Entries are stored as a list of
+    raw keys and a single blob of little endian 64 bit ids.
+    """
+    retval = {f.name : getattr(node, f.name) for f in fields(node) if f.name != "d"}
+    d = getattr(node, "d")
+    if isinstance(d, NodeEntries) :
+        retval.update(d.pack())
+    else :
+        retval["d"] = d
+    return retval
+
+def node_from_dict(data : dict) -> IndexNode :
+    """Build a node from node_to_dict(). Nodes written before entries were
+    stored compactly have a "d" list of items instead - those still load.
+    """
+    if "keys" in data :
+        item_type = _ITEM_TYPES[data["k"]]
+        data["d"] = NodeEntries.unpack(item_type, data.pop("keys"), data.pop("ids"))
+    return NODE_TYPES[data["k"]](**data)
+
+def make_leaf(node_id : int, d : Iterable[LeafItem]) :
+    return LeafNode(INDEX_NODE_TYPE_LEAF, node_id, NodeEntries.of(LeafItem, d))
+
+def make_internal(node_id : int, d : Iterable[InternalItem]) :
+    return InternalNode(INDEX_NODE_TYPE_INTERNAL, node_id, NodeEntries.of(InternalItem, d))
+
+
+def make_bucket(node_id : int, depth : int, d : Iterable[LeafItem]) :
+    return BucketNode(INDEX_NODE_TYPE_BUCKET, node_id, depth, NodeEntries.of(LeafItem, d))
 
-def make_internal(node_id : int, d : InternalData) :
-    return InternalNode(INDEX_NODE_TYPE_INTERNAL, node_id, d)
+def make_directory(node_id : int, depth : int, d : List[int]) :
+    return DirectoryNode(INDEX_NODE_TYPE_DIRECTORY, node_id, depth, d)
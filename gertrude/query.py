@@ -1,4 +1,4 @@
-from typing import Any, List, Self, Set, Tuple, cast
+from typing import Any, Iterator, List, Self, Set, Tuple, cast
 
 
 from .expression import expr_parse
@@ -61,8 +61,8 @@ class Query:
         self.steps.append(plan.DistinctOp(list(columns)))
         return self
 
-    def limit(self, limit : int) -> Self :
-        self.steps.append(plan.LimitOp(limit))
+    def limit(self, limit : int, offset : int = 0) -> Self :
+        self.steps.append(plan.LimitOp(limit, offset))
         return self
 
     def join(self, right : 'Query', on : str | Tuple[str, str], how : str = "inner", rename : bool | tuple[str, str] = False) -> Self :
@@ -84,8 +84,22 @@ class Query:
     def run(self, values:bool = False) -> list[dict[str, Any]] :
         return self._create_runner().run(values)
 
+    def iter(self, values : bool = False) -> Iterator[dict[str, Any]] :
+        """Like run(), but rows are produced one at a time as they are asked
+        for, instead of all at once in a list. Only a sort or the right
+        side of a join holds more than a row or so in memory.
+        Closing the iterator early (or dropping it) stops the scan.
+        """
+        return self._create_runner().iter(values)
+
     def show_plan(self) -> list[str] :
         return self._create_runner().show_plan()
 
+    def estimate(self) -> float | None :
+        """Rough number of rows the query will return, worked out from the
+        statistics kept by Table.analyze(). None if there aren't any.
+        """
+        return self._create_runner().estimate()
+
     def columns(self) -> Set[ColRef] :
         return self._create_runner().columns()
\ No newline at end of file
@@ -1,54 +1,353 @@
-from typing import Any, Iterable, Set, cast
+from typing import Any, Iterable, Iterator, Set, cast
 
 from .lib.types.colref import ColRef
 
-from .lib.plan import OpType, QueryOp, QueryPlan, ScanOp, FilterOp, ReadOp
+from .lib.plan import OpType, QueryOp, QueryPlan, ScanOp, FilterOp, JoinOp, LimitOp, ReadOp, SortOp, TopNOp
+from .lib.stats import estimate_rows
 from .table import Table
+from .index import Index
+from .bitmap_index import BitmapIndex, eval_filter
 
 from .lib import expr_nodes as node
 
 import logging
 logger = logging.getLogger(__name__)
 
+def _column_bound(expr : node.ExprNode) -> tuple[node.ExprNode, str, node.Literal] | None :
+    """Split `term op literal` into its parts, for the comparisons an index
+    can answer. The term is a column, or an expression that might have an
+    expression index.
+    """
+    if isinstance(expr, node.Operation) and expr.name in ['eq', 'gt', 'ge', 'lt', 'le'] \
+        and not isinstance(expr.left, node.Literal) and isinstance(expr.right, node.Literal) :
+        return expr.left, expr.name, expr.right
+    return None
+
+def _index_for_term(table : Table, term : node.ExprNode, conds : list[node.ExprNode],
+                    op : str) -> tuple[str, str] | None :
+    """Name of the index on a column or expression that can answer `op`,
+    and how to describe it. `conds` is the whole filter, for matching
+    partial indexes.
+    """
+    if isinstance(term, node.ColumnName) :
+        if table.spec_for_column(term.name) is None :
+            return None
+        index_name = table.find_index_for_column(term.name, conds=conds, op=op)
+        return (index_name, f"column {term.name}") if index_name is not None else None
+
+    index_name = table.find_index_for_expr(term, conds=conds, op=op)
+    if index_name is None :
+        return None
+    return index_name, f"expression {table.index(index_name).expr}"
+
+def _selectivity(table : Table, expr : node.ExprNode, rest : list[node.ExprNode],
+                 conds : list[node.ExprNode]) -> int | None :
+    """Rough rank of how few rows an index lookup for `expr` finds, lower
+    is better. None if no index can answer it.
+    """
+    bound = _column_bound(expr)
+    if bound is not None :
+        term, op, _ = bound
+        found_index = _index_for_term(table, term, conds, op)
+        if found_index is None :
+            return None
+        index = table.index(found_index[0])
+        if op == 'eq' :
+            return 0 if index.unique else 1
+        if not index.ordered :
+            return None
+        wanted = ['lt', 'le'] if op in ['gt', 'ge'] else ['gt', 'ge']
+        others = [b for b in map(_column_bound, rest) if b is not None]
+        closed = any(b[1] in wanted and node.same_expr(b[0], term) for b in others)
+        return 3 if closed else 4
+    if isinstance(expr, node.INStmt) and all(isinstance(x, node.Literal) for x in expr.right) \
+        and _index_for_term(table, expr.left, conds, 'eq') is not None :
+        return 2
+    return None
+
+# How much more a row costs to read through an index, in random order,
+# than as part of a table scan. An index expected to find more than
+# count / _RANDOM_READ_COST rows loses to a scan.
+_RANDOM_READ_COST = 4.0
+
+def _estimate_rows(table : Table, expr : node.ExprNode, rest : list[node.ExprNode]) -> float | None :
+    """Rows expected to pass `expr`, from the statistics Table.analyze()
+    keeps. A range closed by another condition in `rest` counts both ends.
+    None if there is nothing to go on.
+    """
+    columns = table.stats.get("columns")
+    if columns is None :
+        return None
+    count = table.count()
+
+    if isinstance(expr, node.INStmt) :
+        if not isinstance(expr.left, node.ColumnName) or expr.left.name not in columns \
+            or not all(isinstance(x, node.Literal) for x in expr.right) :
+            return None
+        each = [estimate_rows(columns[expr.left.name], count, 'eq', x.calc({}).value) for x in expr.right]
+        return None if None in each else min(sum(cast(list[float], each)), count)
+
+    bound = _column_bound(expr)
+    if bound is None or not isinstance(bound[0], node.ColumnName) or bound[0].name not in columns :
+        return None
+    term, op, literal = bound
+    col = columns[term.name]
+    rows = estimate_rows(col, count, op, literal.calc({}).value)
+    if rows is None or op == 'eq' :
+        return rows
+
+    wanted = ['lt', 'le'] if op in ['gt', 'ge'] else ['gt', 'ge']
+    for other in rest :
+        other_bound = _column_bound(other)
+        if other_bound is not None and other_bound[1] in wanted and node.same_expr(other_bound[0], term) :
+            other_rows = estimate_rows(col, count, other_bound[1], other_bound[2].calc({}).value)
+            if other_rows is not None :
+                # Each end lets through everything on the other side of it.
+                rows = max(rows + other_rows - count * (1.0 - col["nulls"]), 0.0)
+            break
+    return rows
+
+def _estimate_steps(table : Table, steps : QueryPlan) -> float | None :
+    """Rough number of rows out of `steps`, which start by reading `table`
+    and have had their filters merged. None if the table hasn't been
+    analyzed or there is a join to get past.
+    """
+    if "columns" not in table.stats :
+        return None
+    rows = float(table.count())
+    for i, step in enumerate(steps[1:]) :
+        match step.op :
+            case OpType.filter if i == 0 :
+                conjuncts = cast(FilterOp, step).exprs
+                found = [_estimate_rows(table, c, conjuncts[:j] + conjuncts[j+1:]) for j, c in enumerate(conjuncts)]
+                rows = min([rows] + [x for x in found if x is not None])
+            case OpType.limit :
+                limit = cast(LimitOp, step)
+                rows = min(max(rows - limit.offset, 0.0), limit.limit)
+            case OpType.join :
+                return None
+    return rows
+
+def _merge_filters(steps : QueryPlan) -> QueryPlan :
+    """Fold the filters straight after the read into one, split into
+    normalized conjuncts, so the planner sees every condition at once.
+    """
+    end = 1
+    while end < len(steps) and steps[end].op == OpType.filter :
+        end += 1
+    if end == 1 :
+        return steps
+    exprs = [node.normalize(c) for step in steps[1:end] for expr in cast(FilterOp, step).exprs
+             for c in node.conjuncts(expr)]
+    return [steps[0], FilterOp(exprs)] + steps[end:]
+
+def _sort_order(step : QueryOp | None) -> tuple[str, bool] | None :
+    """The column and direction (True for descending) of a sort on a
+    single plain column - the only kind an index can hand over ready made.
+    """
+    if step is None or step.op != OpType.sort :
+        return None
+    spec = cast(SortOp, step).spec
+    if len(spec) != 1 or not isinstance(spec[0].expr, node.ColumnName) :
+        return None
+    return spec[0].expr.name, spec[0].order == "desc"
+
+# The rows, a description for show_plan(), any filter still to be applied
+# and the (column, descending) order the rows come out in, if known.
+type ScanChoice = tuple[Iterable[dict[str, Any]], str, QueryOp | None, tuple[str, bool] | None]
+
 class QueryRunner :
     def __init__(self, db : Any, steps : QueryPlan) :
         self.db = db
         self.steps = steps
 
-    def _test_filter_for_index(self, filter : QueryOp, table : Table) -> tuple[Iterable[dict[str, Any]], str] | None :
+    def _test_filter_for_bitmaps(self, filter : QueryOp, table : Table) -> tuple[ScanChoice, int] | None :
+        """Answer as much of the filter as possible by combining bitmap indexes.
+        Any conditions the bitmaps can't answer are left in a residual filter.
+        Also returns the number of rows the bitmaps select - it is exact, so
+        the other indexes have to be expected to beat it.
+        """
+        if filter.op != OpType.filter or table.rowmap is None :
+            return None
+        filter = cast(FilterOp, filter)
+        rowmap = table.rowmap
+
+        def lookup(column : str) -> BitmapIndex | None :
+            index_name = table.find_index_for_column(column, kind=BitmapIndex.kind)
+            if index_name is None :
+                return None
+            return cast(BitmapIndex, table.index(index_name))
+
+        rows = rowmap.live
+        used : list[node.ExprNode] = []
+        residual : list[node.ExprNode] = []
+        conjuncts = [c for expr in filter.exprs for c in node.conjuncts(expr)]
+        for expr in conjuncts :
+            result = eval_filter(expr, lookup, rowmap.live)
+            if result is None :
+                residual.append(expr)
+            else :
+                rows &= result[0]
+                used.append(expr)
+
+        if len(used) == 0 :
+            return None
+
+        found = rows.bit_count()
+        count = table.count()
+        if "columns" in table.stats and found * _RANDOM_READ_COST >= count :
+            logger.debug(f"Bitmap indexes for {used} find {found} of {count} rows, a scan is cheaper")
+            return None
+
+        logger.debug(f"Bitmap indexes for {used} find {found} rows, residual = {residual}")
+        scan = table.fetch_rows(rowmap.heap_ids(rows), unwrap=False)
+        description = f"Using bitmap indexes for {used} ({found} rows)"
+        return (scan, description, FilterOp(residual) if len(residual) > 0 else None, None), found
+
+    def _test_filter_for_index(self, filter : QueryOp, table : Table, sort : tuple[str, bool] | None = None,
+                               fewer_than : int | None = None) -> ScanChoice | None :
+        """`sort` is the order wanted by the step after the filter. If the
+        index chosen is on that column, it is walked in that direction.
+        If `fewer_than` is given, only an index expected to find fewer rows
+        than that is used.
+        """
         if filter.op != OpType.filter :
             # really this is just to get the type system to hush.
             return None
         filter = cast(FilterOp, filter)
-        expr = filter.exprs[0]
+        conjuncts = [node.normalize(c) for expr in filter.exprs for c in node.conjuncts(expr)]
+        # The condition likely to find the fewest rows uses its index, the
+        # rest still have to be checked. Ties go to the one matching the
+        # sort, then to the one written first.
+        # With statistics, the estimated number of rows comes first.
+        count = table.count()
+        estimates : dict[int, float] = {}
+        ranked : list[tuple[float, int, bool, int]] = []
+        for i, expr in enumerate(conjuncts) :
+            rest = conjuncts[:i] + conjuncts[i+1:]
+            rank = _selectivity(table, expr, rest, conjuncts)
+            if rank is not None :
+                bound = _column_bound(expr)
+                sorted_by = sort is not None and bound is not None \
+                    and isinstance(bound[0], node.ColumnName) and bound[0].name == sort[0]
+                estimate = _estimate_rows(table, expr, rest)
+                if estimate is not None :
+                    estimates[i] = estimate
+                ranked.append((estimates.get(i, count), rank, not sorted_by, i))
+        logger.debug(f"Index candidates (rows, rank, not sorted, conjunct) = {sorted(ranked)}")
+
+        for _, rank, _, i in sorted(ranked) :
+            if i in estimates and estimates[i] * _RANDOM_READ_COST >= count :
+                logger.debug(f"Index for {conjuncts[i]} would find {estimates[i]:.0f} of {count} rows, a scan is cheaper")
+                continue
+            if fewer_than is not None :
+                # Without statistics only equality on a unique index is
+                # known to find at most one row.
+                expected = estimates.get(i, 1.0 if rank == 0 else None)
+                if expected is None or expected >= fewer_than :
+                    continue
+            choice = self._test_conjunct_for_index(conjuncts[i], conjuncts[:i] + conjuncts[i+1:], conjuncts, table, sort)
+            if choice is not None :
+                return choice
+        return None
+
+    def _test_conjunct_for_index(self, expr : node.ExprNode, rest : list[node.ExprNode], conds : list[node.ExprNode],
+                                 table : Table, sort : tuple[str, bool] | None) -> ScanChoice | None :
         logger.debug(f"isinstance(expr, node.Operation) = {isinstance(expr, node.Operation)}")
         logger.debug(f"expr.name = '{expr.name}'")
-        if isinstance(expr, node.Operation) and expr.name in ['eq','gt', 'ge', 'lt', 'le'] \
-            and isinstance(expr.left, node.ColumnName) and isinstance(expr.right, node.Literal) \
-            and table.spec_for_column(expr.left.name) is not None \
-            and table.find_index_for_column(expr.left.name) is not None :
-
-            key = expr.right.calc({})
-            index_name = table.find_index_for_column(expr.left.name)
-            logger.debug(f"Using index '{index_name}' on column {expr.left.name} for key = {key} with operator {expr.name}")
-            scan = table.index_scan(index_name, key, op=expr.name, unwrap=False) # type: ignore
-            description = f"Using index '{index_name}' on column {expr.left.name} for key = {key} with operator {expr.name}"
-            return scan, description
+        bound = _column_bound(expr)
+        found_index = _index_for_term(table, bound[0], conds, bound[1]) if bound is not None else None
+        if bound is not None and found_index is not None :
+
+            term, op, literal = bound
+            index_name, column = found_index
+            key = literal.calc({})
+            if op != 'eq' and not table.index(index_name).ordered :
+                return None
+
+            # A B+-Tree hands back its rows in key order - walked in the
+            # direction of the sort after the filter, if it is on the same
+            # column.
+            ordered_by : tuple[str, bool] | None = None
+            reverse = False
+            if isinstance(term, node.ColumnName) and table.index(index_name).ordered :
+                if sort is not None and sort[0] == term.name :
+                    reverse = sort[1]
+                ordered_by = (term.name, reverse)
+
+            if op in ['gt', 'ge', 'lt', 'le'] :
+                # Look for the other end of the range on the same column,
+                # as in `x between a and b` or `x > a and x < b`.
+                wanted = ['lt', 'le'] if op in ['gt', 'ge'] else ['gt', 'ge']
+                for other in rest :
+                    other_bound = _column_bound(other)
+                    if other_bound is not None and other_bound[1] in wanted and node.same_expr(other_bound[0], term) :
+                        rest = [x for x in rest if x is not other]
+                        other_key = other_bound[2].calc({})
+                        if op in ['gt', 'ge'] :
+                            lower, lower_op, upper, upper_op = key, op, other_key, other_bound[1]
+                        else :
+                            lower, lower_op, upper, upper_op = other_key, other_bound[1], key, op
+                        logger.debug(f"Using index '{index_name}' on {column} for range {lower_op} {lower} and {upper_op} {upper}")
+                        scan = table.index_scan(index_name, lower, op=lower_op, unwrap=False,
+                                                upper_key=upper, upper_op=upper_op, reverse=reverse)
+                        description = f"Using index '{index_name}' on {column} for range {lower_op} {lower} and {upper_op} {upper}"
+                        if reverse :
+                            description += " (reverse)"
+                        return scan, description, FilterOp(rest) if len(rest) > 0 else None, ordered_by
+
+            logger.debug(f"Using index '{index_name}' on {column} for key = {key} with operator {op}")
+            scan = table.index_scan(index_name, key, op=op, unwrap=False, reverse=reverse) # type: ignore
+            description = f"Using index '{index_name}' on {column} for key = {key} with operator {op}"
+            if reverse :
+                description += " (reverse)"
+            return scan, description, FilterOp(rest) if len(rest) > 0 else None, ordered_by
+        elif isinstance(expr, node.INStmt) and all(isinstance(x, node.Literal) for x in expr.right) \
+            and _index_for_term(table, expr.left, conds, 'eq') is not None :
+
+            found_index = cast(tuple[str, str], _index_for_term(table, expr.left, conds, 'eq'))
+            keys = [x.calc({}) for x in expr.right]
+            index_name, column = found_index
+            logger.debug(f"Using index '{index_name}' on {column} for keys in {keys}")
+            found = table.index(index_name).multi_get(keys)
+            scan = table.fetch_rows((heap_id for ids in found.values() for heap_id in ids), unwrap=False)
+            description = f"Using index '{index_name}' on {column} for keys in {keys}"
+            return scan, description, FilterOp(rest) if len(rest) > 0 else None, None
         else :
              return None
 
+    def _test_sort_for_index(self, step : QueryOp | None, table : Table) -> ScanChoice | None :
+        """Read the whole table in index order when that is the order the
+        sort wants. A limit after the sort then stops the scan early.
+        """
+        sort = _sort_order(step)
+        if sort is None :
+            return None
+        column, reverse = sort
+        index_name = table.find_index_for_column(column, kind=Index.kind)
+        if index_name is None :
+            return None
+
+        logger.debug(f"Using index '{index_name}' on column {column} for the sort (reverse = {reverse})")
+        scan = table.index_scan(index_name, unwrap=False, reverse=reverse)
+        description = f"Using index '{index_name}' on column {column} for the sort"
+        if reverse :
+            description += " (reverse)"
+        return scan, description, None, sort
+
     def plan(self) -> QueryPlan:
         from .database import Database
 
         db = cast(Database, self.db)
 
         logger.debug(f"Planning query with steps {self.steps}")
+        steps = _merge_filters(self.steps)
 
         new_plan : QueryPlan = []
 
 
         step_index = 0
-        step = self.steps[step_index]
+        step = steps[step_index]
 
         if step.op != OpType.read :
             raise ValueError("First step must be read")
@@ -60,41 +359,103 @@ class QueryRunner :
         if table is None :
             raise ValueError(f"Table {table_name} does not exist.")
 
-        if len(self.steps) > 1 :
+        def step_after(i : int) -> QueryOp | None :
+            return steps[i + 1] if i + 1 < len(steps) else None
+
+        # Whether the rows so far come in an order that has to be kept.
+        ordered = False
+        if len(steps) > 1 :
             step_index += 1
-            scan_return = self._test_filter_for_index(self.steps[step_index], table)
+            # The bitmaps say exactly how many rows they find. Another index
+            # is only used instead if it is expected to find fewer.
+            bitmaps = self._test_filter_for_bitmaps(steps[step_index], table)
+            scan_return = self._test_filter_for_index(steps[step_index], table, _sort_order(step_after(step_index)),
+                                                      bitmaps[1] if bitmaps is not None else None)
+            if scan_return is None and bitmaps is not None :
+                scan_return = bitmaps[0]
             if scan_return is None :
                 step_index -= 1
+                scan_return = self._test_sort_for_index(step_after(step_index), table)
+
+            if scan_return is None :
                 logger.debug(f"Using table scan to read table {table_name}")
                 new_plan.append(ScanOp(table.scan(unwrap=False), f"table scan of {table_name}"))
             else :
-                scan, description = scan_return
+                scan, description, residual, ordered_by = scan_return
+                ordered = ordered_by is not None
                 new_plan.append(ScanOp(scan, description))
+                if residual is not None :
+                    new_plan.append(residual)
+                # The rows already come out sorted, so the sort can go.
+                if ordered_by is not None and ordered_by == _sort_order(step_after(step_index)) :
+                    step_index += 1
         else :
             logger.debug(f"Using table scan to read table {table_name}")
             new_plan.append(ScanOp(table.scan(unwrap=False), f"table scan of {table_name}"))
 
-        if step_index < len(self.steps)-1 :
-            new_plan.extend(self.steps[step_index+1:])
+        i = step_index + 1
+        while i < len(steps) :
+            step = steps[i]
+            if step.op == OpType.join and not ordered :
+                step = self._choose_build_side(cast(JoinOp, step), _estimate_steps(table, steps[:i]))
+            elif step.op == OpType.sort and i + 1 < len(steps) and steps[i + 1].op == OpType.limit :
+                # Only the first limit + offset rows of the sort are wanted.
+                limit = cast(LimitOp, steps[i + 1])
+                step = TopNOp(cast(SortOp, step).spec, limit.limit, limit.offset)
+                i += 1
+            if step.op in (OpType.sort, OpType.top_n) :
+                ordered = True
+            new_plan.append(step)
+            i += 1
 
         return new_plan
 
-    def run(self, return_values : bool = False) -> list[dict[str, Any]] :
+    def _choose_build_side(self, join : JoinOp, left_rows : float | None) -> JoinOp :
+        """The hash table is built from the right side unless the left is
+        expected to be smaller. A left outer join always builds from the
+        right, it has to see every left row anyway. Only called when the
+        left rows have no order to keep - building from the left hands
+        them back in the right side's order.
+        """
+        if join.how != "inner" or left_rows is None :
+            return join
+        right_rows = join.right.estimate()
+        if right_rows is None or left_rows >= right_rows :
+            return join
+        logger.debug(f"Building join from the left side ({left_rows:.0f} rows, right {right_rows:.0f})")
+        return join.build_left()
+
+    def estimate(self) -> float | None :
+        """Rough number of rows the query returns, from the table statistics.
+        None if the table hasn't been analyzed.
+        """
+        steps = _merge_filters(self.steps)
+        if len(steps) == 0 or steps[0].op != OpType.read :
+            raise ValueError("First step must be read")
+        table_name = cast(ReadOp, steps[0]).table_name
+        table = self.db.table(table_name=table_name)
+        if table is None :
+            raise ValueError(f"Table {table_name} does not exist.")
+        return _estimate_steps(table, steps)
+
+    def iter(self, return_values : bool = False) -> Iterator[dict[str, Any]] :
+        """The rows of the query, produced as they are asked for."""
         logger.debug(f"Running query with steps {self.steps}")
 
         plan = self.plan()
 
-        data = []
+        data : Iterable[dict[str, Any]] = []
         for op in plan :
             data = op.run(data)
 
         if return_values :
-            if not isinstance(data, list) :
-                return list(data)
-            else :
-                return data
+            yield from data
         else :
-            return [{ k : v.value for k,v in x.items() } for x in data]
+            for x in data :
+                yield { k : v.value for k,v in x.items() }
+
+    def run(self, return_values : bool = False) -> list[dict[str, Any]] :
+        return list(self.iter(return_values))
 
 
     def show_plan(self) -> list[str] :
@@ -2,8 +2,11 @@ from gertrude.lib.types.colref import ColRef
 from .lib.types.value import Value
 from pathlib import Path
 from typing import Dict, Iterable, Any, Callable, Set
+from functools import partial
+from itertools import islice
 import json
 import shutil
+import threading
 import logging
 
 from .lib import heap
@@ -15,7 +18,25 @@ from .globals import (
     FieldSpec
     )
 
-from .index import Index
+from .expression import expr_parse
+from .index import BaseIndex, Index, IndexStats
+from .lib.expr_nodes import ExprNode, implies, same_expr
+from .hash_index import HashIndex
+from .bitmap_index import BitmapIndex
+from .lib.rowmap import RowMap
+from .lib.stats import column_stats
+
+_INDEX_KINDS : dict[str, type[BaseIndex]] = {
+    Index.kind : Index,
+    HashIndex.kind : HashIndex,
+    BitmapIndex.kind : BitmapIndex,
+}
+
+# When several indexes could look up a key, the order to prefer them in.
+# A hash index reads the directory and one bucket, a B+-Tree a path from
+# the root.
+_LOOKUP_ORDER = [HashIndex.kind, Index.kind, BitmapIndex.kind]
+_RANGE_OPS = frozenset(['gt', 'ge', 'lt', 'le'])
 
 
 OPT_DEFAULT = {
@@ -40,13 +61,23 @@ class Table :
                 db_ctx : DBContext) :
 
         self.db_path = db_path
-        self.indexes : Dict[str, Index] = {}
+        self.indexes : Dict[str, BaseIndex] = {}
         self.orig_spec = spec
         self.name = table_name
         self.db_ctx = db_ctx
         self.open = True
         self.stats : dict = {"count" : 0}
         self.stat_update_count = 0
+        # Only exists once there is a bitmap index.
+        self.rowmap : RowMap | None = None
+
+        # Held while rows are changed, so an online index build can take a
+        # consistent snapshot and switch over between changes.
+        self.lock = threading.RLock()
+        # Online builds in progress - the thread and the changes made to the
+        # table since its snapshot, as (action, row, heap_id).
+        self.builds : dict[str, tuple[threading.Thread, list[tuple[str, dict[str, Value], int]]]] = {}
+        self.build_errors : dict[str, Exception] = {}
 
         self.spec : tuple[FieldSpec, ...] = self._reform_spec()
         self.spec_map = {s.name : s for s in self.spec}
@@ -118,13 +149,40 @@ class Table :
 
     def _load_def(self) :
         config = json.loads((self.db_path / "config").read_text())
-        self.stats = json.loads((self.db_path / "stats").read_text())
+        stats_path = self.db_path / "stats"
+        if stats_path.exists() :
+            self.stats = json.loads(stats_path.read_text())
 
         self.id = config["id"]
-        self.spec = config["spec"]
+        self.spec = tuple(FieldSpec(*x) for x in config["spec"])
+        self.spec_map = {s.name : s for s in self.spec}
+        if (self.db_path / "rowmap").exists() :
+            self.rowmap = RowMap(self.db_path / "rowmap")
+
         index_path = self.db_path / "index"
-        for index in index_path.glob("*") :
-            Index._load(index, self.db_ctx)
+        for index_dir in index_path.glob("*") :
+            index_config = json.loads((index_dir / "config").read_text())
+            if index_config.get("building", False) :
+                # An online build that never finished. Start over.
+                logger.debug(f"Removing partly built index {index_dir.name} from table {self.name}")
+                shutil.rmtree(index_dir)
+                continue
+            # Indexes from before there was a choice are all B+-Trees.
+            kind = index_config.get("kind", Index.kind)
+            index = _INDEX_KINDS[kind]._load(index_dir, self.db_ctx, index_config, **self._index_kwargs(kind))
+            index.heap_path = self.db_path / "data"
+            self.indexes[index.index_name] = index
+
+    def _get_rowmap(self) -> RowMap :
+        if self.rowmap is None :
+            self.rowmap = RowMap.create(self.db_path / "rowmap", (x[0] for x in self._data_iter()))
+        return self.rowmap
+
+    def _index_kwargs(self, kind : str) -> dict[str, Any] :
+        """Extra constructor arguments needed by some kinds of index."""
+        if kind == BitmapIndex.kind :
+            return { "rowmap" : self._get_rowmap() }
+        return {}
 
     def _row_from_storage(self, in_data) :
         """This assumes the data is in the same order as the spec and that it really
@@ -165,17 +223,81 @@ class Table :
 
         return {x.name : Value(x.type, TYPES[x.type](in_dict[x.name]) if in_dict[x.name] is not None else None) for x in self.spec}
 
+    def _heap_ids(self) -> Iterable[int] :
+        for entry in (self.db_path / "data").rglob('*') :
+            if entry.is_file() :
+                yield int(HeapID.from_path(entry))
+
     def _data_iter(self) -> Iterable[tuple[int, dict[str, Any]]] :
         if not self.open :
             raise ValueError(f"Table {self.name} is closed.")
 
-        for entry in (self.db_path / "data").rglob('*') :
-            if entry.is_file() :
-                heap_id = HeapID.from_path(entry)
+        for heap_id in self._heap_ids() :
+            data = heap.read(self.db_path / "data", heap_id)
+            record = self._row_from_storage(data)
+            yield (heap_id, record)
 
+    def _snapshot_iter(self, snapshot : list[int]) -> Iterable[tuple[int, dict[str, Any]]] :
+        for heap_id in snapshot :
+            try :
                 data = heap.read(self.db_path / "data", heap_id)
-                record = self._row_from_storage(data)
-                yield (int(heap_id),record)
+            except FileNotFoundError :
+                data = None
+            if data is None :
+                # Deleted since the snapshot. The delete is in the build log.
+                continue
+            yield (heap_id, self._row_from_storage(data))
+
+    def _build_online(self, index : BaseIndex, snapshot : list[int]) :
+        name = index.index_name
+        try :
+            index._create(lambda : self._snapshot_iter(snapshot))
+
+            with self.lock :
+                changes = self.builds[name][1]
+                logger.debug(f"Applying {len(changes)} changes to index {name} built online")
+                # A row inserted and deleted again while the build ran is
+                # left out - it may be gone from the row map already.
+                deleted_later : set[int] = set()
+                skip : set[int] = set()
+                for i in range(len(changes) - 1, -1, -1) :
+                    action, _, heap_id = changes[i]
+                    if action == "delete" :
+                        deleted_later.add(heap_id)
+                    elif heap_id in deleted_later :
+                        skip.add(i)
+
+                for i, (action, row, heap_id) in enumerate(changes) :
+                    if i in skip :
+                        continue
+                    if action == "insert" :
+                        success, msg, ticket = index.prepare_insert(row)
+                        if not success :
+                            raise ValueError(msg)
+                        index.apply_insert(row, heap_id, ticket)
+                    else :
+                        try :
+                            index.delete(row, heap_id)
+                        except ValueError :
+                            # Deleted before the build got to it.
+                            pass
+                index.ready = True
+                index._write_config()
+                del self.builds[name]
+
+        except Exception as e :
+            logger.debug(f"Online build of index {name} failed : {e}")
+            with self.lock :
+                self.build_errors[name] = e
+                del self.builds[name]
+                del self.indexes[name]
+                if not index.closed and index.id != 0 :
+                    index.close()
+                shutil.rmtree(index.path, ignore_errors=True)
+
+    def _log_change(self, action : str, row : dict[str, Value], heap_id : int) :
+        for _, changes in self.builds.values() :
+            changes.append((action, row, heap_id))
 
 
     def _unwrap(self, data : dict[str, Value] ) -> dict[str, Any] :
@@ -191,7 +313,9 @@ class Table :
     #################################################################
     # Public API
     #################################################################
-    def add_index(self, index_name : str, column : str, **kwargs) -> Index:
+    def add_index(self, index_name : str, column : str | None = None, kind : str = Index.kind, *,
+                  expr : str | None = None, where : str | None = None,
+                  online : bool = False, **kwargs) -> BaseIndex:
         if self.db_ctx.mode == "ro" :
             raise ValueError("Database is in read-only mode.")
 
@@ -204,19 +328,80 @@ class Table :
         if index_name in self.indexes :
             raise ValueError(f"Index {index_name} already exists for table {self.name}")
 
-        col = [x for x in self.spec if x.name == column]
-        if len(col) != 1 :
-            raise ValueError(f"Invalid column name {column} for table {self.name}")
+        if (column is None) == (expr is None) :
+            raise ValueError(f"Index {index_name} needs exactly one of a column or an expression.")
 
-        new_index = Index(index_name,
-                          self.db_path / "index" / index_name,
-                          column, col[0].type, self.db_ctx, **kwargs)
-        self.indexes[index_name] = new_index
+        if expr is not None :
+            coltype = self._expr_type(expr)
+        else :
+            col = [x for x in self.spec if x.name == column]
+            if len(col) != 1 :
+                raise ValueError(f"Invalid column name {column} for table {self.name}")
+            coltype = col[0].type
+
+        if where is not None :
+            self._try_expr(where)
 
-        new_index._create(self._data_iter)
+        if kind not in _INDEX_KINDS :
+            raise ValueError(f"Invalid index kind {kind} - must be one of {', '.join(_INDEX_KINDS)}")
+
+        new_index = _INDEX_KINDS[kind](index_name,
+                          self.db_path / "index" / index_name,
+                          column, coltype, self.db_ctx, expr=expr, where=where,
+                          **self._index_kwargs(kind), **kwargs)
+        new_index.heap_path = self.db_path / "data"
+
+        if not online :
+            self.indexes[index_name] = new_index
+            new_index._create(self._data_iter)
+            return new_index
+
+        with self.lock :
+            new_index.ready = False
+            self.indexes[index_name] = new_index
+            self.build_errors.pop(index_name, None)
+            snapshot = list(self._heap_ids())
+            thread = threading.Thread(target=self._build_online, args=(new_index, snapshot),
+                                      name=f"build-{self.name}.{index_name}", daemon=True)
+            self.builds[index_name] = (thread, [])
+        thread.start()
 
         return new_index
 
+    def _try_expr(self, expr : str) -> Value :
+        """Evaluate an index expression on a made up row. Catches references
+        to columns that don't exist, and gives the type of the result.
+        """
+        samples = { "int" : 1, "str" : "a", "float" : 1.0, "bool" : True }
+        row = { x.name : Value(x.type, samples[x.type]) for x in self.spec }
+        try :
+            return expr_parse(expr).calc(row)
+        except (KeyError, TypeError, ValueError, ArithmeticError) as e :
+            raise ValueError(f"Invalid index expression {expr} for table {self.name}: {e}")
+
+    def _expr_type(self, expr : str) -> str :
+        key = self._try_expr(expr)
+        if key.is_null :
+            raise ValueError(f"Cannot tell the type of index expression {expr}")
+        return key.type_name
+
+    def wait_for_index(self, index_name : str, timeout : float | None = None) -> bool :
+        """Wait for an online index build to finish.
+        Returns False if it is still running after `timeout` seconds.
+        Raises ValueError if the build failed.
+        """
+        build = self.builds.get(index_name)
+        if build is not None :
+            build[0].join(timeout)
+            if build[0].is_alive() :
+                return False
+
+        if index_name in self.build_errors :
+            raise ValueError(f"Building index {index_name} failed: {self.build_errors[index_name]}")
+        if index_name not in self.indexes :
+            raise ValueError(f"Index {index_name} does not exist for table {self.name}")
+        return True
+
     def drop_index(self, index_name : str) :
         if self.db_ctx.mode == "ro" :
             raise ValueError("Database is in read-only mode.")
@@ -227,12 +412,32 @@ class Table :
         if index_name not in self.indexes :
             raise ValueError(f"Index {index_name} does not exist for table {self.name}")
 
+        if not self.indexes[index_name].ready :
+            raise ValueError(f"Index {index_name} is still being built.")
+
         index_path = self.db_path / "index" / index_name
         self.indexes[index_name].close()
         del self.indexes[index_name]
 
         shutil.rmtree(index_path)
 
+    def reorganize_index(self, index_name : str, timeout : float | None = 30.0) -> IndexStats :
+        """Rebuild an index in place. Inserts and deletes on the table wait
+        until it is done, and so do new scans of the index. Scans already
+        running get `timeout` seconds to finish first. Returns the index's
+        new stats.
+        """
+        if self.db_ctx.mode == "ro" :
+            raise ValueError("Database is in read-only mode.")
+        self._check_index_usable(index_name)
+        if self.indexes[index_name].kind != Index.kind :
+            raise ValueError(f"Index {index_name} is a {self.indexes[index_name].kind} index - only B+-Tree indexes can be reorganized.")
+
+        with self.lock :
+            if not self.indexes[index_name].ready :
+                raise ValueError(f"Index {index_name} is still being built.")
+            return self.indexes[index_name].reorganize(timeout)
+
     def get_spec(self) :
         return self.spec
 
@@ -245,12 +450,44 @@ class Table :
             return None
         return col[0]
 
-    def find_index_for_column(self, column : str) -> str | None:
-        index = [k for k, x in self.indexes.items() if x.column == column]
-        if len(index) != 1 :
+    def _pick_index(self, match : Callable[[BaseIndex], bool], kind : str | None,
+                    conds : list[ExprNode] | None, op : str | None) -> str | None :
+        # Only an ordered index can answer a range.
+        candidates = [(k, x) for k, x in self.indexes.items()
+                      if x.ready and match(x) and (kind is None or x.kind == kind)
+                      and (op not in _RANGE_OPS or x.ordered)]
+        # Unique first, then the quickest kind to look up, then the oldest.
+        candidates.sort(key=lambda c : (not c[1].unique, _LOOKUP_ORDER.index(c[1].kind)))
+
+        # A partial index can only answer a filter that implies its predicate.
+        # It is smaller than a full index, so it wins if there is one.
+        if conds is not None :
+            partial = [k for k, x in candidates if x.where_node is not None and implies(conds, x.where_node)]
+            if len(partial) > 0 :
+                return partial[0]
+
+        index = [k for k, x in candidates if x.where_node is None]
+        if len(index) == 0 :
             return None
         return index[0]
 
+    def find_index_for_column(self, column : str, kind : str | None = None,
+                              conds : list[ExprNode] | None = None, op : str | None = None) -> str | None:
+        """`conds` are the conditions every row wanted is known to meet.
+        Partial indexes are only considered if they are given.
+        `op` is the comparison the index is wanted for - for a range, only
+        an ordered index is picked. If several indexes will do, a hash
+        index is preferred for looking up keys.
+        """
+        return self._pick_index(lambda x : x.column == column, kind, conds, op)
+
+    def find_index_for_expr(self, expr : ExprNode, kind : str | None = None,
+                            conds : list[ExprNode] | None = None, op : str | None = None) -> str | None :
+        """Like find_index_for_column(), but for an expression index whose
+        expression is the same as `expr`.
+        """
+        return self._pick_index(lambda x : x.expr_node is not None and same_expr(x.expr_node, expr), kind, conds, op)
+
     def insert(self, *args, **kwargs) :
         if self.db_ctx.mode == "ro" :
             raise ValueError("Database is in read-only mode.")
@@ -271,17 +508,28 @@ class Table :
 
         logger.debug(f"--- record_object = {record_object}")
 
-        for index in self.indexes.values() :
-            success, msg = index.test_for_insert(record_object)
-            if not success :
-                raise ValueError(f"Failed to insert record: {msg}")
+        with self.lock :
+            # Every index is checked before any is changed, so a record
+            # one of them rejects is in none of them.
+            tickets = []
+            for index in self.indexes.values() :
+                if not index.ready :
+                    continue
+                success, msg, ticket = index.prepare_insert(record_object)
+                if not success :
+                    raise ValueError(f"Failed to insert record: {msg}")
+                tickets.append((index, ticket))
+
+            heap_id = heap.write(self.db_path / "data", self._row_to_storage(record_object))
 
-        heap_id = heap.write(self.db_path / "data", self._row_to_storage(record_object))
+            self._update_count()
 
-        self._update_count()
+            if self.rowmap is not None :
+                self.rowmap.add(int(heap_id))
 
-        for index in self.indexes.values() :
-            index.insert(record_object, int(heap_id))
+            for index, ticket in tickets :
+                index.apply_insert(record_object, int(heap_id), ticket)
+            self._log_change("insert", record_object, int(heap_id))
 
         return heap_id
 
@@ -292,18 +540,70 @@ class Table :
             else :
                 yield record[1]
 
-    def index_scan(self, name : str, key : Any = None, op : str | None = None, unwrap : bool = True) -> Iterable[dict[str, Any]]:
-        if name not in self.indexes :
-            raise ValueError(f"Index {name} does not exist for table {self.name}")
+    def index_scan(self, name : str, key : Any = None, op : str | None = None, unwrap : bool = True, *,
+                   upper_key : Any = None, upper_op : str | None = None,
+                   reverse : bool = False) -> Iterable[dict[str, Any]]:
+        self._check_index_usable(name)
+
+        heap_ids = self.indexes[name].scan(key, op, upper_key, upper_op, reverse)
+        try :
+            yield from self.fetch_rows(heap_ids, unwrap=unwrap)
+        finally :
+            # Let go of the leaf it holds if the scan is abandoned part way.
+            close = getattr(heap_ids, "close", None)
+            if close is not None :
+                close()
+
+    def index_multi_get(self, name : str, keys : Iterable[Any], unwrap : bool = True) -> dict[Any, list[dict[str, Any]]] :
+        """Look up several keys in an index at once. Returns the matching
+        rows for each key.
+        """
+        self._check_index_usable(name)
+
+        found = self.indexes[name].multi_get(keys)
+        return { k : list(self.fetch_rows(ids, unwrap=unwrap)) for k, ids in found.items() }
+
+    def fetch_rows(self, heap_ids : Iterable[int], unwrap : bool = True) -> Iterable[dict[str, Any]] :
+        """Read the rows for the given heap ids, in the order given.
+        The ids are taken a batch at a time. Each batch is read in heap order
+        (ids sort the same as their paths) on the io threads, then handed
+        back in the order asked for. Batches start at one row and double up
+        to the fetch_batch option, so a caller that only wants the first
+        few rows doesn't wait for many more.
+        """
         if not self.open :
             raise ValueError(f"Table {self.name} is deleted.")
 
-        for block in self.indexes[name].scan(key, op) :
-            row = self._row_from_storage(heap.read(self.db_path / "data", block))
-            if unwrap :
-                yield self._unwrap(row)
+        data_path = self.db_path / "data"
+        max_batch = self.db_ctx.options.fetch_batch
+        ids = iter(heap_ids)
+        size = 1
+        while True :
+            batch = list(islice(ids, size))
+            if len(batch) == 0 :
+                return
+            size = min(max_batch, size * 2)
+
+            if len(batch) == 1 :
+                found = { batch[0] : heap.read(data_path, batch[0]) }
             else :
-                yield row
+                wanted = sorted(set(batch), key=int)
+                found = dict(zip(wanted, self.db_ctx.io_pool().map(partial(heap.read, data_path), wanted)))
+
+            for heap_id in batch :
+                row = self._row_from_storage(found[heap_id])
+                if unwrap :
+                    yield self._unwrap(row)
+                else :
+                    yield row
+
+    def _check_index_usable(self, name : str) :
+        if name not in self.indexes :
+            raise ValueError(f"Index {name} does not exist for table {self.name}")
+        if not self.open :
+            raise ValueError(f"Table {self.name} is deleted.")
+        if not self.indexes[name].ready :
+            raise ValueError(f"Index {name} is still being built.")
 
     def print_index(self, name : str) :
         self.indexes[name].print_tree()
@@ -320,14 +620,19 @@ class Table :
 
         victim = self._row_from_dict(row)
 
-        for block_id, record in self._data_iter() :
-            if record == victim :
-                logger.debug(f"Deleting record{record}")
-                heap.delete(self.db_path / "data", block_id)
-                self._update_count(-1)
-                for index in self.indexes.values() :
-                    index.delete(row)
-                return True
+        with self.lock :
+            for block_id, record in self._data_iter() :
+                if record == victim :
+                    logger.debug(f"Deleting record{record}")
+                    heap.delete(self.db_path / "data", block_id)
+                    self._update_count(-1)
+                    for index in self.indexes.values() :
+                        if index.ready :
+                            index.delete(record, block_id)
+                    self._log_change("delete", record, block_id)
+                    if self.rowmap is not None :
+                        self.rowmap.remove(block_id)
+                    return True
 
         return False
 
@@ -349,7 +654,34 @@ class Table :
                 count += 1
         return count
 
-    def index(self, index_name : str) -> Index :
+    def warm(self) -> int :
+        """Read the upper levels of each index into the cache.
+        Returns the number of nodes read.
+        """
+        return sum(index.warm() for index in list(self.indexes.values()) if index.ready)
+
+    def analyze(self, buckets : int = 32) -> dict[str, dict[str, Any]] :
+        """Read the whole table and keep statistics on each column for the
+        query planner (see lib/stats.py). Returns them. Run it again after
+        the data has changed a lot.
+        """
+        if not self.open :
+            raise ValueError(f"Table {self.name} is deleted.")
+
+        values : dict[str, list[Any]] = {s.name : [] for s in self.spec}
+        rows = 0
+        for row in self.scan() :
+            rows += 1
+            for name, column in values.items() :
+                column.append(row.get(name))
+
+        self.stats["columns"] = {name : column_stats(column, buckets) for name, column in values.items()}
+        self.stats["analyzed"] = rows
+        self._write_stats()
+        logger.debug(f"Analyzed table {self.name} - {self.stats['analyzed']} rows")
+        return self.stats["columns"]
+
+    def index(self, index_name : str) -> BaseIndex :
         return self.indexes[index_name]
 
     def count(self) -> int :
@@ -0,0 +1,110 @@
+from gertrude import Database, cspec
+import logging
+import pytest
+import random
+
+
+def _node_count(table, index_name) :
+    return len(list((table.db_path / "index" / index_name).glob("[0-9]*")))
+
+def _height(index) :
+    height = 1
+    node = index._read_root()
+    while node.k == 'I' :
+        height += 1
+        node = index._read_node(node.d[0].node_id)
+    return height
+
+def test_delete_rebalance(tmp_path, caplog) :
+    caplog.set_level(logging.INFO, logger="gertrude.index")
+
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [
+        cspec("id", "int", pk=True), cspec("name", "str")
+    ])
+
+    rng = random.Random(42)
+    ids = list(range(200))
+    rng.shuffle(ids)
+    for i in ids :
+        table.insert({"id" : i, "name" : f"name{i}"})
+
+    index = table.index("pk_id")
+    full_nodes = _node_count(table, "pk_id")
+    full_height = _height(index)
+
+    rng.shuffle(ids)
+    for i in ids[:190] :
+        assert table.delete({"id" : i, "name" : f"name{i}"})
+
+    data = [x["id"] for x in table.index_scan("pk_id")]
+    assert data == sorted(ids[190:])
+
+    assert _node_count(table, "pk_id") < full_nodes // 4
+    assert _height(index) < full_height
+
+    for i in ids[190:] :
+        data = list(table.index_scan("pk_id", i, op="="))
+        assert data == [{"id" : i, "name" : f"name{i}"}]
+
+    # Tree still accepts inserts after shrinking
+    for i in ids[:20] :
+        table.insert({"id" : i, "name" : f"name{i}"})
+    data = [x["id"] for x in table.index_scan("pk_id")]
+    assert data == sorted(ids[190:] + ids[:20])
+
+def test_delete_everything(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "int", pk=True)])
+
+    for i in range(50) :
+        table.insert({"id" : i})
+    for i in range(50) :
+        assert table.delete({"id" : i})
+
+    assert list(table.index_scan("pk_id")) == []
+    assert _height(table.index("pk_id")) == 2
+
+    table.insert({"id" : 7})
+    assert list(table.index_scan("pk_id")) == [{"id" : 7}]
+
+def test_delete_duplicates(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "int"), cspec("seq", "int")])
+    table.add_index("id_index", "id")
+
+    for i in range(30) :
+        table.insert({"id" : i % 3, "seq" : i})
+
+    # Only the exact row goes, even though the key is shared.
+    for i in range(0, 30, 2) :
+        assert table.delete({"id" : i % 3, "seq" : i})
+
+    data = sorted(x["seq"] for x in table.index_scan("id_index", 1, op="="))
+    assert data == [i for i in range(1, 30, 2) if i % 3 == 1]
+
+    data = sorted((x["id"], x["seq"]) for x in table.index_scan("id_index"))
+    assert data == sorted((i % 3, i) for i in range(1, 30, 2))
+
+@pytest.mark.parametrize("seed, fanout", [(1, 5), (2, 4), (3, 5)])
+def test_random_insert_delete(tmp_path, seed, fanout) :
+    rng = random.Random(seed)
+    db = Database.create(tmp_path / "db", index_fanout=fanout)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("grp", "int")])
+    table.add_index("grp_idx", "grp")
+
+    # Duplicate keys make for internal nodes with a single child, which
+    # used to keep empty leaves around.
+    live : dict[int, int] = {}
+    for step in range(1500) :
+        if len(live) > 0 and rng.random() < 0.45 :
+            i = rng.choice(list(live))
+            assert table.delete({"id" : i, "grp" : live.pop(i)})
+        else :
+            live[step] = rng.randint(0, 30)
+            table.insert({"id" : step, "grp" : live[step]})
+
+        if step % 25 == 0 :
+            found = sorted(x["id"] for x in table.index_scan("grp_idx", 10, op=">="))
+            assert found == sorted(i for i, g in live.items() if g >= 10)
+            assert [x["grp"] for x in table.index_scan("grp_idx")] == sorted(live.values())
@@ -0,0 +1,94 @@
+from gertrude import Database, cspec
+import pytest
+import random
+
+
+def test_hash_index(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "str"), cspec("seq", "int")])
+
+    # some rows before the index exists, the rest after.
+    rng = random.Random(43)
+    ids = [f"id{i:03}" for i in range(100)]
+    rng.shuffle(ids)
+    for i, x in enumerate(ids[:40]) :
+        table.insert({"id" : x, "seq" : i})
+
+    index = table.add_index("id_hash", "id", kind="hash", unique=True)
+
+    for i, x in enumerate(ids[40:]) :
+        table.insert({"id" : x, "seq" : i + 40})
+
+    # Every key is in a bucket the low `depth` bits of its hash point to,
+    # and no bucket is over full.
+    directory = index._read_directory()
+    assert directory.depth > 0 and len(directory.d) == 1 << directory.depth
+    keys = []
+    for slot, bucket_id in enumerate(directory.d) :
+        bucket = index._read_bucket(bucket_id)
+        assert bucket.depth <= directory.depth and len(bucket.d) <= 6
+        for x in bucket.d :
+            assert index._hash(x.key) & ((1 << bucket.depth) - 1) == slot & ((1 << bucket.depth) - 1)
+        if slot == directory.d.index(bucket_id) :
+            keys.extend(x.key.value for x in bucket.d)
+    assert sorted(keys) == sorted(ids)
+
+    for i, x in enumerate(ids) :
+        assert list(table.index_scan("id_hash", x, op="=")) == [{"id" : x, "seq" : i}]
+
+    assert list(table.index_scan("id_hash", "nope", op="=")) == []
+    assert sorted(x["id"] for x in table.index_scan("id_hash")) == sorted(ids)
+
+    with pytest.raises(ValueError) :
+        table.insert({"id" : ids[0], "seq" : 1000})
+
+    with pytest.raises(ValueError) :
+        list(table.index_scan("id_hash", "id001", op=">"))
+
+    assert table.delete({"id" : ids[5], "seq" : 5})
+    assert list(table.index_scan("id_hash", ids[5], op="=")) == []
+
+def test_hash_index_planner(tmp_path) :
+    db = Database.create(tmp_path / "db")
+    table = db.add_table("test", [cspec("id", "int"), cspec("name", "str")])
+    table.add_index("id_hash", "id", kind="hash")
+
+    table.insert({"id" : 1, "name" : "bob"})
+    table.insert({"id" : 2, "name" : "alice"})
+    table.insert({"id" : 2, "name" : "alice again"})
+    table.insert({"id" : 3, "name" : "charlie"})
+
+    query = db.query("test").filter("id = 2").sort("name")
+    assert query.run() == [{"id" : 2, "name" : "alice"}, {"id" : 2, "name" : "alice again"}]
+    assert "id_hash" in query.show_plan()[0]
+
+    query = db.query("test").filter("id in (1, 3, 1, 7)").sort("id")
+    assert query.run() == [{"id" : 1, "name" : "bob"}, {"id" : 3, "name" : "charlie"}]
+    assert "id_hash" in query.show_plan()[0]
+
+    # Range conditions can't use a hash index.
+    query = db.query("test").filter("id > 1").sort("name")
+    assert query.run() == [{"id" : 2, "name" : "alice"}, {"id" : 2, "name" : "alice again"}, {"id" : 3, "name" : "charlie"}]
+    assert "table scan" in query.show_plan()[0]
+
+    # With a B+-Tree on the same column, equality still uses the hash
+    # index, ranges and sorts the B+-Tree.
+    table.add_index("id_tree", "id")
+    assert "id_hash" in db.query("test").filter("id = 2").show_plan()[0]
+    assert "id_hash" in db.query("test").filter("id in (1, 3)").show_plan()[0]
+    query = db.query("test").filter("id > 1")
+    assert "id_tree" in query.show_plan()[0]
+    assert sorted(r["name"] for r in query.run()) == ["alice", "alice again", "charlie"]
+    assert "id_tree" in db.query("test").sort("id").show_plan()[0]
+
+def test_hash_index_reopen(tmp_path) :
+    db = Database.create(tmp_path / "db")
+    table = db.add_table("test", [cspec("id", "int")])
+    table.add_index("id_hash", "id", kind="hash")
+    for i in range(10) :
+        table.insert({"id" : i})
+
+    db2 = Database.open(tmp_path / "db")
+    table = db2.table("test")
+    assert table.index("id_hash").kind == "hash"
+    assert list(table.index_scan("id_hash", 4, op="=")) == [{"id" : 4}]
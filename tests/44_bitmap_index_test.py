@@ -0,0 +1,72 @@
+from gertrude import Database, cspec
+from gertrude.expression import expr_parse
+import logging
+import pytest
+import random
+
+STATUSES = ["new", "active", "done", None]
+
+@pytest.fixture(scope="function")
+def setup_database(make_table, caplog) :
+    caplog.set_level(logging.DEBUG, logger="gertrude.runner")
+
+    # half the rows before the indexes, half after.
+    rng = random.Random(44)
+    rows = [{"id" : i, "status" : rng.choice(STATUSES), "flag" : rng.choice([True, False, None]),
+             "amount" : rng.randint(0, 100)} for i in range(200)]
+    return make_table([
+        cspec("id", "int", pk=True), cspec("status", "str"), cspec("flag", "bool"), cspec("amount", "int")
+    ], rows, {
+        "status_bm" : {"column" : "status", "kind" : "bitmap"},
+        "flag_bm" : {"column" : "flag", "kind" : "bitmap"},
+    }, before=100)
+
+def _expected(rows, condition) :
+    from gertrude.lib.types.value import Value
+    expr = expr_parse(condition)
+    types = {"id" : "int", "status" : "str", "flag" : "bool", "amount" : "int"}
+    retval = []
+    for r in rows :
+        if expr.calc({k : Value(types[k], v) for k, v in r.items()}) :
+            retval.append(r)
+    return sorted(retval, key=lambda x : x["id"])
+
+@pytest.mark.parametrize("condition", [
+    "status = 'active'",
+    "'done' = status",
+    "status != 'active'",
+    "flag",
+    "not flag",
+    "status is null",
+    "status in ('new', 'done')",
+    "status not in ('new', 'done')",
+    "status = 'active' and flag",
+    "status = 'active' or not flag",
+    "not (status = 'done' or flag = false)",
+    "status = 'active' and amount > 50",
+])
+def test_bitmap_filter(setup_database, condition) :
+    db, table, rows = setup_database
+
+    query = db.query("test").filter(condition).sort("id")
+    assert query.run() == _expected(rows, condition)
+    assert "bitmap" in query.show_plan()[0]
+
+def test_bitmap_delete(setup_database) :
+    db, table, rows = setup_database
+
+    for r in rows[::3] :
+        assert table.delete(r)
+    rows = [r for i, r in enumerate(rows) if i % 3 != 0]
+
+    query = db.query("test").filter("status = 'new'", "flag").sort("id")
+    assert query.run() == _expected(rows, "status = 'new' and flag")
+
+    data = sorted(table.index_scan("status_bm", "done", op="="), key=lambda x : x["id"])
+    assert data == _expected(rows, "status = 'done'")
+
+    # Survives being reopened
+    db2 = Database.open(db.db_path)
+    query = db2.query("test").filter("status = 'new' and flag").sort("id")
+    assert query.run() == _expected(rows, "status = 'new' and flag")
+    assert "bitmap" in query.show_plan()[0]
@@ -0,0 +1,44 @@
+from gertrude import Database, cspec
+import pytest
+import random
+
+
+@pytest.mark.parametrize("kind", ["btree", "hash", "bitmap"])
+def test_multi_get(tmp_path, kind) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("grp", "int")])
+
+    # lots of duplicates, so runs of the same key cross leaves.
+    rng = random.Random(45)
+    rows = [{"id" : i, "grp" : rng.randint(0, 30)} for i in range(300)]
+    rng.shuffle(rows)
+    for r in rows :
+        table.insert(r)
+    index = table.add_index("grp_idx", "grp", kind=kind)
+
+    keys = [17, 3, 30, 99, 3, 0, -5, 12]
+    found = index.multi_get(keys)
+    assert set(found.keys()) == set(keys)
+    for k in keys :
+        assert sorted(found[k]) == sorted(index.scan(k, "eq"))
+
+    rows_found = table.index_multi_get("grp_idx", keys)
+    for k in keys :
+        assert sorted(x["id"] for x in rows_found[k]) == sorted(r["id"] for r in rows if r["grp"] == k)
+
+    assert index.multi_get([]) == {}
+
+def test_multi_get_order(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "int", pk=True)])
+    for i in range(100) :
+        table.insert({"id" : i})
+
+    found = table.index("pk_id").multi_get([50, 5, 75, 200])
+    # B+-tree results come back in index order.
+    assert list(found.keys()) == [5, 50, 75, 200]
+    assert [len(x) for x in found.values()] == [1, 1, 1, 0]
+
+    query = db.query("test").filter("id in (75, 5, 50, 5)")
+    assert query.run() == [{"id" : 5}, {"id" : 50}, {"id" : 75}]
+    assert "pk_id" in query.show_plan()[0]
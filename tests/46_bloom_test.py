@@ -0,0 +1,63 @@
+from gertrude import Database, cspec
+from gertrude.index import Index
+import pytest
+
+
+@pytest.mark.parametrize("kind", ["btree", "hash"])
+def test_bloom_filter(tmp_path, monkeypatch, kind) :
+    db = Database.create(tmp_path / "db", index_fanout=8)
+    table = db.add_table("test", [cspec("id", "int")])
+    for i in range(0, 200, 2) :
+        table.insert({"id" : i})
+
+    index = table.add_index("id_idx", "id", kind=kind, unique=True, bloom=True)
+    assert index.bloom is not None
+    assert (index.path / "bloom").exists()
+    start_blocks = index.bloom.blocks
+
+    # Enough inserts to make the filter rebuild itself bigger.
+    for i in range(1, 6000, 2) :
+        table.insert({"id" : i})
+    assert index.bloom.blocks > start_blocks
+
+    for i in range(0, 200, 2) :
+        assert index.bloom.might_contain(index._gen_value(i).raw)
+        assert list(table.index_scan("id_idx", i, op="=")) == [{"id" : i}]
+    with pytest.raises(ValueError) :
+        table.insert({"id" : 4})
+
+    # Most keys that are not there should never get as far as the index.
+    probes = 0
+    def counting(self, key) :
+        nonlocal probes
+        probes += 1
+        return []
+    monkeypatch.setattr(type(index), "_lookup" if kind == "hash" else "_find_leftmost_path", counting)
+    for i in range(10000, 11000) :
+        assert list(index.scan(i, "eq")) == []
+    assert probes < 50
+
+def test_bloom_reopen(tmp_path) :
+    db = Database.create(tmp_path / "db")
+    table = db.add_table("test", [cspec("id", "int")])
+    table.add_index("id_idx", "id", unique=True, bloom=True)
+    for i in range(100) :
+        table.insert({"id" : i})
+
+    db2 = Database.open(tmp_path / "db")
+    table = db2.table("test")
+    index = table.index("id_idx")
+    assert index.bloom is not None and index.bloom.count == 100
+    assert list(table.index_scan("id_idx", 42, op="=")) == [{"id" : 42}]
+    assert table.index_multi_get("id_idx", [5, 500]) == {5 : [{"id" : 5}], 500 : []}
+
+    # Without the file, it is rebuilt from the index.
+    (index.path / "bloom").unlink()
+    index = Index._load(index.path, table.db_ctx)
+    assert index.bloom is not None and index.bloom.count == 100
+
+def test_bloom_not_for_bitmap(tmp_path) :
+    db = Database.create(tmp_path / "db")
+    table = db.add_table("test", [cspec("flag", "bool")])
+    with pytest.raises(ValueError) :
+        table.add_index("flag_bm", "flag", kind="bitmap", bloom=True)
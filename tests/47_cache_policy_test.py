@@ -0,0 +1,132 @@
+from gertrude import Database, cspec
+from gertrude.lib.cache import EVICTION_POLICIES, EvictionPolicy, LRUCache, TwoQPolicy
+from gertrude.lib.types.index import make_leaf
+import pytest
+
+
+def _run_workload(tmp_path, policy) :
+    cache = LRUCache(40, policy)
+    cache.register(1, tmp_path)
+    for block_id in range(600) :
+        cache.put(1, block_id, make_leaf(block_id, []), cache=False)
+
+    hot = range(10)
+    # the hot blocks get used over and over, along with some others ...
+    for i in range(5) :
+        for block_id in hot :
+            cache.get(1, block_id)
+        for block_id in range(500 + i * 20, 520 + i * 20) :
+            cache.get(1, block_id)
+    # ... then a report scans through everything else once.
+    for block_id in range(100, 500) :
+        cache.get(1, block_id)
+
+    before = cache.stats.hits
+    for block_id in hot :
+        assert cache.get(1, block_id).n == block_id
+    assert len(cache.cache) <= 40
+    return cache.stats.hits - before, cache.stats
+
+def test_lru_is_not_scan_resistant(tmp_path) :
+    hits, stats = _run_workload(tmp_path, "lru")
+    assert hits == 0
+    assert stats.policy == "lru"
+
+@pytest.mark.parametrize("policy", ["2q", "arc"])
+def test_scan_resistant_policies(tmp_path, policy) :
+    hits, stats = _run_workload(tmp_path, policy)
+    assert hits == 10
+    assert stats.policy == policy
+    assert len(stats.policy_stats) > 0
+
+def test_bad_policy(tmp_path) :
+    with pytest.raises(ValueError) :
+        LRUCache(10, "fifo")
+    with pytest.raises(ValueError) :
+        Database.create(tmp_path / "db", index_cache_policy="fifo")
+
+@pytest.mark.parametrize("policy", ["lru", "2q", "arc"])
+def test_victim_exclude(policy) :
+    p = EVICTION_POLICIES[policy](4)
+    for block_id in range(3) :
+        p.admit((1, block_id))
+    assert p.victim(exclude={(1, 0)}) == (1, 1)
+    assert p.victim(exclude={(1, 0), (1, 2)}) is None
+    assert p.victim() == (1, 0)
+
+def test_held_block_keeps_its_place(tmp_path) :
+    p = TwoQPolicy(4)
+    # A block asked for again after being pushed out goes to the main list.
+    p.admit((1, 0))
+    assert p.victim() == (1, 0)
+    p.admit((1, 0))
+    p.admit((1, 1))
+    assert list(p.am) == [(1, 0)]
+
+    # Held, it is passed over without being demoted to the FIFO.
+    assert p.victim(exclude={(1, 0)}) == (1, 1)
+    assert list(p.am) == [(1, 0)] and len(p.a1in) == 0
+
+    # In the cache, a held block stays the oldest, and goes first once let go.
+    cache = LRUCache(2)
+    cache.register(1, tmp_path)
+    for block_id in range(5) :
+        cache.put(1, block_id, make_leaf(block_id, []), cache=False)
+    cache.pin(1, 0)
+    for block_id in range(1, 4) :
+        cache.get(1, block_id)
+    assert (1, 0) in cache.cache
+    cache.unpin(1, 0)
+    cache.get(1, 4)
+    assert sorted(cache.cache) == [(1, 3), (1, 4)]
+
+@pytest.mark.parametrize("policy", ["lru", "2q", "arc"])
+def test_database_policy(tmp_path, policy) :
+    db = Database.create(tmp_path / "db", index_fanout=6, index_cache_size=8, index_cache_policy=policy)
+    table = db.add_table("test", [cspec("id", "int", pk=True)])
+    for i in range(200) :
+        table.insert({"id" : i})
+    for i in range(0, 200, 7) :
+        assert list(table.index_scan("pk_id", i, op="=")) == [{"id" : i}]
+    assert [x["id"] for x in table.index_scan("pk_id")] == list(range(200))
+    assert db.cache_stats.policy == policy
+    assert db.cache_stats.blocks <= 8
+
+    db2 = Database.open(tmp_path / "db")
+    assert db2.cache_stats.policy == policy
+    assert db2.cache_stats.size == 8
+
+def test_cache_byte_budget(tmp_path) :
+    budget = 60_000
+    db = Database.create(tmp_path / "db", index_fanout=10, index_cache_size=10_000, index_cache_bytes=budget)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("name", "str")])
+    table.add_index("name_idx", "name")
+    for i in range(500) :
+        table.insert({"id" : i, "name" : f"{i:05}" + "x" * 200})
+
+    for i in range(0, 500, 3) :
+        assert len(list(table.index_scan("name_idx", f"{i:05}" + "x" * 200, op="="))) == 1
+        assert len(list(table.index_scan("pk_id", i, op="="))) == 1
+
+    stats = db.cache_stats
+    assert stats.max_bytes == budget
+    assert 0 < stats.bytes <= budget
+    assert stats.evictions > 0
+    assert set(stats.index_bytes) == {"test.pk_id", "test.name_idx"}
+    assert sum(stats.index_bytes.values()) == stats.bytes + stats.pinned_bytes
+    # Long string keys make for much bigger nodes.
+    assert stats.index_bytes["test.name_idx"] > stats.index_bytes["test.pk_id"]
+
+    table.drop_index("name_idx")
+    stats = db.cache_stats
+    assert set(stats.index_bytes) == {"test.pk_id"}
+    assert stats.bytes + stats.pinned_bytes == stats.index_bytes["test.pk_id"]
+
+def test_incomplete_policy() :
+    class NoVictim(EvictionPolicy) :
+        def hit(self, key) : pass
+        def admit(self, key) : pass
+        def discard(self, key) : pass
+
+    with pytest.raises(TypeError) :
+        NoVictim(4)
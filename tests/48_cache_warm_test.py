@@ -0,0 +1,69 @@
+from gertrude import Database, cspec
+import pytest
+
+
+@pytest.fixture(scope="function")
+def db_path(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6, index_cache_size=4)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("name", "str")])
+    table.add_index("name_hash", "name", kind="hash")
+    for i in range(300) :
+        table.insert({"id" : i, "name" : f"n{i}"})
+    return tmp_path / "db"
+
+@pytest.mark.parametrize("warm", ["sync", "background"])
+def test_warm_on_open(db_path, warm) :
+    db = Database.open(db_path, warm=warm)
+    assert db.wait_for_warm(timeout=10)
+
+    stats = db.cache_stats
+    # every internal node plus the hash directory, and nothing evicted.
+    assert stats.pinned_blocks == db.warm_cache() > 3
+    assert stats.evictions == 0
+
+    # A lookup now only has to read leaves / buckets. (The B+-tree scan
+    # may peek at the next leaf to see the run of keys has ended.)
+    table = db.table("test")
+    before = db.cache_stats.misses
+    assert list(table.index_scan("pk_id", 150, op="=")) == [{"id" : 150, "name" : "n150"}]
+    assert list(table.index_scan("name_hash", "n42", op="=")) == [{"id" : 42, "name" : "n42"}]
+    assert db.cache_stats.misses - before <= 3
+
+def test_pinned_nodes_survive_scans(db_path) :
+    db = Database.open(db_path)
+    table = db.table("test")
+    assert list(table.index_scan("pk_id", 1, op="=")) == [{"id" : 1, "name" : "n1"}]
+    pinned = db.cache_stats.pinned_blocks
+
+    assert len(list(table.index_scan("pk_id"))) == 300
+    stats = db.cache_stats
+    assert stats.evictions > 0
+    assert stats.blocks <= 4
+    assert stats.pinned_blocks >= pinned
+
+def test_no_pinning(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6, index_cache_size=4, index_cache_pin_internal=False)
+    table = db.add_table("test", [cspec("id", "int", pk=True)])
+    for i in range(100) :
+        table.insert({"id" : i})
+    assert db.cache_stats.pinned_blocks == 0
+    assert db.cache_stats.blocks <= 4
+
+def test_bad_warm_mode(db_path) :
+    with pytest.raises(ValueError) :
+        Database.open(db_path, warm="lukewarm")
+
+def test_pinned_byte_budget(tmp_path) :
+    budget = 20_000
+    db = Database.create(tmp_path / "db", index_fanout=6, index_cache_size=10_000, index_cache_bytes=budget)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("name", "str")])
+    table.add_index("name_idx", "name")
+    for i in range(500) :
+        table.insert({"id" : i, "name" : f"{i:05}" + "x" * 100})
+    db.warm_cache()
+
+    # Upper levels that don't fit in half the budget are cached like leaves.
+    stats = db.cache_stats
+    assert 0 < stats.pinned_bytes <= budget // 2
+    assert stats.bytes + stats.pinned_bytes <= budget
+    assert len(list(table.index_scan("name_idx", "00042" + "x" * 100, op="="))) == 1
@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+from gertrude import Database, cspec
+from gertrude.int_id import IntegerIdGenerator
+from gertrude.lib.cache import LRUCache
+from gertrude.lib.types.index import make_leaf
+import random
+
+
+def test_pin_unpin(tmp_path) :
+    cache = LRUCache(2)
+    cache.register(1, tmp_path)
+    for block_id in range(10) :
+        cache.put(1, block_id, make_leaf(block_id, []), cache=False)
+
+    cache.pin(1, 0)
+    cache.pin(1, 0)
+    for block_id in range(1, 10) :
+        cache.get(1, block_id)
+    assert (1, 0) in cache.cache
+    assert cache.stats.held_blocks == 1
+
+    cache.unpin(1, 0)
+    cache.get(1, 5)
+    assert (1, 0) in cache.cache
+
+    cache.unpin(1, 0)
+    assert cache.stats.held_blocks == 0
+    cache.get(1, 6)
+    cache.get(1, 7)
+    assert (1, 0) not in cache.cache
+
+def test_concurrent_readers(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6, index_cache_size=8, index_cache_policy="arc")
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("name", "str")])
+    table.add_index("name_hash", "name", kind="hash")
+    for i in range(400) :
+        table.insert({"id" : i, "name" : f"n{i}"})
+
+    db = Database.open(tmp_path / "db")
+    table = db.table("test")
+
+    def reader(seed : int) :
+        rnd = random.Random(seed)
+        for _ in range(20) :
+            i = rnd.randrange(400)
+            assert list(table.index_scan("pk_id", i, op="=")) == [{"id" : i, "name" : f"n{i}"}]
+            assert list(table.index_scan("name_hash", f"n{i}", op="=")) == [{"id" : i, "name" : f"n{i}"}]
+            assert [r["id"] for r in table.index_scan("pk_id", i, op=">=")][:5] == list(range(i, min(i + 5, 400)))
+            query = db.query("test").filter(f"id in ({i}, {(i * 7) % 400})")
+            assert len(query.run()) == len({i, (i * 7) % 400})
+        return True
+
+    with ThreadPoolExecutor(max_workers=8) as pool :
+        assert all(pool.map(reader, range(8)))
+
+    # Scans that were stopped early gave back their leaves.
+    assert db.cache_stats.held_blocks == 0
+    assert db.cache_stats.blocks <= 8
+
+def test_id_generator_threads(tmp_path) :
+    gen = IntegerIdGenerator(tmp_path / "int_id")
+    with ThreadPoolExecutor(max_workers=8) as pool :
+        ids = list(pool.map(lambda _ : gen.gen_id(), range(2000)))
+    assert len(set(ids)) == 2000
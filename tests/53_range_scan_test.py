@@ -0,0 +1,78 @@
+from gertrude import cspec
+import operator
+import pytest
+import random
+
+
+@pytest.fixture(scope="function")
+def setup_table(make_table) :
+    # lots of duplicates, so runs of the same key cross leaves.
+    rng = random.Random(53)
+    rows = [{"id" : i, "grp" : rng.randint(0, 40), "name" : f"n{i}"} for i in range(300)]
+    rng.shuffle(rows)
+    return make_table([cspec("id", "int", pk=True), cspec("grp", "int"), cspec("name", "str")], rows, {
+        "grp_idx" : {"column" : "grp"},
+        "grp_hash" : {"column" : "grp", "kind" : "hash"},
+    })
+
+@pytest.mark.parametrize("lower_op, upper_op", [
+    (">=", "<="), (">", "<"), (">=", "<"), (">", "<="), (None, "<"),
+])
+@pytest.mark.parametrize("lower, upper", [(10, 20), (0, 40), (15, 15), (20, 10), (0, 3), (38, 99)])
+def test_bounded_scan(setup_table, lower_op, upper_op, lower, upper) :
+    db, table, rows = setup_table
+
+    ops = {">" : operator.gt, ">=" : operator.ge, "<" : operator.lt, "<=" : operator.le}
+    expected = sorted(r["id"] for r in rows
+                      if (lower_op is None or ops[lower_op](r["grp"], lower)) and ops[upper_op](r["grp"], upper))
+
+    index = table.index("grp_idx")
+    heap_ids = list(index.scan(lower if lower_op else None, lower_op, upper, upper_op))
+    found = list(table.fetch_rows(heap_ids))
+    assert sorted(x["id"] for x in found) == expected
+    # Still in key order.
+    assert [x["grp"] for x in found] == sorted(x["grp"] for x in found)
+
+    found = table.index_scan("grp_idx", lower if lower_op else None, op=lower_op, upper_key=upper, upper_op=upper_op)
+    assert sorted(x["id"] for x in found) == expected
+
+def test_bounded_scan_errors(setup_table) :
+    db, table, rows = setup_table
+
+    index = table.index("grp_idx")
+    with pytest.raises(ValueError) :
+        list(index.scan(10, ">=", 20, ">"))
+    with pytest.raises(ValueError) :
+        list(index.scan(10, "<", 20, "<"))
+    with pytest.raises(ValueError) :
+        list(index.scan(10, ">=", None, "<"))
+    with pytest.raises(ValueError) :
+        list(index.scan(10, ">=", 20))
+    with pytest.raises(ValueError) :
+        list(table.index("grp_hash").scan(10, "=", 20, "<"))
+
+@pytest.mark.parametrize("condition, check", [
+    ("grp between 10 and 20", lambda r : 10 <= r["grp"] <= 20),
+    ("grp > 10 and grp < 20", lambda r : 10 < r["grp"] < 20),
+    ("grp < 20 and grp >= 10", lambda r : 10 <= r["grp"] < 20),
+    ("grp >= 10 and id < 100 and grp <= 12", lambda r : 10 <= r["grp"] <= 12 and r["id"] < 100),
+])
+def test_range_query(setup_table, condition, check) :
+    db, table, rows = setup_table
+    table.drop_index("grp_hash")
+
+    query = db.query("test").filter(condition).sort("id")
+    assert query.run() == sorted((r for r in rows if check(r)), key=lambda x : x["id"])
+    plan = query.show_plan()
+    assert "grp_idx" in plan[0] and "range" in plan[0]
+
+def test_range_query_separate_filters(setup_table) :
+    db, table, rows = setup_table
+    table.drop_index("grp_hash")
+
+    query = db.query("test").filter("grp >= 30", "grp < 33").sort("id")
+    assert query.run() == sorted((r for r in rows if 30 <= r["grp"] < 33), key=lambda x : x["id"])
+    plan = query.show_plan()
+    assert "range" in plan[0]
+    # Both bounds came from the index, nothing left to filter.
+    assert not plan[1].startswith("FilterOp")
@@ -0,0 +1,75 @@
+from gertrude import cspec, desc
+from gertrude.lib import heap
+import pytest
+import random
+
+
+@pytest.fixture(scope="function")
+def setup_table(make_table) :
+    rng = random.Random(54)
+    rows = [{"id" : i, "created" : 1000 + i * 3, "grp" : rng.randint(0, 30)} for i in range(300)]
+    rng.shuffle(rows)
+    return make_table([cspec("id", "int", pk=True), cspec("created", "int"), cspec("grp", "int")], rows, {
+        "created_idx" : {"column" : "created"},
+        "grp_idx" : {"column" : "grp"},
+    })
+
+@pytest.mark.parametrize("args", [
+    (None, None, None, None), (10, ">=", None, None), (10, ">", 20, "<"), (10, ">=", 20, "<="),
+    (15, "=", None, None), (15, "<", None, None), (15, "<=", None, None), (99, "<", None, None),
+    (50, ">", None, None), (0, "<", None, None),
+])
+def test_reverse_scan(setup_table, args) :
+    db, table, rows = setup_table
+
+    index = table.index("grp_idx")
+    forward = [r["grp"] for r in table.fetch_rows(index.scan(*args))]
+    backward = [r["grp"] for r in table.fetch_rows(index.scan(*args, reverse=True))]
+    assert sorted(backward) == forward
+    assert backward == sorted(backward, reverse=True)
+
+    found = table.index_scan("grp_idx", args[0], op=args[1], upper_key=args[2], upper_op=args[3], reverse=True)
+    assert [r["grp"] for r in found] == backward
+
+    table.add_index("grp_hash", "grp", kind="hash")
+    with pytest.raises(ValueError) :
+        list(table.index("grp_hash").scan(reverse=True))
+
+def test_latest_n(setup_table, monkeypatch) :
+    db, table, rows = setup_table
+
+    reads = 0
+    real_read = heap.read
+    def counting_read(*args, **kwargs) :
+        nonlocal reads
+        reads += 1
+        return real_read(*args, **kwargs)
+    monkeypatch.setattr(heap, "read", counting_read)
+
+    query = db.query("test").sort(desc("created")).limit(10)
+    expected = sorted(rows, key=lambda x : -x["created"])[:10]
+    assert query.run() == expected
+
+    plan = query.show_plan()
+    assert "created_idx" in plan[0] and "reverse" in plan[0]
+    assert not any(x.startswith("SortOp") for x in plan)
+    # Only about the rows returned were read, not the whole table. Batches
+    # of reads double from one, so at most twice as many.
+    assert 10 <= reads < 20
+
+def test_sort_from_filter_index(setup_table) :
+    db, table, rows = setup_table
+
+    query = db.query("test").filter("created between 1100 and 1200").sort(desc("created"))
+    assert query.run() == sorted((r for r in rows if 1100 <= r["created"] <= 1200), key=lambda x : -x["created"])
+    plan = query.show_plan()
+    assert len(plan) == 1 and "reverse" in plan[0]
+
+    query = db.query("test").filter("created < 1100").sort("created").limit(5)
+    assert query.run() == sorted((r for r in rows if r["created"] < 1100), key=lambda x : x["created"])[:5]
+    assert not any(x.startswith("SortOp") for x in query.show_plan())
+
+    # The index is on another column, so the sort stays.
+    query = db.query("test").filter("grp = 7").sort(desc("created"))
+    assert query.run() == sorted((r for r in rows if r["grp"] == 7), key=lambda x : -x["created"])
+    assert any(x.startswith("SortOp") for x in query.show_plan())
@@ -0,0 +1,83 @@
+from gertrude import Database, cspec
+import pytest
+import random
+
+
+@pytest.fixture(scope="function")
+def setup_table(make_table) :
+    rng = random.Random(57)
+    rows = []
+    for i in range(200) :
+        name = rng.choice(["bob", "Alice", "CHARLIE", "dave"]) + str(i % 20)
+        rows.append({"id" : i, "email" : rng.choice([name.lower(), name.upper(), name]) + "@example.com",
+                     "code" : rng.choice(["ABC", "XYZ", "QRS"]) + f"{i:04d}"})
+    rows.append({"id" : 999, "email" : None, "code" : None})
+
+    # half the rows before the indexes, half after.
+    return make_table([cspec("id", "int", pk=True), cspec("email", "str"), cspec("code", "str")], rows, {
+        "email_upper" : {"expr" : "upper(email)"},
+        "code_prefix" : {"expr" : "substr(code, 1, 3)", "kind" : "hash"},
+    }, before=100)
+
+def test_expression_index(setup_table) :
+    db, table, rows = setup_table
+
+    index = table.index("email_upper")
+    assert index.column is None
+    assert index.coltype == "str"
+    assert table.index("code_prefix").coltype == "str"
+
+    keys = sorted(set(r["email"].upper() for r in rows if r["email"] is not None))
+    for k in keys[:5] :
+        found = list(table.index_scan("email_upper", k, op="="))
+        assert sorted(x["id"] for x in found) == sorted(r["id"] for r in rows if r["email"] and r["email"].upper() == k)
+
+    # Index order is the order of the computed keys.
+    found = [x["email"] for x in table.index_scan("email_upper") if x["email"] is not None]
+    assert [x.upper() for x in found] == sorted(x.upper() for x in found)
+
+@pytest.mark.parametrize("condition, check, index_name", [
+    ("upper(email) = 'BOB3@EXAMPLE.COM'", lambda r : r["email"] and r["email"].upper() == "BOB3@EXAMPLE.COM", "email_upper"),
+    ("upper(email) >= 'C' and upper(email) < 'D'", lambda r : r["email"] and "C" <= r["email"].upper() < "D", "email_upper"),
+    ("upper(email) in ('DAVE1@EXAMPLE.COM', 'ALICE2@EXAMPLE.COM')",
+     lambda r : r["email"] and r["email"].upper() in ("DAVE1@EXAMPLE.COM", "ALICE2@EXAMPLE.COM"), "email_upper"),
+    ("substr(code, 1, 3) = 'XYZ' and id < 50", lambda r : r["code"] and r["code"][:3] == "XYZ" and r["id"] < 50, "code_prefix"),
+])
+def test_expression_query(setup_table, condition, check, index_name) :
+    db, table, rows = setup_table
+
+    query = db.query("test").filter(condition).sort("id")
+    assert query.run() == sorted((r for r in rows if check(r)), key=lambda x : x["id"])
+    assert index_name in query.show_plan()[0]
+
+def test_expression_not_matched(setup_table) :
+    db, table, rows = setup_table
+
+    # Different expressions, so the indexes can't be used.
+    for condition in ["lower(email) = 'bob3@example.com'", "substr(code, 1, 2) = 'XY'", "email = 'bob3@example.com'"] :
+        query = db.query("test").filter(condition)
+        assert "table scan" in query.show_plan()[0]
+
+def test_expression_index_maintained(setup_table) :
+    db, table, rows = setup_table
+
+    for r in rows[::3] :
+        assert table.delete(r)
+    rows = [r for i, r in enumerate(rows) if i % 3 != 0]
+
+    db2 = Database.open(db.db_path)
+    query = db2.query("test").filter("substr(code, 1, 3) = 'ABC'").sort("id")
+    assert query.run() == sorted((r for r in rows if r["code"] and r["code"][:3] == "ABC"), key=lambda x : x["id"])
+    assert "code_prefix" in query.show_plan()[0]
+
+def test_expression_index_errors(setup_table) :
+    db, table, rows = setup_table
+
+    with pytest.raises(ValueError) :
+        table.add_index("bad", "email", expr="upper(email)")
+    with pytest.raises(ValueError) :
+        table.add_index("bad")
+    with pytest.raises(ValueError) :
+        table.add_index("bad", expr="upper(nosuch)")
+    with pytest.raises(ValueError) :
+        table.add_index("bad", expr="upper(email)", kind="bitmap")
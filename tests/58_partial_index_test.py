@@ -0,0 +1,88 @@
+from gertrude import Database, cspec
+from gertrude.expression import expr_parse
+from gertrude.lib.expr_nodes import conjuncts, implies
+import pytest
+import random
+
+STATUSES = ["pending", "done", "archived"]
+
+@pytest.fixture(scope="function")
+def setup_table(make_table) :
+    rng = random.Random(58)
+    rows = [{"id" : i, "status" : rng.choices(STATUSES, [1, 3, 6])[0],
+             "due" : rng.randint(0, 1000), "amount" : rng.randint(0, 500)} for i in range(300)]
+
+    # half the rows before the indexes, half after.
+    return make_table([cspec("id", "int", pk=True), cspec("status", "str"),
+                       cspec("due", "int"), cspec("amount", "int")], rows, {
+        "due_pending" : {"column" : "due", "where" : "status = 'pending'"},
+        "amount_big" : {"column" : "amount", "kind" : "hash", "where" : "amount >= 400"},
+    }, before=150)
+
+def test_partial_index_contents(setup_table) :
+    db, table, rows = setup_table
+
+    found = list(table.index_scan("due_pending"))
+    assert sorted(x["id"] for x in found) == sorted(r["id"] for r in rows if r["status"] == "pending")
+    assert [x["due"] for x in found] == sorted(x["due"] for x in found)
+
+    # Delete some of each, the ones outside the index are just ignored.
+    for r in rows[::4] :
+        assert table.delete(r)
+    rows = [r for i, r in enumerate(rows) if i % 4 != 0]
+
+    db2 = Database.open(db.db_path)
+    table2 = db2.table("test")
+    found = list(table2.index_scan("due_pending"))
+    assert sorted(x["id"] for x in found) == sorted(r["id"] for r in rows if r["status"] == "pending")
+    found = list(table2.index_scan("amount_big"))
+    assert sorted(x["id"] for x in found) == sorted(r["id"] for r in rows if r["amount"] >= 400)
+
+@pytest.mark.parametrize("condition, check, index_name", [
+    ("status = 'pending' and due < 100", lambda r : r["status"] == "pending" and r["due"] < 100, "due_pending"),
+    ("due between 200 and 300 and status = 'pending'", lambda r : r["status"] == "pending" and 200 <= r["due"] <= 300, "due_pending"),
+    ("amount = 450", lambda r : r["amount"] == 450, "amount_big"),
+    ("amount in (420, 499) and amount > 410", lambda r : r["amount"] in (420, 499), "amount_big"),
+    # Not implied, so the partial indexes can't be used.
+    ("due < 100", lambda r : r["due"] < 100, "table scan"),
+    ("status = 'done' and due < 100", lambda r : r["status"] == "done" and r["due"] < 100, "table scan"),
+    ("amount = 300", lambda r : r["amount"] == 300, "table scan"),
+])
+def test_partial_index_query(setup_table, condition, check, index_name) :
+    db, table, rows = setup_table
+
+    query = db.query("test").filter(condition).sort("id")
+    assert query.run() == sorted((r for r in rows if check(r)), key=lambda x : x["id"])
+    assert index_name in query.show_plan()[0]
+
+def test_partial_preferred(setup_table) :
+    db, table, rows = setup_table
+
+    table.add_index("due_all", "due")
+    query = db.query("test").filter("status = 'pending' and due > 900")
+    assert "due_pending" in query.show_plan()[0]
+    query = db.query("test").filter("due > 900")
+    assert "due_all" in query.show_plan()[0]
+
+@pytest.mark.parametrize("conds, pred, expected", [
+    ("x = 1 and y = 2", "y = 2", True),
+    ("x = 1", "x = 1 and y = 2", False),
+    ("x > 10", "x >= 5", True),
+    ("x > 10", "x > 10", True),
+    ("x >= 10", "x > 10", False),
+    ("x = 10", "x > 5", True),
+    ("x < 3", "x <= 3", True),
+    ("x <= 3", "x < 3", False),
+    ("x > 10", "y > 5", False),
+    ("x > 'b'", "x > 5", False),
+])
+def test_implies(conds, pred, expected) :
+    assert implies(conjuncts(expr_parse(conds)), expr_parse(pred)) == expected
+
+def test_partial_index_errors(setup_table) :
+    db, table, rows = setup_table
+
+    with pytest.raises(ValueError) :
+        table.add_index("bad", "due", where="nosuch = 1")
+    with pytest.raises(ValueError) :
+        table.add_index("bad", "status", kind="bitmap", where="due > 5")
@@ -133,7 +133,9 @@ class TestQuery() :
         assert data == [{"id" : 2, "name" : "alice"}, {"id" : 3, "name" : "charlie"}]
         plan = query.show_plan()
         print("\n".join(plan))
-        assert len(plan) == 2
+        # The index returns the rows in id order, so no sort is needed.
+        assert len(plan) == 1
+        assert "pk_id" in plan[0]
 
     def test_distinct_query(self) :
         table = self.db.add_table("test", [
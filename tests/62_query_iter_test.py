@@ -0,0 +1,63 @@
+from gertrude import cspec
+from gertrude.lib import heap
+import pytest
+
+
+@pytest.fixture(scope="function")
+def setup_table(make_table) :
+    rows = [{"id" : i, "grp" : i % 10} for i in range(300)]
+    db, table, _ = make_table([cspec("id", "int", pk=True), cspec("grp", "int")], rows)
+    return db, table
+
+@pytest.fixture
+def count_reads(monkeypatch) :
+    reads = []
+    real_read = heap.read
+    def counting_read(*args, **kwargs) :
+        reads.append(1)
+        return real_read(*args, **kwargs)
+    monkeypatch.setattr(heap, "read", counting_read)
+    return reads
+
+def test_iter(setup_table) :
+    db, table = setup_table
+
+    query = db.query("test").filter("grp = 3").add_column("double", "id * 2").select("id", "double").distinct()
+    rows = query.iter()
+    assert iter(rows) is rows
+    assert list(rows) == query.run()
+    assert len(query.run()) == 30
+
+    values = next(db.query("test").sort("id").iter(values=True))
+    assert values["id"].value == 0
+
+def test_filter_limit_streams(setup_table, count_reads) :
+    db, table = setup_table
+
+    # grp is not indexed, so this is a table scan.
+    rows = db.query("test").filter("grp = 3").limit(5).run()
+    assert len(rows) == 5 and all(r["grp"] == 3 for r in rows)
+    # Only read until the limit was reached, not the whole table.
+    assert len(count_reads) < 100
+
+def test_iter_close(setup_table) :
+    db, table = setup_table
+
+    rows = db.query("test").filter("id >= 10").iter()
+    assert next(rows)["id"] == 10
+    assert db.cache_stats.held_blocks == 1
+    rows.close()
+    assert db.cache_stats.held_blocks == 0
+
+def test_join_empty_side(setup_table) :
+    db, table = setup_table
+    db.add_table("other", [cspec("oid", "int"), cspec("name", "str")])
+
+    query = db.query("test").filter("id < 3").join(db.query("other"), ("id", "oid"))
+    assert query.run() == []
+    query = db.query("test").filter("id < 3").join(db.query("other"), ("id", "oid"), how="left_outer").sort("id")
+    assert [r["id"] for r in query.run()] == [0, 1, 2]
+    # The right side's columns are still there, as nulls.
+    assert all(r["oid"] is None and r["name"] is None for r in query.run())
+    query = db.query("other").join(db.query("test"), ("oid", "id"))
+    assert query.run() == []
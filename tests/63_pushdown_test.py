@@ -0,0 +1,85 @@
+from gertrude import Database, cspec
+import pytest
+import random
+
+
+@pytest.fixture(scope="function")
+def setup_table(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("grp", "int"), cspec("code", "str")])
+    rows = [{"id" : i, "grp" : random.randint(0, 20), "code" : f"c{i}"} for i in range(300)]
+    for r in rows :
+        table.insert(r)
+    table.add_index("grp_idx", "grp")
+    table.add_index("code_idx", "code", unique=True)
+
+    yield db, table, rows
+
+@pytest.mark.parametrize("conditions, check", [
+    (["5 < grp"], lambda r : r["grp"] > 5),
+    (["10 >= grp"], lambda r : r["grp"] <= 10),
+    (["7 = grp"], lambda r : r["grp"] == 7),
+    (["grp >= 5", "grp < 9"], lambda r : 5 <= r["grp"] < 9),
+    (["5 <= grp", "9 > grp"], lambda r : 5 <= r["grp"] < 9),
+    (["id > 100 and grp = 3"], lambda r : r["id"] > 100 and r["grp"] == 3),
+])
+def test_pushdown(setup_table, conditions, check) :
+    db, table, rows = setup_table
+
+    query = db.query("test")
+    for c in conditions :
+        query = query.filter(c)
+    assert "grp_idx" in query.show_plan()[0]
+    assert sorted(r["id"] for r in query.run()) == sorted(r["id"] for r in rows if check(r))
+
+def test_most_selective(setup_table) :
+    db, table, rows = setup_table
+
+    # Equality on a unique index beats equality, which beats a range.
+    query = db.query("test").filter("id > 5").filter("grp = 3").filter("'c42' = code")
+    plan = query.show_plan()
+    assert "code_idx" in plan[0]
+    assert len(plan) == 2 and "FilterOp" in plan[1]
+    expected = [r["id"] for r in rows if r["id"] == 42 and r["grp"] == 3]
+    assert [r["id"] for r in query.run()] == expected
+
+    query = db.query("test").filter("id > 5 and grp = 3")
+    assert "grp_idx" in query.show_plan()[0]
+
+    # A range closed at both ends beats one open at the top.
+    query = db.query("test").filter("grp > 2", "id between 10 and 20")
+    assert "pk_id" in query.show_plan()[0]
+    assert sorted(r["id"] for r in query.run()) == sorted(r["id"] for r in rows if 10 <= r["id"] <= 20 and r["grp"] > 2)
+
+    # Filters after another step are left where they are.
+    query = db.query("test").filter("grp = 3").select("id", "grp").filter("id < 50")
+    assert "grp_idx" in query.show_plan()[0]
+    assert sorted(r["id"] for r in query.run()) == sorted(r["id"] for r in rows if r["grp"] == 3 and r["id"] < 50)
+
+def test_bitmap_ranked(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("grp", "str"), cspec("score", "int")])
+    rows = [{"id" : i, "grp" : "abc"[i % 3], "score" : i % 100} for i in range(450)]
+    for r in rows :
+        table.insert(r)
+    table.add_index("grp_bm", "grp", kind="bitmap")
+    table.add_index("score_idx", "score")
+
+    # One row through the unique index beats 150 from the bitmap.
+    query = db.query("test").filter("id = 5 and grp = 'c'")
+    assert "pk_id" in query.show_plan()[0]
+    assert query.run() == [{"id" : 5, "grp" : "c", "score" : 5}]
+
+    # Without statistics nothing else is known to beat the bitmap.
+    query = db.query("test").filter("grp = 'b'", "score < 3")
+    assert "bitmap" in query.show_plan()[0]
+
+    # With them, the range is expected to find about 14 rows.
+    table.analyze()
+    assert "score_idx" in query.show_plan()[0]
+    expected = sorted(r["id"] for r in rows if r["grp"] == "b" and r["score"] < 3)
+    assert sorted(r["id"] for r in query.run()) == expected
+
+    # A third of the table is past the point where a scan is quicker.
+    assert "table scan" in db.query("test").filter("grp = 'a'").show_plan()[0]
+    assert "pk_id" in db.query("test").filter("grp = 'a'", "id < 10").show_plan()[0]
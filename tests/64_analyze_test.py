@@ -0,0 +1,119 @@
+from gertrude import Database, cspec, desc
+from gertrude.lib.stats import column_stats, estimate_rows
+import pytest
+import random
+
+
+@pytest.fixture(scope="function")
+def setup_table(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=10)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("flag", "int"), cspec("score", "int"),
+                                  cspec("note", "str")])
+    # flag is 1 for 90% of the rows.
+    rows = [{"id" : i, "flag" : 0 if i % 10 == 0 else 1, "score" : random.randint(0, 999),
+             "note" : None if i % 4 == 0 else f"n{i % 50}"} for i in range(1000)]
+    for r in rows :
+        table.insert(r)
+    table.add_index("flag_idx", "flag")
+    table.add_index("score_idx", "score")
+
+    yield db, table, rows
+
+def test_column_stats() :
+    col = column_stats(list(range(100)) + [None] * 100, buckets=10)
+    assert col["ndv"] == 100 and col["nulls"] == 0.5
+    assert col["min"] == 0 and col["max"] == 99
+    assert len(col["histogram"]) == 11
+
+    assert estimate_rows(col, 200, 'lt', 50) == pytest.approx(50, abs=2)
+    assert estimate_rows(col, 200, 'ge', 90) == pytest.approx(10, abs=2)
+    assert estimate_rows(col, 200, 'eq', 7) == pytest.approx(1)
+    assert estimate_rows(col, 200, 'eq', 1000) == 0
+    assert estimate_rows(col, 200, 'lt', "x") is None
+
+    # A value that fills most buckets is estimated as most of the rows.
+    col = column_stats([5] * 90 + list(range(10)), buckets=10)
+    assert estimate_rows(col, 100, 'eq', 5) > 70
+    assert column_stats([])["histogram"] == []
+
+def test_analyze(setup_table) :
+    db, table, rows = setup_table
+
+    assert db.query("test").estimate() is None
+    columns = table.analyze()
+    assert columns["id"]["ndv"] == 1000
+    assert columns["flag"]["ndv"] == 2 and columns["flag"]["max"] == 1
+    assert columns["note"]["nulls"] == 0.25 and columns["note"]["ndv"] == 50
+
+    # Kept with the table.
+    db2 = Database.open(db.db_path)
+    assert db2.table("test").stats["columns"] == columns
+    assert db2.table("test").stats["analyzed"] == 1000
+
+    assert db.query("test").estimate() == 1000
+    assert db.query("test").filter("score < 100").estimate() == pytest.approx(100, rel=0.5)
+    assert db.query("test").filter("score < 500").limit(20).estimate() == 20
+
+def test_cost_based_choice(setup_table) :
+    db, table, rows = setup_table
+
+    # Without statistics any index that matches is used.
+    assert "flag_idx" in db.query("test").filter("flag = 1").show_plan()[0]
+    table.analyze()
+
+    # Matching 90% of the rows is quicker with a scan.
+    query = db.query("test").filter("flag = 1")
+    assert "table scan" in query.show_plan()[0]
+    assert len(query.run()) == 900
+    assert "flag_idx" in db.query("test").filter("flag = 0").show_plan()[0]
+
+    assert "score_idx" in db.query("test").filter("score > 950").show_plan()[0]
+    assert "table scan" in db.query("test").filter("score > 50").show_plan()[0]
+
+    # The smaller estimate wins, whatever the kind of condition.
+    query = db.query("test").filter("id > 10 and id < 990", "score between 10 and 20")
+    assert "score_idx" in query.show_plan()[0]
+    expected = sorted(r["id"] for r in rows if 10 < r["id"] < 990 and 10 <= r["score"] <= 20)
+    assert sorted(r["id"] for r in query.run()) == expected
+
+def test_join_build_side(setup_table) :
+    db, table, rows = setup_table
+    other = db.add_table("other", [cspec("oid", "int"), cspec("label", "str")])
+    for i in range(0, 1000, 100) :
+        other.insert({"oid" : i, "label" : f"l{i}"})
+    table.analyze()
+    other.analyze()
+
+    # The big table on the right is streamed, the small one on the left hashed.
+    query = db.query("other").join(db.query("test"), ("oid", "id"))
+    assert "build left" in query.show_plan()[-1]
+    found = sorted((r["oid"], r["label"], r["score"]) for r in query.run())
+    assert found == [(i, f"l{i}", rows[i]["score"]) for i in range(0, 1000, 100)]
+
+    query = db.query("test").join(db.query("other"), ("id", "oid"))
+    assert "build left" not in query.show_plan()[-1]
+    assert len(query.run()) == 10
+
+    query = db.query("other").join(db.query("test"), ("oid", "id"), how="left_outer")
+    assert "build left" not in query.show_plan()[-1]
+
+def test_join_keeps_left_order(setup_table) :
+    db, table, rows = setup_table
+    other = db.add_table("other", [cspec("oid", "int"), cspec("label", "str")])
+    for i in range(1000) :
+        other.insert({"oid" : i, "label" : f"l{i}"})
+    table.analyze()
+    other.analyze()
+
+    # The left side is small, but sorted - it mustn't be hashed.
+    expected = [r["score"] for r in sorted(rows, key=lambda r : -r["score"])][:5]
+    query = db.query("test").sort(desc("score")).limit(5).join(db.query("other"), ("id", "oid"))
+    assert "build left" not in query.show_plan()[-1]
+    assert [r["score"] for r in query.run()] == expected
+
+    # Nor when an index scan gives it its order.
+    query = db.query("test").filter("score > 980").join(db.query("other"), ("id", "oid"))
+    assert "score_idx" in query.show_plan()[0]
+    assert "build left" not in query.show_plan()[-1]
+    found = [r["score"] for r in query.run()]
+    assert found == sorted(found)
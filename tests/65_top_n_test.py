@@ -0,0 +1,47 @@
+from gertrude import Database, cspec, desc
+import pytest
+import random
+
+
+@pytest.fixture(scope="function")
+def setup_table(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("score", "int"), cspec("name", "str")])
+    rows = [{"id" : i, "score" : random.randint(0, 30), "name" : random.choice(["a", "b", "c"])} for i in range(400)]
+    random.shuffle(rows)
+    for r in rows :
+        table.insert(r)
+
+    yield db, table, rows
+
+@pytest.mark.parametrize("limit, offset", [(10, 0), (10, 15), (1, 0), (0, 0), (50, 380), (500, 0)])
+def test_top_n(setup_table, limit, offset) :
+    db, table, rows = setup_table
+
+    query = db.query("test").sort(desc("score"), "name").limit(limit, offset)
+    assert query.show_plan()[1].startswith("TopN")
+    # Ties come out in the same order as a full sort.
+    full = db.query("test").sort(desc("score"), "name").run()
+    assert query.run() == full[offset:offset+limit]
+
+    scores = [r["score"] for r in query.run()]
+    assert scores == sorted(scores, reverse=True)
+
+def test_limit_offset(setup_table) :
+    db, table, rows = setup_table
+
+    everything = db.query("test").run()
+    assert db.query("test").limit(5, 10).run() == everything[10:15]
+    assert "offset=10" in db.query("test").limit(5, 10).show_plan()[-1]
+
+    # An index in the sort order still stops early.
+    query = db.query("test").sort("id").limit(3, 7)
+    assert "TopN" not in "".join(query.show_plan())
+    assert [r["id"] for r in query.run()] == [7, 8, 9]
+
+    # Only a limit straight after the sort is folded in.
+    query = db.query("test").sort("score").select("id", "score").limit(3)
+    assert not any(x.startswith("TopN") for x in query.show_plan())
+
+    with pytest.raises(ValueError) :
+        db.query("test").limit(5, -1)
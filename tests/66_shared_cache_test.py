@@ -0,0 +1,86 @@
+from gertrude import Database, cspec
+from gertrude.lib.shared_cache import SharedBlockCache, _SLOT_HEADER, block_generation, read_block, write_block
+import subprocess
+import sys
+import uuid
+import pytest
+
+
+@pytest.fixture(scope="function")
+def shared_db(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6, index_shared_cache_bytes=8 << 20)
+    table = db.add_table("test", [cspec("id", "int", pk=True)])
+    for i in range(200) :
+        table.insert({"id" : i})
+    yield db
+    db.db_ctx.cache.shared.unlink()
+
+def test_shared_slots() :
+    cache = SharedBlockCache(f"gertrude_test_{uuid.uuid4().hex[:8]}", 1 << 16)
+    try :
+        cache.put(1, 10, 100, b"hello")
+        assert cache.get(1, 10, 100) == b"hello"
+        # Older generation of the file - stale.
+        assert cache.get(1, 10, 101) is None
+        assert cache.get(1, 11, 100) is None
+
+        # A torn write is caught by the crc.
+        offset = cache._offset(1, 10)
+        cache.shm.buf[offset + _SLOT_HEADER.size + 1] ^= 0xFF
+        assert cache.get(1, 10, 100) is None
+
+        # Too big for a slot - just not shared.
+        cache.put(1, 12, 1, b"x" * 10000)
+        assert cache.get(1, 12, 1) is None
+
+        other = SharedBlockCache(cache.name, 1 << 16)
+        assert not other.owner and other.slots == cache.slots
+        cache.put(2, 3, 7, b"shared")
+        assert other.get(2, 3, 7) == b"shared"
+        other.close()
+    finally :
+        cache.unlink()
+
+def test_block_generation(tmp_path) :
+    path = tmp_path / "001"
+    assert write_block(path, b"abcd") == 1
+    assert write_block(path, b"wxyz") == 2
+    # Same size, likely the same mtime, but a new generation.
+    assert block_generation(path) == 2
+    assert read_block(path) == (2, b"wxyz")
+    assert write_block(path, b"ab") == 3
+    assert read_block(path) == (3, b"ab")
+
+    # Files written before blocks had a generation.
+    path.write_bytes(b"\x81\xa1k\x01")
+    assert read_block(path) == (0, b"\x81\xa1k\x01")
+    assert write_block(path, b"ab") == 1
+
+def test_shared_between_databases(shared_db) :
+    # A second Database object has its own private cache, but shares the tier.
+    db2 = Database.open(shared_db.db_path)
+    table = db2.table("test")
+    assert [x["id"] for x in table.index_scan("pk_id")] == list(range(200))
+    stats = db2.cache_stats
+    # Blocks that share a slot push each other out, so not quite all.
+    assert stats.shared_hits > 4 * stats.shared_misses
+
+    # Changes written by one are seen by the other.
+    shared_db.table("test").insert({"id" : 1000})
+    db3 = Database.open(shared_db.db_path)
+    assert list(db3.table("test").index_scan("pk_id", 1000, op="=")) == [{"id" : 1000}]
+
+def test_shared_between_processes(shared_db) :
+    script = (
+        "import sys; from gertrude import Database\n"
+        "db = Database.open(sys.argv[1])\n"
+        "assert len(list(db.table('test').index_scan('pk_id'))) == 200\n"
+        "print(db.cache_stats.shared_hits)\n"
+    )
+    out = subprocess.run([sys.executable, "-c", script, str(shared_db.db_path)],
+                         capture_output=True, text=True, check=True)
+    assert int(out.stdout.strip()) > 0
+    # The segment outlives a process that only attached to it.
+    db2 = Database.open(shared_db.db_path)
+    list(db2.table("test").index_scan("pk_id"))
+    assert db2.cache_stats.shared_hits > 0
@@ -0,0 +1,131 @@
+from gertrude import Database, cspec
+import pytest
+import random
+import threading
+
+
+def _check_tree(index) :
+    """Every node within fanout, every separator in order."""
+    for level in index._levels()[:-1] :
+        for node in level :
+            assert 2 <= len(node.d) < index.fanout or node.n == 0
+    keys = [x.key for x in index._levels()[-1] for x in x.d]
+    assert all(a <= b for a, b in zip(keys, keys[1:]))
+
+@pytest.mark.parametrize("count", [0, 1, 5, 200, 1500])
+def test_bulk_load(tmp_path, count) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("grp", "int")])
+    rows = [{"id" : i, "grp" : random.randint(0, count * 2)} for i in range(count)]
+    for r in rows :
+        table.insert(r)
+
+    index = table.add_index("grp_idx", "grp")
+    _check_tree(index)
+
+    stats = index.stats()
+    assert stats.kind == "btree"
+    assert stats.entries == count
+    assert stats.nodes[0] == 1
+    assert len(stats.nodes) == stats.height
+    if count > 1000 :
+        # Internal nodes honour the fanout, so the tree has to be deeper.
+        assert stats.height >= 4
+        # Runs of duplicates can push a leaf a little over.
+        assert 0.6 < stats.fill < 0.9
+    assert stats.orphan_bytes == 0
+    assert stats.bytes > 0
+
+    assert sorted(x["id"] for x in table.index_scan("grp_idx")) == list(range(count))
+
+def test_reorganize(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("name", "str")])
+    table.add_index("name_idx", "name", bloom=True)
+
+    rows = [{"id" : i, "name" : f"name{random.randint(0, 5000):05d}"} for i in range(500)]
+    random.shuffle(rows)
+    for r in rows :
+        table.insert(r)
+    for r in rows[::2] :
+        table.delete(r)
+    rows = rows[1::2]
+
+    index = table.index("name_idx")
+    before = index.stats()
+    assert before.entries == len(rows)
+    assert before.key_bytes["max"] == len("name00000") + 1
+
+    # A stray node file is picked up as orphaned space.
+    (index.path / "999999").write_bytes(b"x" * 100)
+    assert index.stats().orphan_bytes == 100
+
+    after = table.reorganize_index("name_idx")
+    assert after.entries == len(rows)
+    assert after.fill > before.fill
+    assert sum(after.nodes) < sum(before.nodes)
+    assert after.orphan_bytes == 0
+    assert not (index.path / "999999").exists()
+    _check_tree(index)
+
+    expected = sorted(rows, key=lambda x : (x["name"], x["id"]))
+    assert sorted(table.index_scan("name_idx"), key=lambda x : (x["name"], x["id"])) == expected
+    for r in rows[:20] :
+        assert r in list(table.index_scan("name_idx", r["name"], op="="))
+
+    # Still works as normal afterwards, and after reopening.
+    table.insert({"id" : 99999, "name" : "zzz"})
+    db2 = Database.open(db.db_path)
+    assert [x["id"] for x in db2.table("test").index_scan("name_idx", "zzz", op="=")] == [99999]
+
+def test_reorganize_with_scans(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "int", pk=True)])
+    for i in range(300) :
+        table.insert({"id" : i})
+
+    # A scan part way through holds the tree - reorganize gives up.
+    scan = table.index_scan("pk_id")
+    assert [next(scan)["id"] for _ in range(10)] == list(range(10))
+    with pytest.raises(ValueError) :
+        table.reorganize_index("pk_id", timeout=0.1)
+    assert [x["id"] for x in scan] == list(range(10, 300))
+
+    # ... or waits for it to finish.
+    scan = table.index_scan("pk_id")
+    first = [next(scan)["id"] for _ in range(10)]
+    done = threading.Event()
+    def reorganize() :
+        table.reorganize_index("pk_id")
+        done.set()
+    thread = threading.Thread(target=reorganize)
+    thread.start()
+    assert not done.wait(0.2)
+    assert first + [x["id"] for x in scan] == list(range(300))
+    thread.join(10)
+    assert done.is_set()
+    assert [x["id"] for x in table.index_scan("pk_id")] == list(range(300))
+
+def test_hash_stats(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "int", pk=True)])
+    for i in range(500) :
+        table.insert({"id" : i})
+    index = table.add_index("id_hash", "id", kind="hash")
+
+    stats = index.stats()
+    assert stats.kind == "hash"
+    assert stats.height == 2
+    assert stats.entries == 500
+    assert stats.nodes[1] >= 500 // 6
+    assert stats.orphan_bytes == 0
+
+    with pytest.raises(ValueError) :
+        index.reorganize()
+    with pytest.raises(ValueError) :
+        table.reorganize_index("id_hash")
+
+    table.add_index("id_bm", "id", kind="bitmap")
+    for call in [table.index("id_bm").stats, table.index("id_bm").reorganize, lambda : table.reorganize_index("id_bm")] :
+        with pytest.raises(ValueError) :
+            call()
@@ -0,0 +1,76 @@
+from gertrude import Database, cspec
+from gertrude.lib import packer
+from gertrude.lib.shared_cache import read_block
+from gertrude.lib.types.index import (
+    InternalItem, LeafItem, NodeEntries, make_internal, make_leaf, node_from_dict, node_to_dict
+    )
+from gertrude.lib.types.value import Value
+import random
+
+
+def _item(i : int, heap_id : int) -> LeafItem :
+    return LeafItem(Value("int", i), heap_id)
+
+def test_node_entries() :
+    items = [_item(i, 1000 + i) for i in range(10)]
+    d = NodeEntries.of(LeafItem, items)
+    assert len(d) == 10
+    assert list(d) == items
+    assert d[3] == items[3]
+    assert d.key(3) == items[3].key
+    assert d.ids[3] == 1003
+
+    # slices are entries too, so a split stays compact.
+    left, right = d[:4], d[4:]
+    assert isinstance(left, NodeEntries) and left + right == d
+
+    d.insert(2, _item(1, 7))
+    del d[0]
+    d[-1] = _item(99, 5)
+    assert [x.heap_id for x in d] == [1001, 7, 1002, 1003, 1004, 1005, 1006, 1007, 1008, 5]
+
+    # Anything assigned to a node is converted.
+    leaf = make_leaf(3, items)
+    assert isinstance(leaf.d, NodeEntries)
+    leaf.d = items[:2]
+    assert isinstance(leaf.d, NodeEntries) and list(leaf.d) == items[:2]
+
+def test_node_round_trip() :
+    items = [_item(i, random.getrandbits(64)) for i in range(80)]
+    leaf = make_leaf(12, items)
+    raw = packer.pack(node_to_dict(leaf))
+    back = node_from_dict(packer.unpack(raw))
+    assert back == leaf
+    assert list(back.d) == items
+
+    internal = make_internal(0, [InternalItem(Value("int", None), 4), InternalItem(Value("int", 5), 9)])
+    assert node_from_dict(packer.unpack(packer.pack(node_to_dict(internal)))) == internal
+
+    # Smaller than an ext type per item.
+    old = packer.pack({"k" : leaf.k, "n" : leaf.n, "d" : items})
+    assert len(raw) < len(old)
+    # ... and those still load.
+    assert node_from_dict(packer.unpack(old)) == leaf
+
+def test_old_node_files(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("grp", "int")])
+    rows = [{"id" : i, "grp" : random.randint(0, 50)} for i in range(200)]
+    for r in rows :
+        table.insert(r)
+    table.add_index("grp_idx", "grp")
+
+    # Rewrite every node the way they used to be written.
+    index = table.index("grp_idx")
+    for path in index.path.iterdir() :
+        if path.name.isdigit() :
+            node = node_from_dict(packer.unpack(read_block(path)[1]))
+            path.write_bytes(packer.pack({"k" : node.k, "n" : node.n, "d" : list(node.d)}))
+
+    db2 = Database.open(db.db_path)
+    table2 = db2.table("test")
+    found = list(table2.index_scan("grp_idx", 10, op=">="))
+    assert sorted(x["id"] for x in found) == sorted(r["id"] for r in rows if r["grp"] >= 10)
+
+    table2.insert({"id" : 500, "grp" : 10})
+    assert 500 in [x["id"] for x in table2.index_scan("grp_idx", 10, op="=")]
@@ -0,0 +1,70 @@
+from gertrude import Database, cspec
+import pytest
+import random
+
+
+def _check_tree(index) :
+    keys = [x.key for x in index._levels()[-1] for x in x.d]
+    assert all(a <= b for a, b in zip(keys, keys[1:]))
+
+def test_append_fill(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=20)
+    table = db.add_table("events", [cspec("id", "int", pk=True), cspec("ts", "int"), cspec("grp", "int")])
+    table.add_index("ts_idx", "ts")
+    table.add_index("grp_idx", "grp")
+
+    for i in range(1000) :
+        table.insert({"id" : i, "ts" : 5000 + i // 3, "grp" : random.randint(0, 1000)})
+
+    ts = table.index("ts_idx").stats()
+    grp = table.index("grp_idx").stats()
+    # Appends leave the leaves nearly full, random keys about 3/4.
+    assert ts.fill > 0.85
+    assert grp.fill < 0.8
+    assert sum(ts.nodes) < sum(grp.nodes)
+    _check_tree(table.index("ts_idx"))
+    _check_tree(table.index("pk_id"))
+
+    found = list(table.index_scan("ts_idx", 5100, op=">=", upper_key=5110, upper_op="<"))
+    assert sorted(x["id"] for x in found) == list(range(300, 330))
+
+def test_append_path(tmp_path, monkeypatch) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("events", [cspec("id", "int", pk=True)])
+    index = table.index("pk_id")
+
+    for i in range(0, 200, 2) :
+        table.insert({"id" : i})
+
+    # Appends no longer search from the root.
+    searches = 0
+    real_find = index._find_block2
+    def counting_find(*args, **kwargs) :
+        nonlocal searches
+        searches += 1
+        return real_find(*args, **kwargs)
+    monkeypatch.setattr(index, "_find_block2", counting_find)
+
+    for i in range(200, 300, 2) :
+        table.insert({"id" : i})
+    assert searches == 0
+
+    # Still caught as duplicates, out of order keys still go in.
+    with pytest.raises(ValueError) :
+        table.insert({"id" : 298})
+    table.insert({"id" : 51})
+    table.insert({"id" : 300})
+    assert searches > 0
+
+    expected = list(range(0, 300, 2)) + [51, 300]
+    assert [x["id"] for x in table.index_scan("pk_id")] == sorted(expected)
+    _check_tree(index)
+
+    # A stale path after deletes and a reorganize is just a miss.
+    for i in range(150, 300, 2) :
+        table.delete({"id" : i})
+    table.reorganize_index("pk_id")
+    table.insert({"id" : 1000})
+    table.insert({"id" : 1001})
+    expected = [x for x in expected if x < 150 or x >= 300] + [1000, 1001]
+    assert [x["id"] for x in table.index_scan("pk_id")] == sorted(expected)
@@ -0,0 +1,57 @@
+from gertrude import Database, cspec
+import pytest
+import random
+
+
+@pytest.fixture(scope="function")
+def setup_table(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("code", "str"), cspec("grp", "int")])
+    table.add_index("code_idx", "code", unique=True)
+    table.add_index("grp_hash", "grp", kind="hash")
+
+    ids = list(range(0, 400, 2))
+    random.shuffle(ids)
+    for i in ids :
+        table.insert({"id" : i, "code" : f"c{i}", "grp" : i % 7})
+
+    yield db, table
+
+def test_single_descent(setup_table, monkeypatch) :
+    db, table = setup_table
+
+    index = table.index("pk_id")
+    searches = 0
+    real_find = index._find_block2
+    def counting_find(*args, **kwargs) :
+        nonlocal searches
+        # It calls itself for each level below the root.
+        if kwargs.get("parent") is None :
+            searches += 1
+        return real_find(*args, **kwargs)
+    monkeypatch.setattr(index, "_find_block2", counting_find)
+
+    table.insert({"id" : 101, "code" : "c101", "grp" : 3})
+    assert searches == 1
+
+    assert [x["id"] for x in table.index_scan("pk_id", 101, op="=")] == [101]
+    assert [x["id"] for x in table.index_scan("code_idx", "c101", op="=")] == [101]
+
+def test_all_or_nothing(setup_table) :
+    db, table = setup_table
+
+    # pk is fine, but code is taken - nothing may change.
+    with pytest.raises(ValueError) :
+        table.insert({"id" : 1001, "code" : "c10", "grp" : 1})
+    assert list(table.index_scan("pk_id", 1001, op="=")) == []
+    assert 1001 not in [x["id"] for x in table.index_scan("grp_hash", 1, op="=")]
+    assert len(list(table.scan())) == 200
+
+    with pytest.raises(ValueError) :
+        table.insert({"id" : 10, "code" : "new", "grp" : 1})
+    assert list(table.index_scan("code_idx", "new", op="=")) == []
+
+    table.insert({"id" : 1001, "code" : "new", "grp" : 1})
+    for name, key in [("pk_id", 1001), ("code_idx", "new")] :
+        assert [x["id"] for x in table.index_scan(name, key, op="=")] == [1001]
+    assert 1001 in [x["id"] for x in table.index_scan("grp_hash", 1, op="=")]
@@ -0,0 +1,114 @@
+from gertrude import Database, cspec
+from gertrude.lib import heap
+from multiprocessing import shared_memory
+import gc
+import pytest
+import random
+
+
+def _make_db(tmp_path, **kwargs) :
+    db = Database.create(tmp_path / "db", index_fanout=6, **kwargs)
+    table = db.add_table("test", [cspec("id", "int", pk=True), cspec("grp", "int")])
+    rows = [{"id" : i, "grp" : random.randint(0, 100)} for i in range(600)]
+    for r in rows :
+        table.insert(r)
+    table.add_index("grp_idx", "grp")
+    # Start cold.
+    return Database.open(db.db_path), rows
+
+def test_readahead(tmp_path, monkeypatch) :
+    db, rows = _make_db(tmp_path)
+
+    hinted = []
+    real_prefetch = heap.prefetch
+    def recording_prefetch(path, ids) :
+        ids = list(ids)
+        hinted.extend(ids)
+        real_prefetch(path, ids)
+    monkeypatch.setattr(heap, "prefetch", recording_prefetch)
+
+    table = db.table("test")
+    found = list(table.index_scan("grp_idx", 20, op=">=", upper_key=80, upper_op="<"))
+    assert sorted(x["id"] for x in found) == sorted(r["id"] for r in rows if 20 <= r["grp"] < 80)
+    assert [x["grp"] for x in found] == sorted(x["grp"] for x in found)
+
+    db.db_ctx.io_pool().shutdown(wait=True)
+    assert db.cache_stats.prefetches > 0
+    # The rows of the leaves loaded ahead were hinted too.
+    assert len(hinted) > 0
+    assert set(hinted) <= set(table._heap_ids())
+
+def test_readahead_off(tmp_path) :
+    db, rows = _make_db(tmp_path, scan_readahead=0)
+
+    found = list(db.table("test").index_scan("grp_idx"))
+    assert len(found) == len(rows)
+    assert db.cache_stats.prefetches == 0
+
+def test_prefetch_gone(tmp_path) :
+    db, rows = _make_db(tmp_path)
+    index = db.table("test").index("grp_idx")
+
+    # Blocks or indexes that have gone away are skipped.
+    assert db.db_ctx.cache.prefetch(index.id, 999999) is None
+    assert db.db_ctx.cache.prefetch(-1, 1) is None
+    heap.prefetch(db.db_path / "tables" / "test" / "data", [12345])
+
+def test_batched_fetch(tmp_path, monkeypatch) :
+    db, rows = _make_db(tmp_path, io_threads=1, fetch_batch=16)
+    table = db.table("test")
+
+    reads = []
+    real_read = heap.read
+    def recording_read(path, heap_id) :
+        reads.append(heap_id)
+        return real_read(path, heap_id)
+    monkeypatch.setattr(heap, "read", recording_read)
+
+    ids = list(table._heap_ids())
+    random.shuffle(ids)
+    wanted = ids[:100] + ids[:3]
+    expected = [table._unwrap(table._row_from_storage(real_read(table.db_path / "data", x))) for x in wanted]
+    assert list(table.fetch_rows(wanted)) == expected
+
+    # Batches of 1, 2, 4, 8 then 16, each read in heap order.
+    start = 0
+    for size in [1, 2, 4, 8] + [16] * 6 :
+        batch = wanted[start:start+size]
+        assert reads[:len(set(batch))] == sorted(set(batch))
+        reads = reads[len(set(batch)):]
+        start += size
+    assert reads == []
+
+def test_close(tmp_path) :
+    db = Database.create(tmp_path / "db", index_fanout=6, index_shared_cache_bytes=1 << 20)
+    table = db.add_table("test", [cspec("id", "int", pk=True)])
+    for i in range(200) :
+        table.insert({"id" : i})
+    assert len(list(table.index_scan("pk_id"))) == 200
+    pool = db.db_ctx.io_pool()
+    shared = db.db_ctx.cache.shared
+
+    # The process that made the segment removes it.
+    other = Database.open(db.db_path)
+    db.close()
+    assert all(not t.is_alive() for t in pool._threads)
+    assert db.db_ctx.cache.shared is None
+    with pytest.raises(FileNotFoundError) :
+        shared_memory.SharedMemory(name=shared.name)
+    # Others attached keep working.
+    assert len(list(other.table("test").index_scan("pk_id"))) == 200
+    other.close()
+
+    with Database.open(db.db_path) as db2 :
+        list(db2.table("test").index_scan("pk_id"))
+
+    # Without close(), the threads stop once the database is gone.
+    db3 = Database.open(db.db_path)
+    list(db3.table("test").index_scan("pk_id"))
+    pool = db3.db_ctx.io_pool()
+    del db3
+    gc.collect()
+    for t in pool._threads :
+        t.join(5)
+        assert not t.is_alive()
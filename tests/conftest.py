@@ -0,0 +1,28 @@
+from gertrude import Database
+import pytest
+
+
+@pytest.fixture(scope="function")
+def make_table(tmp_path) :
+    """Returns a function that creates a database with one table "test"
+    and fills it with `rows`. The first `before` rows go in before the
+    `indexes` (name -> add_index arguments) are added, the rest after.
+    Returns (db, table, rows).
+    """
+    def make(columns, rows, indexes=None, before=None, **db_options) :
+        db_options.setdefault("index_fanout", 6)
+        db = Database.create(tmp_path / "db", **db_options)
+        table = db.add_table("test", columns)
+
+        if before is None :
+            before = len(rows)
+        for r in rows[:before] :
+            table.insert(r)
+        for name, args in (indexes or {}).items() :
+            table.add_index(name, **args)
+        for r in rows[before:] :
+            table.insert(r)
+
+        return db, table, rows
+
+    return make